@@ -4,39 +4,65 @@ import json
 import os
 import sys
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
 
 from openai import AsyncOpenAI
 from collector.runner import Runner
+from collector.convergence import CRITERIA, ConvergenceMonitor
+from collector.normalization import RULES, Normalizer, enabled_rules, normalization_config
+from collector.metrics import MetricsServer, RunMetrics, publish_metrics, write_metrics_file
+from collector.sweep import load_sweep
+from collector.backends import MockBackend, load_mock_corpus
+from collector.rate_control import AdaptiveLimiter, TokenBucket
 from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
 from collector.cache_manager import calculate_prompt_hash, find_latest_run
+from collector.run_log import RunLog
+from collector.snapshot import snapshot_path, save_snapshot, load_snapshot
+from collector.logprob_store import LogprobTable, logprobs_path
+from collector.file_io import COMPRESSION_SUFFIXES, compression_of, open_text
 from collector.serializer import (
     CollectorOutput, MetaInfo, ConfigInfo, RequestConfig, 
-    NormalizationConfig, GraphInfo, StatsInfo, Node, Edge, RunResult,
-    ErrorInfo, LogprobContent
+    GraphExportConfig, ConvergenceConfig, write_output_json
 )
+from collector.graph_export import export_graph
 
-async def main():
-    parser = argparse.ArgumentParser(description="LLM Stochastic Output Collector")
-    parser.add_argument("--prompt", type=str, required=True, help="Prompt to run")
-    parser.add_argument("--n", type=int, default=10, help="Number of repetitions")
-    parser.add_argument("--concurrency", type=int, default=5, help="Concurrency level")
-    parser.add_argument("--model", type=str, default="gpt-4.1-mini", help="Model name")
-    parser.add_argument("--out", type=str, help="Output JSON path")
-    parser.add_argument("--temp", type=float, default=1.0, help="Temperature")
-    parser.add_argument("--max_tokens", type=int, default=50, help="Max output tokens")
-    parser.add_argument("--debug", action="store_true", help="Enable debug mode (collect logprobs)")
-    parser.add_argument("--compress", action="store_true", help="Enable graph path compression (Radix Tree)")
-    
-    args = parser.parse_args()
-
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        print("Error: OPENAI_API_KEY environment variable is not set.")
-        sys.exit(1)
+def load_output_runs(path) -> Tuple[List[dict], int]:
+    """
+    出力ファイルから成功した run を読み込む（logprobs がサイドカーにあれば run に戻す）。
+    出力の id は出力内の位置なので、エラーの run も含めた件数（次の run の id）も一緒に返す。
+    """
+    with open_text(path) as f:
+        output_model = CollectorOutput(**json.load(f))
+    table = None
+    if output_model.meta.logprobs_file:
+        table = LogprobTable.load(path.parent / output_model.meta.logprobs_file)
+    runs = [
+        {**r.model_dump(), "logprobs": table.dicts(i)} if table is not None else r.model_dump()
+        for i, r in enumerate(output_model.runs) if r.status == "ok"
+    ]
+    return runs, len(output_model.runs)
 
-    client = AsyncOpenAI(api_key=api_key)
-    aggregator = Aggregator()
+async def collect(
+    args,
+    client: Optional[AsyncOpenAI],
+    backend: Optional[MockBackend],
+    limiter: Optional[AdaptiveLimiter],
+    request_bucket: Optional[TokenBucket],
+    token_bucket: Optional[TokenBucket],
+    semaphore: Optional[asyncio.Semaphore] = None,
+    progress_desc: str = "Collecting",
+    progress_position: Optional[int] = None,
+    metrics_server: Optional[MetricsServer] = None
+):
+    """
+    1つの設定（args の prompt / model / temp など）について収集・レジューム・保存を行う。
+    client / backend / limiter / バケット / semaphore / メトリクスサーバーは呼び出し側が用意し、スイープでは全設定で共有する。
+    """
+    aggregator_cls = {"object": Aggregator, "array": ArrayAggregator, "radix": RadixAggregator}[args.trie]
+    aggregator = aggregator_cls()
+    normalization = normalization_config(args.normalize)
 
     # ハッシュの計算
     config_dict = {
@@ -44,36 +70,222 @@ async def main():
         "prompt": args.prompt,
         "temp": args.temp,
         "max_tokens": args.max_tokens,
-        "debug": args.debug
+        "debug": args.debug,
+        # モックの結果が実 API の結果と混ざってレジュームされないよう区別する
+        "backend": "mock" if args.backend == "mock" else None,
+        # シャードは設定ごとに別ハッシュで保存・レジュームし、--merge-shards で統合する
+        "shard": f"{args.shard[0]}/{args.shard[1]}" if args.shard else None,
+        # 正規化した結果は正規化しない結果と混ぜない（規則が違えば別ハッシュ）
+        "normalization": ",".join(enabled_rules(normalization)) or None
     }
     prompt_hash = calculate_prompt_hash(config_dict)
+    # シャードは n を分担する（端数は先頭のシャードから1件ずつ）
+    goal_n = args.n
+    if args.shard:
+        index, count = args.shard
+        goal_n = args.n // count + (1 if index < args.n % count else 0)
     
     # 既存ファイルの検索とロード
     out_dir = "out"
-    existing_file = find_latest_run(out_dir, prompt_hash)
+    # シャードを統合するときは、統合先の既存の出力ではなく各シャードの出力から作り直す
+    existing_file = None if args.merge_shards else find_latest_run(out_dir, prompt_hash)
     existing_runs = []
+    # existing_count は成功した run の数（残りの必要回数に使う）、next_id は次に記録する run の id（エラーの run も数える）
+    existing_count = 0
+    next_id = 0
+    run_log = RunLog.for_hash(out_dir, prompt_hash) if args.stream else None
+    snapshot_file = snapshot_path(out_dir, prompt_hash)
+    snapshot = load_snapshot(snapshot_file, aggregator_cls) if (run_log and run_log.exists()) or existing_file else None
     
-    if existing_file:
+    if args.merge_shards:
+        # 各シャードの最新の出力をシャード順に連結し、Trie はシャードごとの集計をマージする
+        # （シャード0 から順に全テキストを1プロセスで挿入した場合とグラフ・統計が一致する）
+        for index in range(args.merge_shards):
+            shard_hash = calculate_prompt_hash({**config_dict, "shard": f"{index}/{args.merge_shards}"})
+            shard_file = find_latest_run(out_dir, shard_hash)
+            if not shard_file:
+                print(f"Warning: No output found for shard {index}/{args.merge_shards} ({shard_hash}). Skipping.")
+                continue
+            shard_runs, _ = load_output_runs(shard_file)
+            shard_snapshot = load_snapshot(snapshot_path(out_dir, shard_hash), aggregator_cls)
+            if shard_snapshot and shard_snapshot[1].get("source") == shard_file.name and shard_snapshot[1]["ok_runs"] == len(shard_runs):
+                shard_aggregator = shard_snapshot[0]
+            else:
+                shard_aggregator = aggregator_cls()
+                shard_aggregator.load_from_runs(shard_runs)
+            aggregator.merge(shard_aggregator)
+            existing_runs.extend({**r, "id": len(existing_runs) + i} for i, r in enumerate(shard_runs))
+            print(f"Merged shard {index}/{args.merge_shards}: {shard_file} ({len(shard_runs)} runs)")
+        existing_count = len(existing_runs)
+        next_id = len(existing_runs)
+    elif run_log and run_log.exists():
+        # ランログがあれば、巨大なJSONを読まずに1行ずつ再生する
+        # スナップショットがあればTrieを直接復元し、それより後に追記された run だけを再生する
+        print(f"Existing run log found: {run_log.path}. Resuming...")
+        start = 0
+        info = snapshot[1] if snapshot else {}
+        if info.get("log_offset") is not None and info.get("next_id") is not None and info["log_offset"] <= run_log.offset():
+            aggregator = snapshot[0]
+            start = info["log_offset"]
+            existing_count = info["ok_runs"]
+            next_id = info["next_id"]
+            print(f"Loaded trie snapshot: {snapshot_file} ({existing_count} runs)")
+        newer_runs = []
+        for r in run_log.replay(start):
+            # 完了順に追記されるので、ログの id は順不同。次の id は最大値の次にする
+            next_id = max(next_id, r.get("id", -1) + 1)
+            if r.get("status") == "ok":
+                newer_runs.append(r)
+        aggregator.load_from_runs(newer_runs)
+        existing_count += len(newer_runs)
+        print(f"Loaded {existing_count} successful runs.")
+    elif existing_file:
         print(f"Existing run found: {existing_file}. Resuming...")
         try:
-            with open(existing_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                output_model = CollectorOutput(**data)
-                existing_runs = [r.model_dump() for r in output_model.runs if r.status == "ok"]
+            # logprobs がサイドカーにある場合は、次の保存で引き継げるよう run に戻される
+            existing_runs, next_id = load_output_runs(existing_file)
+            # 同じ出力ファイルから作られたスナップショットがあれば、Trie の再構築を省く
+            if snapshot and snapshot[1].get("source") == existing_file.name and snapshot[1]["ok_runs"] == len(existing_runs):
+                aggregator = snapshot[0]
+                print(f"Loaded trie snapshot: {snapshot_file}")
+            else:
                 aggregator.load_from_runs(existing_runs)
-                print(f"Loaded {len(existing_runs)} successful runs.")
+            print(f"Loaded {len(existing_runs)} successful runs.")
         except Exception as e:
             print(f"Warning: Failed to load existing file: {e}. Starting fresh.")
+        existing_count = len(existing_runs)
+        
+        # 以降はランログだけで再開できるよう、既存の結果をログへ移す
+        if run_log and existing_runs:
+            with run_log:
+                # id は出力内の位置のまま（どれも next_id より小さい）。logprobs はランログに残さない
+                for r in existing_runs:
+                    run_log.append({**r, "logprobs": None})
+            existing_runs = []
+
+    graph_config = GraphExportConfig(
+        min_count=args.graph_min_count,
+        min_p=args.graph_min_p,
+        top_k=args.graph_top_k,
+        max_depth=args.graph_max_depth
+    )
+
+    # 収束による早期終了（--n は上限になる）。既存の回答も数えてから判定を始める
+    monitor = None
+    if args.converge:
+        monitor = ConvergenceMonitor(ConvergenceConfig(
+            criteria=args.converge,
+            tolerance=args.converge_tol,
+            relative_tolerance=args.converge_rel_tol,
+            confidence=args.converge_confidence,
+            interval=args.converge_interval,
+            min_samples=args.converge_min_n,
+            patience=args.converge_patience,
+            top_k=args.converge_top_k,
+            branch=args.converge_branch
+        ), aggregator)
+        if run_log and run_log.exists():
+            # ランログを頭から読み直さず、復元済みの Trie から数える
+            monitor.prime_from_trie(existing_count)
+        else:
+            monitor.prime(r.get("text", "") for r in existing_runs if r.get("status") == "ok")
+
+    # 実行時メトリクス（要約は meta.metrics に、--metrics なら out/metrics-{hash}.json にも定期的に書く）
+    metrics = RunMetrics()
+    metrics_file = os.path.join(out_dir, f"metrics-{prompt_hash}.json") if args.metrics else None
+    if metrics_server:
+        metrics_server.register(prompt_hash[:12], metrics)
 
     # 必要回数の計算
-    needed_n = max(0, args.n - len(existing_runs))
-    
+    needed_n = max(0, goal_n - existing_count)
+
+    def save_output(all_runs, is_checkpoint=False):
+        """
+        all_runs（リスト、またはランログの replay のようなイテレータ）を1回だけ走査しながら出力を書く。
+        ノード・エッジ・run はモデルを作らずに1件ずつ書き出す（write_output_json）。
+        """
+        # 集計（枝刈りしない場合はノード・エッジをイテレータのまま書き出す）
+        nodes_data, edges_data = export_graph(aggregator, args.compress, graph_config)
+            
+        trie_stats = aggregator.calculate_stats()
+        
+        current_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        fname = f"checkpoint-{current_id}-{prompt_hash}.json" if is_checkpoint else f"run-{current_id}-{prompt_hash}.json"
+        fname += COMPRESSION_SUFFIXES.get(args.output_compression, "")
+        final_path = args.out or os.path.join(out_dir, fname)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        
+        # logprobs は JSON に埋め込まず、列指向のバイナリとして隣に保存する
+        table = LogprobTable() if args.debug else None
+        sidecar = logprobs_path(final_path)
+
+        def runs():
+            for r in all_runs:
+                if table is not None:
+                    table.append(r.get("logprobs"))
+                    r = {**r, "logprobs": None}
+                yield r
+        
+        meta = MetaInfo(
+            run_id=current_id,
+            library={"python": sys.version.split()[0], "openai": "v2"},
+            host={"os": sys.platform},
+            notes="Checkpoint" if is_checkpoint else None,
+            concurrency=limiter.summary() if limiter else None,
+            logprobs_file=sidecar.name if table is not None else None,
+            metrics=metrics.to_dict()
+        )
+        config = ConfigInfo(
+            model=args.model,
+            prompt=args.prompt,
+            n=goal_n,
+            concurrency=args.max_concurrency if limiter else args.concurrency,
+            request=RequestConfig(
+                max_output_tokens=args.max_tokens,
+                temperature=args.temp,
+                store=False,
+                choices_per_request=args.choices_per_request,
+                stream=args.stream_responses
+            ),
+            normalization=normalization,
+            graph=None if graph_config.is_noop() else graph_config
+        )
+        
+        # 書き込み途中で中断しても、壊れたファイルがレジューム対象にならないよう置き換えで確定する
+        tmp_path = final_path + ".tmp"
+        # 圧縮形式は最終的なファイル名の拡張子で決まる（--out 指定時はその拡張子に従う）
+        with metrics.timer("serializer"), open_text(tmp_path, "w", compression=compression_of(final_path)) as f:
+            write_output_json(
+                f, meta, config, runs(), nodes_data, edges_data, trie_stats["depth_stats"],
+                convergence=monitor.summary() if monitor else None
+            )
+        if table is not None:
+            table.save(sidecar)
+        os.replace(tmp_path, final_path)
+        return final_path
+
     if needed_n == 0:
-        print(f"Already have {len(existing_runs)} runs. No more runs needed.")
-        raw_results = []
+        print(f"Already have {existing_count} runs. No more runs needed.")
+        raw_results = existing_runs
     else:
         def on_result(text, result):
-            aggregator.add_text(text)
+            with metrics.timer("aggregator"):
+                aggregator.add_text(text)
+            if monitor:
+                monitor.observe(text)
+        
+        logged_ok = existing_count
+        logged_next_id = next_id
+        # ストリーミング時は、受信中の文字も反映した表示用の深さ別統計（確定した Trie の統計の複製から始める）
+        live_stats = aggregator.depth_stats.copy() if args.stream_responses else None
+
+        def progress_postfix():
+            # 深さ別統計は挿入時に更新済みなので O(max_depth) で取得できる
+            depth_stats = live_stats if live_stats is not None else aggregator.depth_stats
+            if depth_stats.max_depth == 0:
+                return {}
+            entropies = [depth_stats.entropy(d) for d in range(depth_stats.max_depth)]
+            return {"depth": depth_stats.max_depth, "max_H": f"{max(entropies):.2f}"}
 
         request_params = {
             "temperature": args.temp,
@@ -85,71 +297,29 @@ async def main():
             request_params["logprobs"] = True
             request_params["top_logprobs"] = 5
 
-        def save_output(all_runs, is_checkpoint=False):
-            # 集計
-            if args.compress:
-                nodes_data, edges_data = aggregator.get_compressed_graph_data()
-            else:
-                nodes_data, edges_data = aggregator.get_graph_data()
-                
-            trie_stats = aggregator.calculate_stats()
-            
-            ok_count = sum(1 for r in all_runs if r.get("status") == "ok")
-            error_count = len(all_runs) - ok_count
-            
-            output = CollectorOutput(
-                meta=MetaInfo(
-                    run_id=datetime.now().strftime("%Y%m%d-%H%M%S"),
-                    library={"python": sys.version.split()[0], "openai": "v2"},
-                    host={"os": sys.platform},
-                    notes="Checkpoint" if is_checkpoint else None
-                ),
-                config=ConfigInfo(
-                    model=args.model,
-                    prompt=args.prompt,
-                    n=args.n,
-                    concurrency=args.concurrency,
-                    request=RequestConfig(
-                        max_output_tokens=args.max_tokens,
-                        temperature=args.temp,
-                        store=False
-                    ),
-                    normalization=NormalizationConfig(enabled=False)
-                ),
-                runs=[
-                    RunResult(
-                        id=i,  # 全体で一意なIDに振り直し
-                        text=r.get("text", ""),
-                        status=r.get("status", "ok"),
-                        error=ErrorInfo(**r["error"]) if r.get("error") else None,
-                        usage=r.get("usage"),
-                        logprobs=r.get("logprobs")
-                    ) for i, r in enumerate(all_runs)
-                ],
-                graph=GraphInfo(
-                    nodes=[Node(**n) for n in nodes_data],
-                    edges=[Edge(**e) for e in edges_data]
-                ),
-                stats=StatsInfo(
-                    totals={
-                        "ok": ok_count, 
-                        "error": error_count, 
-                        "total_chars": sum(len(r.get("text", "")) for r in all_runs)
-                    },
-                    depth_stats=trie_stats["depth_stats"]
-                )
-            )
-            
-            current_id = output.meta.run_id
-            fname = f"checkpoint-{current_id}-{prompt_hash}.json" if is_checkpoint else f"run-{current_id}-{prompt_hash}.json"
-            final_path = args.out or os.path.join(out_dir, fname)
-            os.makedirs(os.path.dirname(final_path), exist_ok=True)
-            
-            with open(final_path, "w", encoding="utf-8") as f:
-                f.write(output.model_dump_json(indent=2, by_alias=True))
-            return final_path
+        def on_complete(result):
+            # ログへの追記と同じタイミングでTrieへ反映し、スナップショットとログの位置を一致させる
+            nonlocal logged_ok, logged_next_id
+            # ランナーの id は今回の実行の中での連番なので、既存の記録（エラーの run も含む）の後ろへずらす
+            run_id = next_id + result["id"]
+            logged_next_id = max(logged_next_id, run_id + 1)
+            with metrics.timer("run_log"):
+                run_log.append({**result, "id": run_id})
+            if result.get("status") == "ok":
+                with metrics.timer("aggregator"):
+                    aggregator.add_text(result["text"])
+                logged_ok += 1
+                if monitor:
+                    monitor.observe(result["text"])
 
         def on_checkpoint(current_new_runs):
+            if run_log:
+                # 結果はログに追記済みなので、ディスクへ確定させるだけでよい
+                run_log.flush(sync=True)
+                with metrics.timer("snapshot"):
+                    save_snapshot(aggregator, snapshot_file, {"ok_runs": logged_ok, "log_offset": run_log.offset(), "next_id": logged_next_id})
+                print(f" Run log synced: {run_log.path} ({logged_ok} runs)")
+                return
             combined = existing_runs + current_new_runs
             path = save_output(combined, is_checkpoint=True)
             print(f" Checkpoint saved to {path}")
@@ -159,23 +329,219 @@ async def main():
             model=args.model,
             prompt=args.prompt,
             n=needed_n,
-            concurrency=args.concurrency,
+            concurrency=args.max_concurrency if limiter else args.concurrency,
             request_params=request_params,
-            on_result=on_result,
-            on_checkpoint=on_checkpoint if args.n >= 1000 else None,
-            checkpoint_interval=max(1, needed_n // 5) # 20%ごとに保存
+            on_result=None if run_log else on_result,
+            on_checkpoint=on_checkpoint,
+            # 20%ごとに保存（小規模な実行では中断時のみ保存）
+            checkpoint_interval=max(1, needed_n // 5) if goal_n >= 1000 else None,
+            progress_postfix=progress_postfix,
+            on_complete=on_complete if run_log else None,
+            limiter=limiter,
+            request_bucket=request_bucket,
+            token_bucket=token_bucket,
+            choices_per_request=args.choices_per_request,
+            backend=backend,
+            semaphore=semaphore,
+            progress_desc=progress_desc,
+            progress_position=progress_position,
+            should_stop=monitor.should_stop if monitor else None,
+            metrics=metrics,
+            stream_responses=args.stream_responses,
+            live_stats=live_stats,
+            normalize=Normalizer(normalization) if normalization.enabled else None,
+            # ランログに書き出す場合は結果を溜めない（出力はログから書く）
+            keep_results=run_log is None
         )
 
-        print(f"Starting collection: model={args.model}, total_goal={args.n}, existing={len(existing_runs)}, need={needed_n}")
-        new_results = await runner.run()
-        raw_results = existing_runs + new_results
+        prefix = f"{progress_desc} " if progress_position is not None else ""
+        print(f"{prefix}Starting collection: model={args.model}, temp={args.temp}, total_goal={goal_n}, existing={existing_count}, need={needed_n}")
+        publisher = asyncio.create_task(publish_metrics(metrics, metrics_file, args.metrics_interval))
+        try:
+            new_results = await runner.run()
+        finally:
+            publisher.cancel()
+            await asyncio.gather(publisher, return_exceptions=True)
+            if run_log:
+                run_log.flush(sync=True)
+                save_snapshot(aggregator, snapshot_file, {"ok_runs": logged_ok, "log_offset": run_log.offset(), "next_id": logged_next_id})
+                run_log.close()
+        if not run_log:
+            raw_results = existing_runs + new_results
+        if monitor and monitor.converged:
+            print(f"{prefix}Converged after {monitor.converged_at} successful runs; stopped early ({monitor.n} collected in total, goal {goal_n}).")
 
     # 最終保存
     if needed_n > 0 or not existing_file:
+        if run_log:
+            # ランログモードでは全件がログにあるので、1行ずつ読みながら出力を書き出す
+            raw_results = run_log.replay()
         final_path = save_output(raw_results, is_checkpoint=False)
+        if not run_log:
+            with metrics.timer("snapshot"):
+                save_snapshot(aggregator, snapshot_file, {
+                    "ok_runs": sum(1 for r in raw_results if r.get("status") == "ok"),
+                    "source": os.path.basename(final_path)
+                })
         print(f"Done. Output saved to {final_path}")
     else:
         print(f"Existing results are up-to-date: {existing_file}")
+    if metrics_file:
+        write_metrics_file(metrics_file, metrics)
+
+async def run_configs(args, client, backend, limiter, request_bucket, token_bucket, metrics_server):
+    """単一の設定、または --sweep の全設定を収集する"""
+    if not args.sweep:
+        await collect(args, client, backend, limiter, request_bucket, token_bucket, metrics_server=metrics_server)
+        return
+
+    try:
+        configs = load_sweep(args.sweep, args)
+    except (OSError, ValueError) as e:
+        print(f"Error: invalid sweep spec {args.sweep}: {e}")
+        sys.exit(1)
+    # 全設定で1つの同時実行枠を共有する。asyncio.Semaphore は待機順に枠を渡すので、
+    # 各設定のワーカーが交互に枠を得て、設定間で公平に進む
+    semaphore = None if limiter else asyncio.Semaphore(args.concurrency)
+    print(f"Sweep: {len(configs)} configurations from {args.sweep}")
+    results = await asyncio.gather(*(
+        collect(
+            config, client, backend, limiter, request_bucket, token_bucket,
+            semaphore=semaphore, progress_desc=f"[{i + 1}/{len(configs)}]", progress_position=i,
+            metrics_server=metrics_server
+        )
+        for i, config in enumerate(configs)
+    ), return_exceptions=True)
+    for i, (config, result) in enumerate(zip(configs, results)):
+        if isinstance(result, BaseException):
+            print(f"[{i + 1}/{len(configs)}] failed (model={config.model}, temp={config.temp}): {result!r}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="LLM Stochastic Output Collector")
+    parser.add_argument("--prompt", type=str, help="Prompt to run (required unless --sweep)")
+    parser.add_argument("--sweep", type=str, help="Matrix spec JSON: run every prompt x model x temp configuration in one process")
+    parser.add_argument("--n", type=int, default=10, help="Number of repetitions")
+    parser.add_argument("--concurrency", type=str, default="5", help="Concurrency level (integer, or 'auto' for adaptive AIMD control)")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Upper bound for --concurrency auto")
+    parser.add_argument("--rpm", type=float, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=float, help="Tokens-per-minute budget")
+    parser.add_argument("--model", type=str, default="gpt-4.1-mini", help="Model name")
+    parser.add_argument("--out", type=str, help="Output JSON path")
+    parser.add_argument("--temp", type=float, default=1.0, help="Temperature")
+    parser.add_argument("--max_tokens", type=int, default=50, help="Max output tokens")
+    parser.add_argument("--choices-per-request", type=int, default=1, help="Samples requested per API call via the chat completions 'n' parameter")
+    parser.add_argument("--stream-responses", action="store_true", help="Use streaming completions: live per-depth stats update as characters arrive, and time-to-first-token is recorded per run")
+    parser.add_argument("--debug", action="store_true", help="Enable debug mode (collect logprobs; cannot be combined with --stream)")
+    parser.add_argument("--normalize", nargs="*", choices=RULES, metavar="RULE", help=f"Normalize texts before aggregation, keeping the original in raw_text (no RULE: nfkc punctuation whitespace strip; available: {', '.join(RULES)})")
+    parser.add_argument("--compress", action="store_true", help="Enable graph path compression (Radix Tree)")
+    graph = parser.add_argument_group("graph export")
+    graph.add_argument("--graph-min-count", type=int, default=1, help="Drop edges taken fewer times than this")
+    graph.add_argument("--graph-min-p", type=float, default=0.0, help="Drop edges whose branch probability is below this")
+    graph.add_argument("--graph-top-k", type=int, help="Keep at most this many children per node")
+    graph.add_argument("--graph-max-depth", type=int, help="Do not expand nodes at or beyond this depth")
+    converge = parser.add_argument_group("early stopping")
+    converge.add_argument("--converge", nargs="+", choices=CRITERIA, help="Stop before --n once all of these statistics converge (entropy: per-depth entropy, topk: top-k answer shares, rare: rate of --converge-branch)")
+    converge.add_argument("--converge-tol", type=float, default=0.01, help="entropy: max change in bits between checks / topk: max confidence-interval half-width")
+    converge.add_argument("--converge-rel-tol", type=float, default=0.25, help="rare: max confidence-interval half-width relative to the rate")
+    converge.add_argument("--converge-confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    converge.add_argument("--converge-interval", type=int, default=100, help="Check every this many successful runs")
+    converge.add_argument("--converge-min-n", type=int, default=500, help="Never stop before this many successful runs (also the minimum samples for a depth to be compared)")
+    converge.add_argument("--converge-patience", type=int, default=3, help="Consecutive converged checks required to stop")
+    converge.add_argument("--converge-top-k", type=int, default=5, help="topk: number of most frequent answers to track")
+    converge.add_argument("--converge-branch", type=str, help="rare: answer prefix whose rate is tracked")
+    observe = parser.add_argument_group("metrics")
+    observe.add_argument("--metrics", action="store_true", help="Periodically write runtime metrics to out/metrics-{hash}.json")
+    observe.add_argument("--metrics-interval", type=float, default=5.0, help="Seconds between metrics file updates")
+    observe.add_argument("--metrics-port", type=int, help="Serve Prometheus text-format metrics on http://127.0.0.1:PORT/metrics while collecting")
+    parser.add_argument("--stream", action="store_true", help="Append each run to out/runs-{hash}.jsonl instead of writing full checkpoint files")
+    parser.add_argument("--output-compression", choices=["none", *COMPRESSION_SUFFIXES], default="none", help="Write output/checkpoint files as .json.gz or .json.zst")
+    parser.add_argument("--trie", choices=["object", "array", "radix"], default="object", help="Trie backend (array: compact flat-array trie, radix: path-compressed on insert, best with --compress)")
+    parser.add_argument("--shard", type=str, help="Collect only shard I of K (as 'I/K', 0-based) of --n; shards are saved separately")
+    parser.add_argument("--merge-shards", type=int, metavar="K", help="Merge the outputs of shards 0..K-1 into one output (collecting any shortfall)")
+    parser.add_argument("--backend", choices=["openai", "mock"], default="openai", help="Completion backend (mock: local stand-in, no API key needed)")
+    mock = parser.add_argument_group("mock backend")
+    mock.add_argument("--mock-latency", type=float, default=0.5, help="Median latency in seconds")
+    mock.add_argument("--mock-latency-sigma", type=float, default=0.3, help="Log-normal sigma of the latency (0: constant)")
+    mock.add_argument("--mock-429-rate", type=float, default=0.0, help="Probability of an injected 429")
+    mock.add_argument("--mock-5xx-rate", type=float, default=0.0, help="Probability of an injected 500")
+    mock.add_argument("--mock-capacity", type=int, help="Return 429 when more requests than this are in flight")
+    mock.add_argument("--mock-corpus", type=str, help="classification_report.json to sample outputs from")
+    mock.add_argument("--mock-seed", type=int, help="Random seed")
+    
+    args = parser.parse_args()
+    if args.concurrency != "auto":
+        try:
+            args.concurrency = int(args.concurrency)
+        except ValueError:
+            parser.error("--concurrency must be an integer or 'auto'")
+    if args.choices_per_request < 1:
+        parser.error("--choices-per-request must be at least 1")
+    if not args.sweep and args.prompt is None:
+        parser.error("--prompt is required unless --sweep is given")
+    if args.shard:
+        try:
+            index, count = (int(x) for x in args.shard.split("/"))
+        except ValueError:
+            parser.error("--shard must be given as I/K (e.g. 0/4)")
+        if not 0 <= index < count:
+            parser.error("--shard index must satisfy 0 <= I < K")
+        args.shard = (index, count)
+    if args.merge_shards is not None:
+        if args.shard or args.stream or args.merge_shards < 1:
+            parser.error("--merge-shards needs K >= 1 and cannot be combined with --shard or --stream")
+    if args.debug and args.stream:
+        # ランログは run を1行ずつ残すためのもので、logprobs を入れると行が肥大化し、出力時に全件をメモリに載せることになる
+        parser.error("--debug cannot be combined with --stream (logprobs are not kept in the run log)")
+    if args.converge:
+        if "rare" in args.converge and args.converge_branch is None:
+            parser.error("--converge rare needs --converge-branch")
+        if args.converge_interval < 1 or args.converge_patience < 1 or not 0 < args.converge_confidence < 1:
+            parser.error("--converge-interval and --converge-patience must be at least 1, and --converge-confidence in (0, 1)")
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be positive")
+    if args.sweep and args.out:
+        parser.error("--out cannot be used with --sweep (each configuration is saved under its own hash)")
+
+    limiter = AdaptiveLimiter(max_limit=args.max_concurrency) if args.concurrency == "auto" else None
+    client = None
+    backend = None
+    if args.backend == "mock":
+        backend = MockBackend(
+            corpus=load_mock_corpus(args.mock_corpus) if args.mock_corpus else None,
+            latency=args.mock_latency,
+            latency_sigma=args.mock_latency_sigma,
+            rate_429=args.mock_429_rate,
+            rate_5xx=args.mock_5xx_rate,
+            capacity=args.mock_capacity,
+            seed=args.mock_seed
+        )
+    else:
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            print("Error: OPENAI_API_KEY environment variable is not set.")
+            sys.exit(1)
+        if limiter:
+            # 429 を自前で観測・再試行するため、SDK のリトライは無効にする
+            client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        else:
+            client = AsyncOpenAI(api_key=api_key)
+    request_bucket = TokenBucket(args.rpm) if args.rpm else None
+    token_bucket = TokenBucket(args.tpm) if args.tpm else None
+
+    metrics_server = MetricsServer(args.metrics_port) if args.metrics_port else None
+    if metrics_server:
+        await metrics_server.start()
+        print(f"Serving metrics on http://{metrics_server.host}:{metrics_server.port}/metrics")
+    try:
+        await run_configs(args, client, backend, limiter, request_bucket, token_bucket, metrics_server)
+    finally:
+        if metrics_server:
+            await metrics_server.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        # 完了分はチェックポイント（またはランログとスナップショット）に保存済みで、同じ引数で再開できる
+        print("Interrupted. Re-run with the same arguments to resume.")
+        sys.exit(130)
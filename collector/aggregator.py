@@ -1,4 +1,225 @@
-from typing import Dict, List, Optional, Tuple
+import heapq
+import math
+from array import array
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # query は graph_export・serializer（pydantic）を読み込むので、Trie 本体からは index() の中でだけ import する
+    from collector.query import TrieIndex
+
+TOP_CHARS = 5
+
+# 小さい回数の x·log2(x) は表引きにして、挿入ごとの log2 呼び出しを避ける
+_XLOG2X_TABLE_SIZE = 1 << 16
+_XLOG2X_TABLE = [0.0] + [x * math.log2(x) for x in range(1, _XLOG2X_TABLE_SIZE)]
+
+def _xlog2x(x: int) -> float:
+    if x < _XLOG2X_TABLE_SIZE:
+        return _XLOG2X_TABLE[x]
+    return x * math.log2(x)
+
+def top_chars(char_counts: Dict[str, int], total: int, k: int = TOP_CHARS) -> List[dict]:
+    """出現回数の多い順に上位k件を返す（同数の場合は文字順で決定的に並べる）"""
+    top = heapq.nsmallest(k, char_counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{"ch": ch, "count": cnt, "p": cnt/total} for ch, cnt in top]
+
+def split_compressed_edges(edges: Iterable[dict]) -> Tuple[List[dict], List[dict]]:
+    """iter_compressed_edges の出力を get_compressed_graph_data の (nodes, edges) に分ける（根のIDは 0）"""
+    nodes = [{"id": 0, "depth": 0}]
+    plain = []
+    for e in edges:
+        nodes.append({"id": e["to"], "depth": e["depth"]})
+        plain.append({"from": e["from"], "to": e["to"], "ch": e["ch"], "count": e["count"]})
+    return nodes, plain
+
+def depth_stats_from_counts(depth_counts: Dict[int, Dict[str, int]]) -> List[dict]:
+    """深さ -> {文字: 遷移回数} から深さ別統計を組み立てる（recalculate_stats 用。エントロピーは確率から直接計算する）"""
+    depth_stats = []
+    for d in sorted(depth_counts):
+        char_counts = depth_counts[d]
+        total_transitions = sum(char_counts.values())
+        if total_transitions == 0:
+            continue
+
+        entropy = 0.0
+        for cnt in char_counts.values():
+            p = cnt / total_transitions
+            entropy -= p * math.log2(p)
+
+        depth_stats.append({
+            "depth": d,
+            "total_transitions": total_transitions,
+            "unique_chars": len(char_counts),
+            "top_chars": top_chars(char_counts, total_transitions),
+            "entropy_bits": entropy
+        })
+    return depth_stats
+
+class DepthStats:
+    """
+    深さごとの遷移統計を挿入時に逐次更新する。
+
+    深さ d の遷移は「各テキストの d 文字目」と一致するため、Trie を走査しなくても
+    総遷移数・文字ヒストグラム・エントロピー項（Σ c·log2 c）を保持できる。
+    エントロピーは H = log2(T) - Σ c·log2 c / T で O(1) に求まる。
+    """
+
+    def __init__(self):
+        self.totals: List[int] = []
+        self.char_counts: List[Dict[str, int]] = []
+        self._xlogx: List[float] = []
+
+    def add(self, tokens, weight: int = 1, start: int = 0):
+        """tokens を深さ start から続く遷移として数える（ストリーミングで届いた続きを足す場合は start > 0）"""
+        totals = self.totals
+        char_counts = self.char_counts
+        xlogx = self._xlogx
+        table = _XLOG2X_TABLE
+        missing = start + len(tokens) - len(totals)
+        if missing > 0:
+            totals.extend([0] * missing)
+            char_counts.extend({} for _ in range(missing))
+            xlogx.extend([0.0] * missing)
+        for d, token in enumerate(tokens, start):
+            counts = char_counts[d]
+            old = counts.get(token, 0)
+            new = old + weight
+            counts[token] = new
+            totals[d] += weight
+            if new < _XLOG2X_TABLE_SIZE:
+                xlogx[d] += table[new] - table[old]
+            else:
+                xlogx[d] += _xlog2x(new) - _xlog2x(old)
+
+    def remove(self, tokens, weight: int = 1, start: int = 0):
+        """add の取り消し（回数が 0 になった文字と、末尾の遷移のない深さは消し、取り消し前と同じ状態に戻す）"""
+        for d, token in enumerate(tokens, start):
+            counts = self.char_counts[d]
+            old = counts[token]
+            new = old - weight
+            if new:
+                counts[token] = new
+            else:
+                del counts[token]
+            self.totals[d] -= weight
+            self._xlogx[d] += _xlog2x(new) - _xlog2x(old)
+        while self.totals and self.totals[-1] == 0:
+            self.totals.pop()
+            self.char_counts.pop()
+            self._xlogx.pop()
+
+    def copy(self) -> "DepthStats":
+        return DepthStats.from_dict(self.to_dict())
+
+    def merge(self, other: "DepthStats"):
+        """other の統計を足し込む（other のテキストを全て add した場合と同じ回数になる）"""
+        missing = other.max_depth - self.max_depth
+        if missing > 0:
+            self.totals.extend([0] * missing)
+            self.char_counts.extend({} for _ in range(missing))
+            self._xlogx.extend([0.0] * missing)
+        for d, other_counts in enumerate(other.char_counts):
+            counts = self.char_counts[d]
+            for token, weight in other_counts.items():
+                old = counts.get(token, 0)
+                counts[token] = old + weight
+                self._xlogx[d] += _xlog2x(old + weight) - _xlog2x(old)
+            self.totals[d] += other.totals[d]
+
+    @property
+    def max_depth(self) -> int:
+        return len(self.totals)
+
+    def entropy(self, depth: int) -> float:
+        total = self.totals[depth]
+        if total == 0:
+            return 0.0
+        # 丸め誤差で僅かに負になるのを防ぐ
+        return max(0.0, math.log2(total) - self._xlogx[depth] / total)
+
+    def exact_entropy(self, depth: int) -> float:
+        """
+        Σ c·log2 c を回数から fsum で計算し直したエントロピー。
+        逐次更新の値は足し込む順序で末尾の桁が変わるため、出力にはこちらを使い、
+        挿入順やシャードのマージ順によらず同じ値にする。
+        """
+        total = self.totals[depth]
+        if total == 0:
+            return 0.0
+        xlogx = math.fsum(_xlog2x(c) for c in self.char_counts[depth].values())
+        return max(0.0, math.log2(total) - xlogx / total)
+
+    def to_dict(self) -> dict:
+        return {"totals": self.totals, "char_counts": self.char_counts, "xlogx": self._xlogx}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DepthStats":
+        stats = cls()
+        stats.totals = list(data["totals"])
+        stats.char_counts = [dict(c) for c in data["char_counts"]]
+        stats._xlogx = list(data["xlogx"])
+        return stats
+
+    def to_list(self) -> List[dict]:
+        depth_stats = []
+        for d, total in enumerate(self.totals):
+            if total == 0:
+                continue
+            counts = self.char_counts[d]
+            depth_stats.append({
+                "depth": d,
+                "total_transitions": total,
+                "unique_chars": len(counts),
+                "top_chars": top_chars(counts, total),
+                "entropy_bits": self.exact_entropy(d)
+            })
+        return depth_stats
+
+class StreamCursor:
+    """
+    ストリーミング中の1サンプルの途中経過（届いた文字）を DepthStats に逐次反映するカーソル。
+    保持するのは届いた文字列と次の深さだけ。
+
+    commit で確定（反映したまま残す。正規化後のテキストに置き換えても確定できる）、abort で反映した分を全て取り消す。どちらも最初の1回だけが効くので、
+    エラーや途中のキャンセルで abort し、成功時に commit すれば、途中までのサンプルが二重に数えられたり
+    半端に残ったりすることはない。
+    """
+
+    def __init__(self, stats: DepthStats):
+        self.stats = stats
+        self.parts: List[str] = []
+        self.offset = 0
+        self.open = True
+
+    def feed(self, chunk: str):
+        if not self.open or not chunk:
+            return
+        self.stats.add(chunk, 1, start=self.offset)
+        self.parts.append(chunk)
+        self.offset += len(chunk)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def commit(self, text: Optional[str] = None):
+        """
+        反映を確定する。text を渡すと、届いた文字の代わりに text を数えた状態にして確定する
+        （集計前に正規化する場合、確定後の統計を Trie に入る正規化済みのテキストと一致させる）。
+        """
+        if not self.open:
+            return
+        self.open = False
+        if text is not None and text != self.text:
+            self.stats.remove(self.text)
+            self.stats.add(text)
+
+    def abort(self):
+        if not self.open:
+            return
+        self.open = False
+        self.stats.remove(self.text)
 
 class TrieNode:
     def __init__(self, node_id: int, depth: int):
@@ -13,16 +234,25 @@ class Aggregator:
         self.root = TrieNode(0, 0)
         self.nodes.append(self.root)
         self._next_id = 1
+        self.depth_stats = DepthStats()
 
     def load_from_runs(self, runs: List[dict]):
         """
         既存の実行結果（runs）をアグリゲーターに読み込む。
+        同一テキストはまとめて1回だけ挿入する。
+        """
+        self.add_many(run.get("text", "") for run in runs if run.get("status") == "ok")
+
+    def add_many(self, texts: Iterable[str]):
+        """
+        複数のテキストを追加する。
+        同一テキストを先に集約し、ユニークな文字列ごとに出現回数を重みとして1回だけ挿入する。
+        初出順に挿入するため、ノードIDは1件ずつ add_text した場合と同じになる。
         """
-        for run in runs:
-            if run.get("status") == "ok":
-                self.add_text(run.get("text", ""))
+        for text, weight in Counter(texts).items():
+            self.add_text(text, weight)
 
-    def add_text(self, text: str):
+    def add_text(self, text: str, weight: int = 1):
         current = self.root
         for char in text:
             if char not in current.children:
@@ -32,11 +262,12 @@ class Aggregator:
                 self.nodes.append(new_node)
                 current.counts[char] = 0
             
-            current.counts[char] += 1
+            current.counts[char] += weight
             current = current.children[char]
+        self.depth_stats.add(text, weight)
 
-    def add_tokens(self, tokens: List[str]):
-        """トークンのリストをアグリゲーターに追加する"""
+    def add_tokens(self, tokens: List[str], weight: int = 1):
+        """トークンのリストをアグリゲーターに追加する（weight 回分としてカウント）"""
         current = self.root
         for token in tokens:
             if token not in current.children:
@@ -46,116 +277,157 @@ class Aggregator:
                 self.nodes.append(new_node)
                 current.counts[token] = 0
             
-            current.counts[token] += 1
+            current.counts[token] += weight
             current = current.children[token]
+        self.depth_stats.add(tokens, weight)
 
-    def get_graph_data(self) -> Tuple[List[dict], List[dict]]:
-        nodes_data = [{"id": node.node_id, "depth": node.depth} for node in self.nodes]
-        edges_data = []
+    def export_arrays(self) -> Tuple[array, array, array, List[str]]:
+        """
+        Trie をノードID順のフラット配列 (parent, label, count) とラベル表に変換する。
+        count は親からそのノードへの遷移回数。スナップショット保存用。
+        """
+        size = len(self.nodes)
+        parent = array("i", [-1]) * size
+        label = array("i", [-1]) * size
+        count = array("q", [0]) * size
+        labels: List[str] = []
+        label_ids: Dict[str, int] = {}
+        for node in self.nodes:
+            for char, child in node.children.items():
+                label_id = label_ids.get(char)
+                if label_id is None:
+                    label_id = label_ids[char] = len(labels)
+                    labels.append(char)
+                parent[child.node_id] = node.node_id
+                label[child.node_id] = label_id
+                count[child.node_id] = node.counts[char]
+        return parent, label, count, labels
+
+    @classmethod
+    def from_arrays(cls, parent, label, count, labels: List[str], depth_stats: Optional[DepthStats] = None) -> "Aggregator":
+        """export_arrays の逆変換。ノードIDと子の挿入順はそのまま復元される"""
+        aggregator = cls()
+        nodes = aggregator.nodes
+        for node_id in range(1, len(parent)):
+            parent_node = nodes[parent[node_id]]
+            node = TrieNode(node_id, parent_node.depth + 1)
+            char = labels[label[node_id]]
+            parent_node.children[char] = node
+            parent_node.counts[char] = count[node_id]
+            nodes.append(node)
+        aggregator._next_id = len(nodes)
+        if depth_stats is not None:
+            aggregator.depth_stats = depth_stats
+        return aggregator
+
+    def merge(self, other):
+        """
+        other（Aggregator / ArrayAggregator、スナップショットから復元したものでもよい）を取り込む。
+        共通の接頭辞では遷移回数を足し、新しいノードは other のノードID順に末尾へ採番する。
+        ID は挿入順に振られているので、結果は self のテキストに続けて other のテキストを
+        add_text した場合とノードID・子の順序まで一致する。
+        """
+        parent, label, count, labels = other.export_arrays()
+        mapped = [self.root]
+        for node_id in range(1, len(parent)):
+            current = mapped[parent[node_id]]
+            char = labels[label[node_id]]
+            child = current.children.get(char)
+            if child is None:
+                child = TrieNode(self._next_id, current.depth + 1)
+                self._next_id += 1
+                current.children[char] = child
+                self.nodes.append(child)
+                current.counts[char] = 0
+            current.counts[char] += count[node_id]
+            mapped.append(child)
+        self.depth_stats.merge(other.depth_stats)
+
+    def iter_nodes(self) -> Iterator[dict]:
+        """get_graph_data のノードを1件ずつ返す（出力へ直接書き出す用）"""
+        for node in self.nodes:
+            yield {"id": node.node_id, "depth": node.depth}
+
+    def iter_edges(self) -> Iterator[dict]:
+        """get_graph_data のエッジを1件ずつ返す"""
         for node in self.nodes:
             for char, child in node.children.items():
-                edges_data.append({
+                yield {
                     "from": node.node_id,
                     "to": child.node_id,
                     "ch": char,
                     "count": node.counts[char]
-                })
-        return nodes_data, edges_data
+                }
 
-    def get_compressed_graph_data(self) -> Tuple[List[dict], List[dict]]:
+    def index(self) -> "TrieIndex":
+        """接頭辞の確率・続き・上位の回答などを問い合わせる索引（現時点の Trie のコピー）を作る"""
+        from collector.query import TrieIndex
+        return TrieIndex.from_arrays(*self.export_arrays())
+
+    def get_graph_data(self) -> Tuple[List[dict], List[dict]]:
+        return list(self.iter_nodes()), list(self.iter_edges())
+
+    def iter_compressed_edges(self) -> Iterator[dict]:
         """
-        パス圧縮（Radix Tree）を適用したグラフデータを返す。
-        分岐のない連続したノードを統合する。
+        パス圧縮（Radix Tree）を適用したエッジを深さ優先で1件ずつ返す。分岐のない連続したノードを統合する。
+        各エッジには行き先のノードの深さ（depth、元の Trie での深さ）を付ける。
+        親ごとのエッジは連続し、ノードへ入るエッジはそのノードから出るエッジより先に来る。
         """
-        compressed_nodes = []
-        compressed_edges = []
-        
-        # 訪問済みノードセット（統合後のルート候補として管理）
-        # 基本的に root から開始
-        stack = [(self.root, self.root.node_id)]
-        visited_nodes = {self.root.node_id}
-        compressed_nodes.append({"id": self.root.node_id, "depth": self.root.depth})
-
+        stack = [self.root]
         while stack:
-            curr_node, curr_compressed_id = stack.pop()
-            
+            curr_node = stack.pop()
+
             for char, child in curr_node.children.items():
                 edge_label = char
                 edge_count = curr_node.counts[char]
                 next_node = child
-                
+
                 # 直収（子が1つだけで、かつその子への流入が出口と同じ）の間、圧縮を続ける
                 # ただし、元の Trie なので child への流入は 1箇所のみであることが保証されている
                 while len(next_node.children) == 1:
                     # 子ノードの唯一の遷移先を取得
-                    next_char, nn = list(next_node.children.items())[0]
+                    next_char, nn = next(iter(next_node.children.items()))
                     # もし next_node のカウントと nn へのカウントが同じ（漏れがない）なら圧縮
                     if next_node.counts[next_char] == edge_count:
                         edge_label += next_char
                         next_node = nn
                     else:
                         break
-                
-                # 新しいノードを登録（もしまだなら）
-                if next_node.node_id not in visited_nodes:
-                    compressed_nodes.append({"id": next_node.node_id, "depth": next_node.depth})
-                    visited_nodes.add(next_node.node_id)
-                    stack.append((next_node, next_node.node_id))
-                
-                compressed_edges.append({
-                    "from": curr_compressed_id,
+
+                # 元の Trie は木なので、統合後のノードは必ず未訪問
+                stack.append(next_node)
+                yield {
+                    "from": curr_node.node_id,
                     "to": next_node.node_id,
                     "ch": edge_label,
-                    "count": edge_count
-                })
-                
-        return compressed_nodes, compressed_edges
+                    "count": edge_count,
+                    "depth": next_node.depth
+                }
+
+    def get_compressed_graph_data(self) -> Tuple[List[dict], List[dict]]:
+        """パス圧縮（Radix Tree）を適用したグラフデータを返す（iter_compressed_edges をリストにしたもの）"""
+        return split_compressed_edges(self.iter_compressed_edges())
 
     def calculate_stats(self) -> dict:
-        # 簡易的な統計計算の実装
-        total_ok = 0 # 外部で管理
-        total_error = 0 # 外部で管理
-        
-        depth_map: Dict[int, List[TrieNode]] = {}
-        max_depth = 0
-        for node in self.nodes:
-            depth_map.setdefault(node.depth, []).append(node)
-            if node.depth > max_depth:
-                max_depth = node.depth
+        """
+        挿入時に更新している深さ別統計を返す（Trie の再走査なし）。
+        深さごとの文字ヒストグラムから上位の文字とエントロピーを求めるので、コストは全深さのユニーク文字数の合計に比例する。
+        """
+        return {
+            "depth_stats": self.depth_stats.to_list()
+        }
 
-        depth_stats = []
-        import math
-        for d in range(max_depth + 1):
-            nodes_at_d = depth_map.get(d, [])
-            total_transitions = sum(sum(node.counts.values()) for node in nodes_at_d)
-            if total_transitions == 0:
+    def recalculate_stats(self) -> dict:
+        """全ノードを走査して深さ別統計を計算し直す（calculate_stats の検証用）"""
+        # 深さ d のノードから出る遷移を集計する
+        depth_counts: Dict[int, Dict[str, int]] = {}
+        for node in self.nodes:
+            if not node.counts:
                 continue
-            
-            # 各文字の出現回数を集計
-            char_counts: Dict[str, int] = {}
-            for node in nodes_at_d:
-                for char, count in node.counts.items():
-                    char_counts[char] = char_counts.get(char, 0) + count
-            
-            unique_chars = len(char_counts)
-            top_chars = sorted(
-                [{"ch": ch, "count": cnt, "p": cnt/total_transitions} for ch, cnt in char_counts.items()],
-                key=lambda x: x["count"], reverse=True
-            )[:5]
-            
-            entropy = 0.0
-            for cnt in char_counts.values():
-                p = cnt / total_transitions
-                entropy -= p * math.log2(p)
-                
-            depth_stats.append({
-                "depth": d,
-                "total_transitions": total_transitions,
-                "unique_chars": unique_chars,
-                "top_chars": top_chars,
-                "entropy_bits": entropy
-            })
+            char_counts = depth_counts.setdefault(node.depth, {})
+            for char, count in node.counts.items():
+                char_counts[char] = char_counts.get(char, 0) + count
 
         return {
-            "depth_stats": depth_stats
+            "depth_stats": depth_stats_from_counts(depth_counts)
         }
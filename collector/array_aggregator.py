@@ -0,0 +1,262 @@
+from array import array
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from collector.aggregator import DepthStats, depth_stats_from_counts, split_compressed_edges
+
+if TYPE_CHECKING:
+    from collector.query import TrieIndex
+
+# 子インデックスのキーは (親ID << 32) | ラベルID で1つの int にまとめる
+_LABEL_BITS = 32
+_NO_NODE = -1
+
+class ArrayAggregator:
+    """
+    Aggregator と同じAPIを持つ、フラット配列ベースのTrie実装。
+
+    ノードごとに Python オブジェクトと dict を2つ持つ代わりに、
+    ノードIDをインデックスとした配列で構造を保持する。
+
+    - parent / depth / label / count: ノードごとの属性（count は親からこのノードへの遷移回数）
+    - first_child / last_child / next_sibling: 子の列挙用（挿入順を保持）
+    - child_index: (親ID, ラベルID) -> 子ID の検索用インデックス
+    - ラベル（文字・トークン）は intern してIDで保持する
+    """
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self._label_ids: Dict[str, int] = {}
+
+        self._parent = array("i", [_NO_NODE])
+        self._depth = array("i", [0])
+        self._label = array("i", [_NO_NODE])
+        self._count = array("q", [0])
+        self._first_child = array("i", [_NO_NODE])
+        self._last_child = array("i", [_NO_NODE])
+        self._next_sibling = array("i", [_NO_NODE])
+        self._child_index: Dict[int, int] = {}
+        self.depth_stats = DepthStats()
+
+    def __len__(self) -> int:
+        return len(self._parent)
+
+    def load_from_runs(self, runs: List[dict]):
+        """
+        既存の実行結果（runs）をアグリゲーターに読み込む。
+        同一テキストはまとめて1回だけ挿入する。
+        """
+        self.add_many(run.get("text", "") for run in runs if run.get("status") == "ok")
+
+    def add_many(self, texts: Iterable[str]):
+        """同一テキストを集約し、ユニークな文字列ごとに出現回数を重みとして挿入する"""
+        for text, weight in Counter(texts).items():
+            self.add_tokens(text, weight)
+
+    def _intern(self, label: str) -> int:
+        label_id = len(self.labels)
+        self.labels.append(label)
+        self._label_ids[label] = label_id
+        return label_id
+
+    def _new_node(self, parent: int, label_id: int) -> int:
+        node_id = len(self._parent)
+        self._parent.append(parent)
+        self._depth.append(self._depth[parent] + 1)
+        self._label.append(label_id)
+        self._count.append(0)
+        self._first_child.append(_NO_NODE)
+        self._last_child.append(_NO_NODE)
+        self._next_sibling.append(_NO_NODE)
+
+        last = self._last_child[parent]
+        if last == _NO_NODE:
+            self._first_child[parent] = node_id
+        else:
+            self._next_sibling[last] = node_id
+        self._last_child[parent] = node_id
+        return node_id
+
+    def add_text(self, text: str, weight: int = 1):
+        self.add_tokens(text, weight)
+
+    def _get_or_create_child(self, node: int, token: str) -> int:
+        label_id = self._label_ids.get(token)
+        if label_id is None:
+            label_id = self._intern(token)
+        key = (node << _LABEL_BITS) | label_id
+        child = self._child_index.get(key)
+        if child is None:
+            child = self._new_node(node, label_id)
+            self._child_index[key] = child
+        return child
+
+    def add_tokens(self, tokens, weight: int = 1):
+        """トークン（または文字）の列をアグリゲーターに追加する（weight 回分としてカウント）"""
+        label_ids = self._label_ids
+        child_index = self._child_index
+        counts = self._count
+        node = 0
+        for token in tokens:
+            # 既存パスの走査が大半なので、例外を使って高速パスを短くする
+            try:
+                node = child_index[(node << _LABEL_BITS) | label_ids[token]]
+            except KeyError:
+                node = self._get_or_create_child(node, token)
+            counts[node] += weight
+        self.depth_stats.add(tokens, weight)
+
+    def merge(self, other):
+        """other を取り込む（Aggregator.merge と同じく、other のノードID順に新しいノードを採番する）"""
+        parent, label, count, labels = other.export_arrays()
+        counts = self._count
+        mapped = array("i", [0])
+        for node_id in range(1, len(parent)):
+            child = self._get_or_create_child(mapped[parent[node_id]], labels[label[node_id]])
+            counts[child] += count[node_id]
+            mapped.append(child)
+        self.depth_stats.merge(other.depth_stats)
+
+    def export_arrays(self) -> Tuple[array, array, array, List[str]]:
+        """Trie をノードID順のフラット配列 (parent, label, count) とラベル表として返す"""
+        return self._parent, self._label, self._count, self.labels
+
+    @classmethod
+    def from_arrays(cls, parent, label, count, labels: List[str], depth_stats: Optional[DepthStats] = None) -> "ArrayAggregator":
+        """
+        export_arrays の逆変換。配列はそのまま複製し、
+        depth・兄弟リスト・子インデックスだけをノード数 O(N) で再構築する。
+        """
+        aggregator = cls()
+        size = len(parent)
+        aggregator._parent = array("i", parent)
+        aggregator._label = array("i", label)
+        aggregator._count = array("q", count)
+        aggregator.labels = list(labels)
+        aggregator._label_ids = {ch: i for i, ch in enumerate(aggregator.labels)}
+
+        depth = aggregator._depth = array("i", [0]) * size
+        first_child = aggregator._first_child = array("i", [_NO_NODE]) * size
+        last_child = aggregator._last_child = array("i", [_NO_NODE]) * size
+        next_sibling = aggregator._next_sibling = array("i", [_NO_NODE]) * size
+        child_index = aggregator._child_index
+        parent = aggregator._parent
+        label = aggregator._label
+        # 子は必ず親より大きいIDを持つので、ID順に1回走査すれば挿入順も再現できる
+        for node_id in range(1, size):
+            p = parent[node_id]
+            depth[node_id] = depth[p] + 1
+            last = last_child[p]
+            if last == _NO_NODE:
+                first_child[p] = node_id
+            else:
+                next_sibling[last] = node_id
+            last_child[p] = node_id
+            child_index[(p << _LABEL_BITS) | label[node_id]] = node_id
+
+        if depth_stats is not None:
+            aggregator.depth_stats = depth_stats
+        return aggregator
+
+    def _iter_children(self, node_id: int):
+        child = self._first_child[node_id]
+        next_sibling = self._next_sibling
+        while child != _NO_NODE:
+            yield child
+            child = next_sibling[child]
+
+    def iter_nodes(self) -> Iterator[dict]:
+        depth = self._depth
+        for i in range(len(depth)):
+            yield {"id": i, "depth": depth[i]}
+
+    def iter_edges(self) -> Iterator[dict]:
+        labels = self.labels
+        label = self._label
+        counts = self._count
+        for node_id in range(len(self._depth)):
+            for child in self._iter_children(node_id):
+                yield {
+                    "from": node_id,
+                    "to": child,
+                    "ch": labels[label[child]],
+                    "count": counts[child]
+                }
+
+    def index(self) -> "TrieIndex":
+        """接頭辞の確率・続き・上位の回答などを問い合わせる索引（現時点の Trie のコピー）を作る"""
+        from collector.query import TrieIndex
+        return TrieIndex.from_arrays(*self.export_arrays())
+
+    def get_graph_data(self) -> Tuple[List[dict], List[dict]]:
+        return list(self.iter_nodes()), list(self.iter_edges())
+
+    def iter_compressed_edges(self) -> Iterator[dict]:
+        """
+        パス圧縮（Radix Tree）を適用したエッジを1件ずつ返す。
+        Aggregator.iter_compressed_edges と同じ順序・内容を出力する。
+        """
+        labels = self.labels
+        label = self._label
+        counts = self._count
+        depth = self._depth
+        first_child = self._first_child
+        next_sibling = self._next_sibling
+
+        stack = [0]
+        while stack:
+            curr = stack.pop()
+            for child in self._iter_children(curr):
+                edge_count = counts[child]
+                parts = [labels[label[child]]]
+                next_node = child
+
+                # 子が1つだけで、かつ流量が変わらない間は圧縮を続ける
+                while True:
+                    only = first_child[next_node]
+                    if only == _NO_NODE or next_sibling[only] != _NO_NODE:
+                        break
+                    if counts[only] != edge_count:
+                        break
+                    parts.append(labels[label[only]])
+                    next_node = only
+
+                # 元の Trie は木なので、統合後のノードは必ず未訪問
+                stack.append(next_node)
+                yield {
+                    "from": curr,
+                    "to": next_node,
+                    "ch": "".join(parts),
+                    "count": edge_count,
+                    "depth": depth[next_node]
+                }
+
+    def get_compressed_graph_data(self) -> Tuple[List[dict], List[dict]]:
+        """パス圧縮（Radix Tree）を適用したグラフデータを返す（Aggregator.get_compressed_graph_data と同じ）"""
+        return split_compressed_edges(self.iter_compressed_edges())
+
+    def calculate_stats(self) -> dict:
+        """挿入時に更新している深さ別統計を返す（Trie の再走査なし。コストは Aggregator.calculate_stats と同じ）"""
+        return {
+            "depth_stats": self.depth_stats.to_list()
+        }
+
+    def recalculate_stats(self) -> dict:
+        """全ノードを走査して深さ別統計を計算し直す（calculate_stats の検証用）"""
+        depth = self._depth
+        label = self._label
+        counts = self._count
+        labels = self.labels
+
+        # 深さ d のノードから出る遷移を集計する
+        depth_counts: Dict[int, Dict[str, int]] = {}
+        for node_id in range(len(depth)):
+            if self._first_child[node_id] == _NO_NODE:
+                continue
+            char_counts = depth_counts.setdefault(depth[node_id], {})
+            for child in self._iter_children(node_id):
+                ch = labels[label[child]]
+                char_counts[ch] = char_counts.get(ch, 0) + counts[child]
+
+        return {
+            "depth_stats": depth_stats_from_counts(depth_counts)
+        }
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import math
+import random
+from types import SimpleNamespace
+from typing import Any, Dict, Mapping, Optional, Protocol, Tuple
+
+class CompletionBackend(Protocol):
+    """
+    Runner が chat completions を呼び出す先。
+    create は API と同じキーワード引数（model, messages, n, logprobs など）を受け取り、
+    (レスポンス, レスポンスヘッダ) を返す。ヘッダを取れない場合は None を返してよい。
+    """
+
+    async def create(self, **kwargs) -> Tuple[Any, Optional[Mapping[str, str]]]:
+        ...
+
+class OpenAIBackend:
+    """OpenAI SDK（AsyncOpenAI）経由で実際の API を呼び出すバックエンド"""
+
+    def __init__(self, client, raw_headers: bool = False):
+        self.client = client
+        # 適応制御ではレート制限ヘッダを参照するため raw レスポンスを受け取る
+        self.raw_headers = raw_headers
+
+    async def create(self, **kwargs):
+        if not self.raw_headers:
+            return await self.client.chat.completions.create(**kwargs), None
+        raw = await self.client.chat.completions.with_raw_response.create(**kwargs)
+        return raw.parse(), raw.headers
+
+# 実験プロンプト（北海道の県庁所在地）の回答分布を模した既定のコーパス
+DEFAULT_MOCK_CORPUS = {
+    "北海道の県庁所在地は札幌市です。": 60,
+    "北海道には県庁所在地はありませんが、道庁所在地は札幌市です。": 25,
+    "札幌市です。": 10,
+    "北海道は県ではないため、県庁所在地はありません。": 4,
+    "I'm not sure.": 1,
+}
+
+def load_mock_corpus(report_path: str) -> Dict[str, int]:
+    """classification_report.json の (ユニーク回答, 出現回数) をモックの出力分布として読み込む"""
+    with open(report_path, "r", encoding="utf-8") as f:
+        details = json.load(f)["details"]
+    return {text: info["count"] for text, info in details.items()}
+
+class MockAPIError(Exception):
+    """openai.APIStatusError と同じく status_code と response.headers を持つ擬似エラー"""
+
+    def __init__(self, status_code: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+class MockBackend:
+    """
+    API キーなしで Runner とパイプライン全体を動かすためのローカルなバックエンド。
+    chat completions と同じ形のレスポンス（choices / message / logprobs / usage）を返す。
+
+    - レイテンシ: 中央値 latency 秒の対数正規分布（latency_sigma=0 なら一定）
+    - エラー注入: rate_429 / rate_5xx の確率で失敗させる。capacity を指定すると、
+      同時実行数がそれを超えたリクエストも 429 にする（適応制御の確認用）
+    - 出力: corpus（テキスト → 重み）から重み付きでサンプリングする
+    - logprobs=True なら、最大4文字ずつのトークンに区切った logprobs を付ける
+    - stream=True なら、同じ区切りのトークンを1つずつチャンクとして返す（最初のチャンクまでがレイテンシの
+      ttft_share 倍、残りを均等に流す）。500 の注入はストリームの途中で起こす
+    """
+
+    def __init__(
+        self,
+        corpus: Optional[Dict[str, float]] = None,
+        latency: float = 0.5,
+        latency_sigma: float = 0.3,
+        rate_429: float = 0.0,
+        rate_5xx: float = 0.0,
+        capacity: Optional[int] = None,
+        seed: Optional[int] = None,
+        ttft_share: float = 0.3,
+    ):
+        corpus = corpus or DEFAULT_MOCK_CORPUS
+        self.texts = list(corpus)
+        self.weights = list(corpus.values())
+        total = sum(self.weights)
+        self._logp = {text: math.log(w / total) for text, w in corpus.items()}
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.capacity = capacity
+        self.ttft_share = ttft_share
+        self._random = random.Random(seed)
+        self._in_flight = 0
+        self.requests = 0
+
+    def _sample_latency(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency
+        return self.latency * math.exp(self._random.gauss(0.0, self.latency_sigma))
+
+    def _logprobs(self, text: str, top_logprobs: int):
+        # テキスト全体の対数確率をトークンに均等に割り振る
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+        logprob = self._logp[text] / len(tokens)
+        content = []
+        for token in tokens:
+            top = [SimpleNamespace(token=token, logprob=logprob, bytes=list(token.encode("utf-8")))]
+            for k in range(1, top_logprobs):
+                alt = self._random.choice(self.texts)[:1] or "?"
+                top.append(SimpleNamespace(token=alt, logprob=logprob - k, bytes=list(alt.encode("utf-8"))))
+            content.append(SimpleNamespace(
+                token=token, logprob=logprob, bytes=list(token.encode("utf-8")), top_logprobs=top
+            ))
+        return SimpleNamespace(content=content)
+
+    def _response(self, kwargs: dict):
+        count = kwargs.get("n") or 1
+        prompt = "".join(m["content"] for m in kwargs.get("messages", []))
+        want_logprobs = bool(kwargs.get("logprobs"))
+        choices = []
+        completion_tokens = 0
+        for index, text in enumerate(self._random.choices(self.texts, self.weights, k=count)):
+            logprobs = self._logprobs(text, kwargs.get("top_logprobs") or 0) if want_logprobs else None
+            completion_tokens += len(logprobs.content) if logprobs else -(-len(text) // 4)
+            choices.append(SimpleNamespace(
+                index=index,
+                message=SimpleNamespace(role="assistant", content=text),
+                logprobs=logprobs,
+                finish_reason="stop",
+            ))
+        return SimpleNamespace(
+            choices=choices,
+            usage=SimpleNamespace(prompt_tokens=len(prompt), completion_tokens=completion_tokens),
+        )
+
+    async def _stream(self, response, duration: float, fail: bool):
+        """レスポンスを choice ごとのトークン単位のチャンクに分けて流し、最後に usage だけのチャンクを返す"""
+        self._in_flight += 1
+        try:
+            tokens = [
+                [(lp.token, lp) for lp in c.logprobs.content] if c.logprobs
+                else [(c.message.content[i:i + 4], None) for i in range(0, len(c.message.content), 4)]
+                for c in response.choices
+            ]
+            steps = max((len(t) for t in tokens), default=0)
+            for step in range(steps):
+                if fail and step >= steps // 2:
+                    raise MockAPIError(500, "Mock server error (mid-stream)")
+                if step:
+                    await asyncio.sleep(duration / steps)
+                yield SimpleNamespace(choices=[
+                    SimpleNamespace(
+                        index=c.index,
+                        delta=SimpleNamespace(role="assistant", content=t[step][0]),
+                        logprobs=SimpleNamespace(content=[t[step][1]]) if t[step][1] else None,
+                        finish_reason=None
+                    )
+                    for c, t in zip(response.choices, tokens) if step < len(t)
+                ], usage=None)
+            yield SimpleNamespace(choices=[], usage=response.usage)
+        finally:
+            self._in_flight -= 1
+
+    async def create(self, **kwargs):
+        self.requests += 1
+        self._in_flight += 1
+        try:
+            stream = bool(kwargs.get("stream"))
+            latency = self._sample_latency()
+            await asyncio.sleep(latency * self.ttft_share if stream else latency)
+            headers = {"x-ratelimit-remaining-requests": str(max(0, (self.capacity or 10_000) - self._in_flight))}
+            if self.capacity is not None and self._in_flight > self.capacity:
+                raise MockAPIError(429, "Mock rate limit: too many concurrent requests", {"retry-after": "0.1"})
+            roll = self._random.random()
+            if roll < self.rate_429:
+                raise MockAPIError(429, "Mock rate limit", {"retry-after": "0.1"})
+            failed = roll < self.rate_429 + self.rate_5xx
+            if stream:
+                return self._stream(self._response(kwargs), latency * (1 - self.ttft_share), failed), headers
+            if failed:
+                raise MockAPIError(500, "Mock server error")
+            return self._response(kwargs), headers
+        finally:
+            self._in_flight -= 1
@@ -1,5 +1,37 @@
+import hashlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
 from tokenizers import Tokenizer, models, trainers, pre_tokenizers
-from typing import List
+
+# train_from_iterator に渡す1バッチあたりのテキスト数
+_TRAIN_BATCH = 1000
+
+def corpus_fingerprint(counts: Dict[str, int], vocab_size: int) -> str:
+    """(ユニークなテキスト, 出現回数) の集合と語彙サイズから、学習済み語彙のキャッシュキーを作る"""
+    digest = hashlib.sha256(f"vocab={vocab_size}\n".encode("utf-8"))
+    for text, count in sorted(counts.items()):
+        digest.update(f"{count}\t{len(text)}\t".encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+def _weighted_batches(counts: Dict[str, int]) -> Iterator[List[str]]:
+    """
+    ユニークなテキストを出現回数分だけ繰り返したバッチを返す。
+    pre_tokenizer が無いのでテキスト全体が1語として数えられ、重み付きで学習したのと同じになる。
+    重複を展開したリストは作らず、Rust 側への受け渡しもバッチ単位にする。
+    """
+    batch: List[str] = []
+    for text, count in counts.items():
+        while count > 0:
+            take = min(count, _TRAIN_BATCH - len(batch))
+            batch.extend([text] * take)
+            count -= take
+            if len(batch) >= _TRAIN_BATCH:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
 
 class BPEManager:
     def __init__(self, vocab_size: int = 1000):
@@ -8,20 +40,54 @@ class BPEManager:
         self.tokenizer.pre_tokenizer = None
         self.vocab_size = vocab_size
         self.trainer = trainers.BpeTrainer(
-            vocab_size=vocab_size, 
+            vocab_size=vocab_size,
             special_tokens=["[UNK]", "[PAD]", "[CLS]", "[SEP]", "[MASK]"]
         )
 
-    def train(self, texts: List[str]):
-        """与えられたテキストデータでBPEを学習する"""
-        if not texts:
+    def train(self, texts: Iterable[str]):
+        """与えられたテキストデータでBPEを学習する（同一テキストは集約して回数で重み付けする）"""
+        self.train_counts(Counter(texts))
+
+    def train_counts(self, counts: Dict[str, int]):
+        """(ユニークなテキスト -> 出現回数) でBPEを学習する"""
+        if not counts:
             return
-        self.tokenizer.train_from_iterator(texts, trainer=self.trainer)
+        self.tokenizer.train_from_iterator(
+            _weighted_batches(counts), trainer=self.trainer, length=sum(counts.values())
+        )
+
+    def train_or_load(self, counts: Dict[str, int], cache_dir) -> bool:
+        """
+        同じコーパス・語彙サイズで学習済みの語彙が cache_dir にあれば読み込み、無ければ学習して保存する。
+        キャッシュから読み込んだ場合は True を返す。
+        """
+        path = Path(cache_dir) / f"bpe-{self.vocab_size}-{corpus_fingerprint(counts, self.vocab_size)[:16]}.json"
+        if path.exists():
+            self.tokenizer = Tokenizer.from_file(str(path))
+            return True
+        self.train_counts(counts)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        self.tokenizer.save(str(tmp_path))
+        tmp_path.replace(path)
+        return False
 
     def tokenize(self, text: str) -> List[str]:
         """テキストを現在の語彙でトークン化する"""
         encoding = self.tokenizer.encode(text)
         return encoding.tokens
 
+    def tokenize_batch(self, texts: List[str]) -> List[List[str]]:
+        """
+        複数のテキストをまとめてトークン化する（tokenizers 側でまとめて・複数コアなら並列に処理される）。
+        オフセットを計算しない encode_batch_fast で id だけを受け取り、語彙表で文字列に戻す。
+        同じトークンは同じ文字列オブジェクトを共有するので、Trie のラベルも重複して持たない。
+        """
+        vocab = [""] * self.tokenizer.get_vocab_size()
+        for token, token_id in self.tokenizer.get_vocab().items():
+            vocab[token_id] = token
+        encodings = self.tokenizer.encode_batch_fast(texts, add_special_tokens=False)
+        return [[vocab[i] for i in encoding.ids] for encoding in encodings]
+
     def get_vocab(self):
         return self.tokenizer.get_vocab()
@@ -2,6 +2,7 @@ import hashlib
 import json
 from pathlib import Path
 from typing import Optional, Dict, Any
+from collector.file_io import JSON_SUFFIXES
 
 def calculate_prompt_hash(config_dict: Dict[str, Any]) -> str:
     """
@@ -11,6 +12,13 @@ def calculate_prompt_hash(config_dict: Dict[str, Any]) -> str:
     # ハッシュに含めるべき重要な設定項目
     relevant_keys = ["model", "prompt", "temp", "max_tokens", "debug"]
     config_to_hash = {k: config_dict.get(k) for k in relevant_keys}
+    # temp は 1 と 1.0 で同じハッシュになるよう float に揃える（CLI の --temp は常に float）
+    if config_to_hash["temp"] is not None:
+        config_to_hash["temp"] = float(config_to_hash["temp"])
+    # 後から追加した項目は、既存のハッシュを変えないよう値があるときだけ含める
+    for k in ["backend", "shard", "normalization"]:
+        if config_dict.get(k) is not None:
+            config_to_hash[k] = config_dict[k]
     
     config_str = json.dumps(config_to_hash, sort_keys=True)
     return hashlib.sha256(config_str.encode("utf-8")).hexdigest()
@@ -18,15 +26,17 @@ def calculate_prompt_hash(config_dict: Dict[str, Any]) -> str:
 def find_latest_run(output_dir: str, prompt_hash: str) -> Optional[Path]:
     """
     指定されたディレクトリから、特定のプロンプトハッシュを含む最新のJSONファイルを探す。
-    ファイル名形式: run-{timestamp}-{hash}.json を想定。
+    ファイル名形式: run-{timestamp}-{hash}.json を想定（.json.gz / .json.zst も対象）。
     """
     dir_path = Path(output_dir)
     if not dir_path.exists():
         return None
     
     # run-*.json と checkpoint-*.json の両方を探す
-    candidates = list(dir_path.glob(f"run-*-{prompt_hash}.json"))
-    candidates.extend(list(dir_path.glob(f"checkpoint-*-{prompt_hash}.json")))
+    candidates = []
+    for suffix in JSON_SUFFIXES:
+        candidates.extend(dir_path.glob(f"run-*-{prompt_hash}{suffix}"))
+        candidates.extend(dir_path.glob(f"checkpoint-*-{prompt_hash}{suffix}"))
     
     if not candidates:
         return None
@@ -0,0 +1,140 @@
+import heapq
+import math
+from collections import Counter
+from statistics import NormalDist
+from typing import Any, Dict, Iterable, Optional, Tuple
+from collector.serializer import ConvergenceConfig
+
+CRITERIA = ("entropy", "topk", "rare")
+
+def wilson_interval(successes: int, n: int, z: float) -> Tuple[float, float]:
+    """二項割合の Wilson スコア区間（割合が 0 や 1 に近い・稀な分岐でも区間が潰れない）"""
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+class ConvergenceMonitor:
+    """
+    収集中の統計が収束したかを判定する（早期終了用）。
+
+    observe は1件ごとに回答の出現回数を数えるだけで、判定は interval 件ごとにしか行わない。
+    深さ別エントロピーはアグリゲーターが挿入時に更新している depth_stats から O(max_depth) で読み、
+    上位回答・稀な分岐の割合は observe で数えた回数から求めるので、判定で Trie を走査することはない。
+    """
+
+    def __init__(self, config: ConvergenceConfig, aggregator):
+        self.config = config
+        self.aggregator = aggregator
+        self.z = NormalDist().inv_cdf(0.5 + config.confidence / 2)
+        self.n = 0
+        self.answers: Counter = Counter()
+        self.branch_hits = 0
+        self.checks = 0
+        self.streak = 0
+        self.converged = False
+        self.converged_at: Optional[int] = None
+        self._prev_entropy: Optional[Dict[int, float]] = None
+        # 最後の判定時点の件数と各条件の結果（summary はこの組を報告する）
+        self._last: Dict[str, Any] = {"samples": 0, "criteria": {}}
+
+    def observe(self, text: str, weight: int = 1):
+        self.n += weight
+        self.answers[text] += weight
+        if self.config.branch is not None and text.startswith(self.config.branch):
+            self.branch_hits += weight
+
+    def prime(self, texts: Iterable[str]):
+        """レジューム時に、既存の成功した回答を数え直す（判定はしない）"""
+        for text in texts:
+            self.observe(text)
+
+    def prime_from_trie(self, n: int):
+        """
+        prime と同じだが、回答ごとの回数をアグリゲーターの Trie から読む（ランログを読み直さない）。
+        n は既存の成功した回答の数。Trie は空の回答を数えないので、足りない分は空の回答として数える。
+        """
+        for text, count in self.aggregator.index().answers():
+            self.observe(text, count)
+        if n > self.n:
+            self.observe("", n - self.n)
+
+    def _entropy(self) -> Dict[str, Any]:
+        # 十分な数のテキストが到達した深さだけを比べる（深い位置の少数のサンプルで判定が揺れないように）
+        depth_stats = self.aggregator.depth_stats
+        current = {
+            d: depth_stats.entropy(d)
+            for d in range(depth_stats.max_depth) if depth_stats.totals[d] >= self.config.min_samples
+        }
+        prev, self._prev_entropy = self._prev_entropy, current
+        common = [d for d in current if prev is not None and d in prev]
+        if not common:
+            return {"converged": False, "max_delta_bits": None, "depths": len(current)}
+        depth, delta = max(((d, abs(current[d] - prev[d])) for d in common), key=lambda item: item[1])
+        return {
+            "converged": delta <= self.config.tolerance,
+            "max_delta_bits": delta,
+            "max_delta_depth": depth,
+            "depths": len(common)
+        }
+
+    def _topk(self) -> Dict[str, Any]:
+        answers = []
+        worst = 0.0
+        for text, count in heapq.nlargest(self.config.top_k, self.answers.items(), key=lambda item: item[1]):
+            low, high = wilson_interval(count, self.n, self.z)
+            worst = max(worst, (high - low) / 2)
+            answers.append({"text": text, "count": count, "p": count / self.n, "ci_low": low, "ci_high": high})
+        return {"converged": bool(answers) and worst <= self.config.tolerance, "max_half_width": worst, "answers": answers}
+
+    def _rare(self) -> Dict[str, Any]:
+        low, high = wilson_interval(self.branch_hits, self.n, self.z)
+        rate = self.branch_hits / self.n
+        half = (high - low) / 2
+        return {
+            # 一度も現れていない分岐は相対誤差が定まらないので収束とみなさない
+            "converged": rate > 0 and half <= self.config.relative_tolerance * rate,
+            "branch": self.config.branch,
+            "count": self.branch_hits,
+            "rate": rate,
+            "ci_low": low,
+            "ci_high": high
+        }
+
+    def check(self) -> bool:
+        """選んだ統計を全て評価し、patience 回続けて全てが収束していれば True を返す"""
+        self.checks += 1
+        evaluate = {"entropy": self._entropy, "topk": self._topk, "rare": self._rare}
+        criteria = {name: evaluate[name]() for name in self.config.criteria}
+        self._last = {"samples": self.n, "criteria": criteria}
+        if self.n >= self.config.min_samples and all(result["converged"] for result in criteria.values()):
+            self.streak += 1
+        else:
+            self.streak = 0
+        if self.streak >= self.config.patience and not self.converged:
+            self.converged = True
+            self.converged_at = self.n
+        return self.converged
+
+    def should_stop(self) -> bool:
+        """結果を1件受け取るごとに呼ぶ。interval 件ごとにだけ判定する"""
+        if self.converged:
+            return True
+        if self.n == 0 or self.n % self.config.interval:
+            return False
+        return self.check()
+
+    def summary(self) -> Dict[str, Any]:
+        """stats.convergence に記録する内容（条件・判定の状態・最後の判定時点の件数と観測した値）"""
+        return {
+            "rule": self.config.model_dump(),
+            "converged": self.converged,
+            "converged_at": self.converged_at,
+            "samples": self._last["samples"],
+            "checks": self.checks,
+            "streak": self.streak,
+            "criteria": self._last["criteria"]
+        }
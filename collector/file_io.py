@@ -0,0 +1,116 @@
+import gzip
+import io
+import json
+import re
+from pathlib import Path
+from typing import Any, Iterator, Optional, TextIO
+
+# 拡張子と圧縮形式の対応（出力ファイル名は run-...-{hash}.json / .json.gz / .json.zst）
+COMPRESSION_SUFFIXES = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+JSON_SUFFIXES = (".json", ".json.gz", ".json.zst")
+
+def compression_of(path) -> Optional[str]:
+    """拡張子から圧縮形式を判定する（非圧縮なら None）"""
+    name = str(path)
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    return None
+
+def strip_compression_suffix(path) -> Path:
+    """run-xxx.json.gz → run-xxx.json"""
+    path = Path(path)
+    if compression_of(path):
+        return path.with_suffix("")
+    return path
+
+def _zstd_module():
+    # Python 3.14 以降は標準ライブラリ、それ以前は zstandard パッケージ（任意依存）を使う
+    try:
+        from compression import zstd
+        return zstd, True
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard, False
+    except ImportError:
+        raise RuntimeError("zstd support requires Python 3.14+ or the 'zstandard' package (pip install zstandard)")
+
+def open_text(path, mode: str = "r", compression: Optional[str] = None, level: Optional[int] = None) -> TextIO:
+    """
+    UTF-8 のテキストとして開く。圧縮形式は compression、省略時は path の拡張子で決める。
+    gzip / zstd はどちらもストリーミングで読み書きするため、全体をメモリに展開しない。
+    """
+    if mode not in ("r", "w"):
+        raise ValueError(f"unsupported mode: {mode}")
+    compression = compression if compression is not None else compression_of(path)
+    if compression is None:
+        return open(path, mode, encoding="utf-8")
+    if compression == "gzip":
+        # 既定の 9 は書き込みが遅いわりに縮まないので 6 を使う
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=level if level is not None else 6)
+    if compression == "zstd":
+        zstd, stdlib = _zstd_module()
+        if stdlib:
+            return zstd.open(path, mode + "t", encoding="utf-8", level=level)
+        raw = open(path, mode + "b")
+        if mode == "r":
+            stream = zstd.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstd.ZstdCompressor(level=level if level is not None else 3).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    raise ValueError(f"unknown compression: {compression}")
+
+def load_json(path) -> Any:
+    """.json / .json.gz / .json.zst を透過的に読み込む"""
+    with open_text(path) as f:
+        return json.load(f)
+
+def iter_json_array(f: TextIO, key: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    テキストストリームから最初の "key": [...] の要素を1つずつ読み出す（ファイル全体を読み込まない）。
+    JSON 文字列の中の引用符は必ずエスケープされるため、run のテキストに "key" が含まれていても誤検出しない。
+    """
+    pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buf = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+        match = pattern.search(buf)
+        if match:
+            buf = buf[match.end():]
+            break
+        # キーがチャンクの境目にまたがる場合に備えて末尾だけ残す
+        buf = buf[-256:]
+
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        # 要素間の空白とカンマを読み飛ばす
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            if pos >= len(buf):
+                raise json.JSONDecodeError("need more data", buf, pos)
+            value, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield value
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
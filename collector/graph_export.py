@@ -0,0 +1,211 @@
+import heapq
+from itertools import groupby
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collector.serializer import GraphExportConfig
+
+# 枝刈りした兄弟エッジをまとめたエッジのラベル
+OTHER_LABEL = "(other)"
+
+def _sibling_groups(edges: Iterable[dict]) -> Iterator[Tuple[int, List[dict]]]:
+    """
+    同じ親から出るエッジをまとめて返す。
+    iter_edges（親ID順）・iter_compressed_edges（深さ優先）のどちらも、
+    親ごとのエッジが連続し、ノードへ入るエッジがそのノードから出るエッジより先に来る。
+    """
+    for parent, group in groupby(edges, key=lambda e: e["from"]):
+        yield parent, list(group)
+
+def _with_p(e: dict, p: Optional[float]) -> dict:
+    # 出力するエッジのキーだけを残す（iter_compressed_edges の depth は深さの計算にだけ使う）
+    return {"from": e["from"], "to": e["to"], "ch": e["ch"], "count": e["count"], "p": p}
+
+def annotate_edges(edges: Iterable[dict]) -> Iterator[dict]:
+    """
+    各エッジに条件付き確率 p（同じ親から出る遷移の合計に対する割合）を付けて返す。
+    保持するのは兄弟エッジだけなので、エッジ全体を展開しない。
+    """
+    for _, group in _sibling_groups(edges):
+        total = sum(e["count"] for e in group)
+        for e in group:
+            yield _with_p(e, e["count"] / total if total else None)
+
+def focus_subtree(edges: Iterable[dict], prefix: str) -> Iterator[dict]:
+    """
+    ルートから prefix をたどった先のノードを根とする部分木のエッジだけを返す（ノードIDは元のまま）。
+    圧縮エッジの途中で prefix が終わる場合は、そのエッジの終点を根にする。prefix をたどれなければ何も返さない。
+    保持するのは部分木のノードIDだけ。
+    """
+    current, rest = 0, prefix
+    members: Optional[Set[int]] = {0} if not prefix else None
+    for parent, group in _sibling_groups(edges):
+        if members is None:
+            if parent != current:
+                continue
+            for e in group:
+                if rest.startswith(e["ch"]) or e["ch"].startswith(rest):
+                    current, rest = e["to"], rest[len(e["ch"]):]
+                    break
+            else:
+                return
+            if not rest:
+                members = {current}
+            continue
+        if parent in members:
+            for e in group:
+                members.add(e["to"])
+                yield e
+
+def _child_depth(e: dict, parent_depth: int, depths: Optional[Dict[int, int]]) -> int:
+    """
+    エッジの行き先の深さ。エッジに depth があれば（iter_compressed_edges）それを、無ければ depths を使い、
+    どちらも無ければ親の深さ + 1（圧縮していないグラフでは1エッジが1文字・1トークン）とする。
+    """
+    if "depth" in e:
+        return e["depth"]
+    if depths is not None:
+        return depths[e["to"]]
+    return parent_depth + 1
+
+def _append_others(nodes: List[dict], edges: List[dict], others: List[dict], max_id: int):
+    # "other" の行き先は既存のどのノードIDとも重ならないよう、最大IDの後ろに採番する
+    for i, other in enumerate(others, start=max_id + 1):
+        nodes.append({"id": i, "depth": other["depth"]})
+        edges.append({"from": other["from"], "to": i, "ch": OTHER_LABEL, "count": other["count"], "p": other["p"]})
+
+def prune_graph(
+    edges: Iterable[dict],
+    config: GraphExportConfig,
+    depths: Optional[Dict[int, int]] = None
+) -> Tuple[List[dict], List[dict]]:
+    """
+    エッジを1回走査しながら枝刈りし、残したノードとエッジ（p 付き）を返す。
+    最初のエッジの親を根とする（focus_subtree の出力もそのまま渡せる）。
+
+    - 残したノードから出るエッジだけを見る（刈った部分木は読み飛ばす）
+    - count < min_count、p < min_p のエッジと、上位 top_k 件（count の多い順）に入らないエッジは刈る
+    - 刈ったエッジの回数は親ごとに1本の OTHER_LABEL エッジにまとめる（行き先は末尾に追加する葉ノード）
+    - 深さ max_depth 以上のノードは展開しない
+
+    ノードの深さは _child_depth で決める（圧縮エッジのラベルの文字数はトークン数と一致しないので使わない）。
+    圧縮グラフをファイルから読む場合など、エッジに depth が無いときは depths を渡すこと。
+    "other" の葉の深さは、まとめた子のうち最も浅いものの深さにする。
+    max_depth は根からの相対的な深さで判定する（根の深さは depths があればそこから、無ければ 0）。
+    """
+    kept: Dict[int, int] = {}
+    nodes: List[dict] = []
+    pruned_edges: List[dict] = []
+    others: List[dict] = []
+    max_id = 0
+    root_depth = 0
+
+    for parent, group in _sibling_groups(edges):
+        if not nodes:
+            root_depth = depths[parent] if depths is not None else 0
+            kept[parent] = root_depth
+            nodes.append({"id": parent, "depth": root_depth})
+        max_id = max(max_id, parent, *(e["to"] for e in group))
+        parent_depth = kept.get(parent)
+        if parent_depth is None:
+            continue
+        if config.max_depth is not None and parent_depth - root_depth >= config.max_depth:
+            continue
+
+        total = sum(e["count"] for e in group)
+        candidates = [
+            e for e in group
+            if e["count"] >= config.min_count and (total and e["count"] / total >= config.min_p)
+        ]
+        if config.top_k is not None and len(candidates) > config.top_k:
+            # 同数のときは元の順序（挿入順）を優先する
+            candidates = sorted(candidates, key=lambda e: -e["count"])[:config.top_k]
+        keep = {e["to"] for e in candidates}
+
+        other_count = 0
+        other_depth = None
+        for e in group:
+            depth = _child_depth(e, parent_depth, depths)
+            if e["to"] not in keep:
+                other_count += e["count"]
+                other_depth = depth if other_depth is None else min(other_depth, depth)
+                continue
+            kept[e["to"]] = depth
+            nodes.append({"id": e["to"], "depth": depth})
+            pruned_edges.append(_with_p(e, e["count"] / total))
+        if other_count:
+            others.append({"from": parent, "depth": other_depth, "count": other_count, "p": other_count / total})
+
+    _append_others(nodes, pruned_edges, others, max_id)
+    return nodes, pruned_edges
+
+def level_of_detail(edges_factory: Callable[[], Iterable[dict]], budget: int) -> Tuple[List[dict], List[dict]]:
+    """
+    出現回数の多い順に最大 budget 個のノードを選び、根から連結した部分木として返す（詳細度の制限）。
+
+    子への回数は親への回数を超えないので、(回数の降順, 出現順) の上位 budget 件は必ず親も含む。
+    1回目の走査では大きさ budget のヒープだけを保持し、2回目の走査で残した親ごとの遷移の合計を数えて
+    p と、選ばれなかった子をまとめた "other" エッジを作る。edges_factory は呼ぶたびに同じエッジ列を最初から返すこと。
+    ノードの深さは prune_graph と同じく _child_depth で決める（根の深さは 0）。
+    """
+    heap: List[Tuple[int, int, dict]] = []
+    root = None
+    max_id = 0
+    for seq, e in enumerate(edges_factory()):
+        if root is None:
+            root = e["from"]
+        max_id = max(max_id, e["from"], e["to"])
+        item = (e["count"], -seq, e)
+        if len(heap) < budget:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+    if root is None:
+        return [], []
+
+    selected = sorted(heap, key=lambda item: -item[1])
+    kept: Dict[int, int] = {root: 0}
+    kept_mass: Dict[int, int] = {}
+    for _, _, e in selected:
+        kept[e["to"]] = _child_depth(e, kept[e["from"]], None)
+        kept_mass[e["from"]] = kept_mass.get(e["from"], 0) + e["count"]
+
+    totals: Dict[int, int] = {}
+    other_depths: Dict[int, int] = {}
+    for parent, group in _sibling_groups(edges_factory()):
+        if parent in kept:
+            totals[parent] = sum(e["count"] for e in group)
+            dropped = [_child_depth(e, kept[parent], None) for e in group if e["to"] not in kept]
+            if dropped:
+                other_depths[parent] = min(dropped)
+
+    nodes = [{"id": root, "depth": 0}]
+    edges = []
+    for _, _, e in selected:
+        nodes.append({"id": e["to"], "depth": kept[e["to"]]})
+        edges.append(_with_p(e, e["count"] / totals[e["from"]]))
+    others = [
+        {"from": parent, "depth": other_depths[parent], "count": total - kept_mass.get(parent, 0),
+         "p": (total - kept_mass.get(parent, 0)) / total}
+        for parent, total in totals.items() if total > kept_mass.get(parent, 0)
+    ]
+    _append_others(nodes, edges, others, max_id)
+    return nodes, edges
+
+def _compressed_nodes(aggregator) -> Iterator[dict]:
+    # 圧縮グラフのノードは根と各エッジの行き先（エッジをもう1回走査して作る）
+    yield {"id": 0, "depth": 0}
+    for e in aggregator.iter_compressed_edges():
+        yield {"id": e["to"], "depth": e["depth"]}
+
+def export_graph(aggregator, compress: bool = False, config: Optional[GraphExportConfig] = None):
+    """
+    アグリゲーターから出力用の (nodes, edges) を作る。エッジには p を付ける。
+    枝刈りしない場合は nodes / edges ともにイテレータのまま返し、出力へ直接流せるようにする。
+    圧縮する場合もエッジは iter_compressed_edges から1件ずつ読む（全ノード・全エッジのリストを作らない）。
+    """
+    if compress:
+        nodes, edges = _compressed_nodes(aggregator), aggregator.iter_compressed_edges()
+    else:
+        nodes, edges = aggregator.iter_nodes(), aggregator.iter_edges()
+    if config is None or config.is_noop():
+        return nodes, annotate_edges(edges)
+    return prune_graph(edges, config)
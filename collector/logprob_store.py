@@ -0,0 +1,179 @@
+import json
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from collector.file_io import strip_compression_suffix
+from collector.serializer import LogprobContent
+
+# ファイル形式:
+#   MAGIC (8 bytes) | ヘッダ長 (uint32 LE) | ヘッダ JSON
+#   | present (int8, run ごと) | run_offsets (int64, runs+1) | token_ids (int32) | logprobs (float32)
+#   | top_offsets (int64, positions+1) | top_token_ids (int32) | top_logprobs (float32)
+#   | token_lengths (int32) | bytes_lengths (int32, -1 は None) | トークン (UTF-8) | バイト列
+# 行 i は出力 JSON の runs[i] に対応する。トークンは (文字列, bytes) の組で辞書化して1度だけ保存する。
+MAGIC = b"LSCLOGP1"
+_HEADER_LEN = struct.Struct("<I")
+
+def logprobs_path(output_path) -> Path:
+    """出力 JSON と同じ場所に置くサイドカーのパス（run-xxx.json / run-xxx.json.gz → run-xxx.logprobs.bin）"""
+    path = strip_compression_suffix(output_path)
+    return path.with_name(path.stem + ".logprobs.bin")
+
+class LogprobTable:
+    """
+    デバッグモードの logprobs を列指向で保持する。
+
+    トークンごとの dict（bytes は int のリスト、top_logprobs も dict のリスト）を持つ代わりに、
+    トークン辞書の id 配列・float32 の logprob 配列と、run / トークンごとのオフセット配列に分解する。
+    run ごとの dict / LogprobContent は必要になったときに rows から組み立てる。
+    """
+
+    def __init__(self):
+        self.present = array("b")
+        self.run_offsets = array("q", [0])
+        self.token_ids = array("i")
+        self.logprobs = array("f")
+        self.top_offsets = array("q", [0])
+        self.top_token_ids = array("i")
+        self.top_logprobs = array("f")
+        self.tokens: List[str] = []
+        self.token_bytes: List[Optional[bytes]] = []
+        self._token_index: Dict[Tuple[str, Optional[bytes]], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.present)
+
+    def _token_id(self, token: str, raw) -> int:
+        raw = bytes(raw) if raw is not None else None
+        key = (token, raw)
+        token_id = self._token_index.get(key)
+        if token_id is None:
+            token_id = self._token_index[key] = len(self.tokens)
+            self.tokens.append(token)
+            self.token_bytes.append(raw)
+        return token_id
+
+    def append(self, logprobs: Optional[Iterable[dict]]) -> int:
+        """1 run 分の logprobs（Runner が返す dict のリスト、または None）を追加し、行番号を返す"""
+        self.present.append(logprobs is not None)
+        for lp in logprobs or ():
+            self.token_ids.append(self._token_id(lp["token"], lp.get("bytes")))
+            self.logprobs.append(lp["logprob"])
+            for top in lp.get("top_logprobs") or ():
+                self.top_token_ids.append(self._token_id(top["token"], top.get("bytes")))
+                self.top_logprobs.append(top["logprob"])
+            self.top_offsets.append(len(self.top_token_ids))
+        self.run_offsets.append(len(self.token_ids))
+        return len(self.present) - 1
+
+    @classmethod
+    def from_runs(cls, runs: Iterable[dict]) -> "LogprobTable":
+        table = cls()
+        for run in runs:
+            table.append(run.get("logprobs"))
+        return table
+
+    def _entry(self, token_id: int, logprob: float) -> dict:
+        raw = self.token_bytes[token_id]
+        return {"token": self.tokens[token_id], "logprob": logprob, "bytes": list(raw) if raw is not None else None}
+
+    def dicts(self, row: int) -> Optional[List[dict]]:
+        """行 row の logprobs を Runner の出力と同じ dict のリストとして組み立てる"""
+        if not self.present[row]:
+            return None
+        result = []
+        for pos in range(self.run_offsets[row], self.run_offsets[row + 1]):
+            entry = self._entry(self.token_ids[pos], self.logprobs[pos])
+            entry["top_logprobs"] = [
+                self._entry(self.top_token_ids[k], self.top_logprobs[k])
+                for k in range(self.top_offsets[pos], self.top_offsets[pos + 1])
+            ]
+            result.append(entry)
+        return result
+
+    def content(self, row: int) -> Optional[List[LogprobContent]]:
+        """行 row の logprobs を RunResult.logprobs と同じ LogprobContent のリストとして返す"""
+        entries = self.dicts(row)
+        return None if entries is None else [LogprobContent(**e) for e in entries]
+
+    def save(self, path):
+        """一時ファイルに書いてから置き換える（スナップショットと同じ手順）"""
+        encoded = [t.encode("utf-8") for t in self.tokens]
+        header = {
+            "byteorder": sys.byteorder,
+            "runs": len(self.present),
+            "positions": len(self.token_ids),
+            "top_positions": len(self.top_token_ids),
+            "tokens": len(self.tokens),
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LEN.pack(len(header_bytes)))
+            f.write(header_bytes)
+            for arr in (
+                self.present, self.run_offsets, self.token_ids, self.logprobs,
+                self.top_offsets, self.top_token_ids, self.top_logprobs,
+                array("i", [len(b) for b in encoded]),
+                array("i", [len(b) if b is not None else -1 for b in self.token_bytes]),
+            ):
+                arr.tofile(f)
+            f.write(b"".join(encoded))
+            f.write(b"".join(b for b in self.token_bytes if b is not None))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> Optional["LogprobTable"]:
+        """サイドカーを読み込む。ファイルが無い・壊れている場合は None を返す"""
+        path = Path(path)
+        if not path.exists():
+            return None
+        data = path.read_bytes()
+        if data[:len(MAGIC)] != MAGIC:
+            return None
+        offset = len(MAGIC)
+        (header_len,) = _HEADER_LEN.unpack_from(data, offset)
+        offset += _HEADER_LEN.size
+        header = json.loads(data[offset:offset + header_len])
+        offset += header_len
+        swap = header["byteorder"] != sys.byteorder
+
+        def read(typecode: str, length: int) -> array:
+            nonlocal offset
+            arr = array(typecode)
+            end = offset + arr.itemsize * length
+            arr.frombytes(data[offset:end])
+            if swap:
+                arr.byteswap()
+            offset = end
+            return arr
+
+        table = cls()
+        table.present = read("b", header["runs"])
+        table.run_offsets = read("q", header["runs"] + 1)
+        table.token_ids = read("i", header["positions"])
+        table.logprobs = read("f", header["positions"])
+        table.top_offsets = read("q", header["positions"] + 1)
+        table.top_token_ids = read("i", header["top_positions"])
+        table.top_logprobs = read("f", header["top_positions"])
+        token_lengths = read("i", header["tokens"])
+        bytes_lengths = read("i", header["tokens"])
+        for length in token_lengths:
+            table.tokens.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+        for length in bytes_lengths:
+            if length < 0:
+                table.token_bytes.append(None)
+                continue
+            table.token_bytes.append(data[offset:offset + length])
+            offset += length
+        table._token_index = {key: i for i, key in enumerate(zip(table.tokens, table.token_bytes))}
+        return table
@@ -0,0 +1,293 @@
+import asyncio
+import bisect
+import contextlib
+import json
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 秒単位のヒストグラムの上限（Prometheus の le）。最後のバケットは +Inf。
+# Trie への挿入など1回がマイクロ秒単位の同期処理も測るため、1ms 未満も刻む
+SECONDS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _label(value: str) -> str:
+    """Prometheus のラベル値（\\ と " と改行をエスケープする）"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+class Histogram:
+    """
+    固定バケットのヒストグラム（Prometheus の histogram と同じ累積バケットで出力する）。
+    観測値を保持しないので、件数によらずメモリは一定。分位点はバケット内の線形補間で推定する。
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """histogram_quantile と同じ推定（+Inf のバケットに入る場合は観測した最大値を返す）"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.max
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = min(self.buckets[i], self.max)
+                return lower + (upper - lower) * max(0.0, rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max if self.count else None
+        }
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """(le, 累積件数) を返す"""
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            total += count
+            yield ("+Inf" if bound == float("inf") else repr(bound)), total
+
+class RunMetrics:
+    """
+    1つの収集（設定）の実行時メトリクス。Runner と収集処理が更新する。
+
+    - request_latency: API 呼び出し1回のレイテンシ（成功・失敗とも。ストリーミング時は最後のチャンクまで）
+    - time_to_first_token: ストリーミング時、リクエスト開始から各 choice の最初の文字が届くまでの時間
+    - queue_wait: 同時実行枠（semaphore / AIMD）を得るまでの待ち時間
+    - budget_wait: RPM / TPM のトークンバケットを待った時間
+    - in_flight: 実行中のリクエスト数（と最大値）
+    - tokens: usage の入力・出力トークン数（毎秒の出力トークン数は経過時間で割って求める）
+    - errors: エラーの種類ごとの件数（429 の再試行は retries に数える）
+    - timings: イベントループ上で同期的に実行した処理（Trie への挿入、ランログ、出力の書き出しなど）の所要時間
+    - event_loop_lag: 一定間隔で眠るタスクの寝過ごし時間（同期処理がイベントループを止めていた時間の目安）
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.request_latency = Histogram()
+        self.time_to_first_token = Histogram()
+        self.queue_wait = Histogram()
+        self.budget_wait = Histogram()
+        self.event_loop_lag = Histogram()
+        self.timings: Dict[str, Histogram] = {}
+        self.requests = 0
+        self.retries = 0
+        self.results = 0
+        self.ok = 0
+        self.errors: Counter = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """with ブロックの所要時間を timings[name] に記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.observe(time.perf_counter() - started)
+
+    def request_started(self):
+        self.requests += 1
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def request_finished(self, latency: float):
+        self.in_flight -= 1
+        self.request_latency.observe(latency)
+
+    def add_usage(self, usage):
+        if usage:
+            self.input_tokens += usage.prompt_tokens or 0
+            self.output_tokens += usage.completion_tokens or 0
+
+    def result(self, result: dict):
+        self.results += 1
+        if result.get("status") == "ok":
+            self.ok += 1
+        else:
+            self.errors[result.get("error", {}).get("type", "unknown")] += 1
+
+    async def watch_event_loop(self, interval: float = 0.1):
+        """キャンセルされるまで、interval 秒ごとに寝過ごした時間を記録する"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            self.event_loop_lag.observe(max(0.0, time.monotonic() - started - interval))
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "elapsed_seconds": elapsed,
+            "requests": self.requests,
+            "retries": self.retries,
+            "results": {"total": self.results, "ok": self.ok, "errors": dict(self.errors)},
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "tokens": {
+                "input": self.input_tokens,
+                "output": self.output_tokens,
+                "output_per_second": self.output_tokens / elapsed if elapsed > 0 else None
+            },
+            "results_per_second": self.results / elapsed if elapsed > 0 else None,
+            "request_latency": self.request_latency.summary(),
+            "time_to_first_token": self.time_to_first_token.summary(),
+            "queue_wait": self.queue_wait.summary(),
+            "budget_wait": self.budget_wait.summary(),
+            "event_loop_lag": self.event_loop_lag.summary(),
+            "timings": {name: histogram.summary() for name, histogram in self.timings.items()}
+        }
+
+    def prometheus_lines(self, labels: str) -> List[str]:
+        """Prometheus のテキスト形式の行（# TYPE 行を除く）。labels は 'config="..."' のような文字列"""
+        lines = [
+            f"collector_requests_total{{{labels}}} {self.requests}",
+            f"collector_retries_total{{{labels}}} {self.retries}",
+            f'collector_results_total{{{labels},status="ok"}} {self.ok}',
+            f"collector_in_flight{{{labels}}} {self.in_flight}",
+            f'collector_tokens_total{{{labels},kind="input"}} {self.input_tokens}',
+            f'collector_tokens_total{{{labels},kind="output"}} {self.output_tokens}',
+        ]
+        for error_type, count in self.errors.items():
+            lines.append(f'collector_errors_total{{{labels},type={_label(error_type)}}} {count}')
+        histograms = [
+            ("collector_request_latency_seconds", "", self.request_latency),
+            ("collector_time_to_first_token_seconds", "", self.time_to_first_token),
+            ("collector_queue_wait_seconds", "", self.queue_wait),
+            ("collector_budget_wait_seconds", "", self.budget_wait),
+            ("collector_event_loop_lag_seconds", "", self.event_loop_lag),
+        ] + [
+            ("collector_sync_seconds", f',stage={_label(name)}', histogram) for name, histogram in self.timings.items()
+        ]
+        for name, extra, histogram in histograms:
+            for le, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{labels}{extra},le="{le}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}{extra}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}{extra}}} {histogram.count}")
+        return lines
+
+# 各メトリクスの型（# TYPE 行）
+_PROMETHEUS_TYPES = {
+    "collector_requests_total": "counter",
+    "collector_retries_total": "counter",
+    "collector_results_total": "counter",
+    "collector_in_flight": "gauge",
+    "collector_tokens_total": "counter",
+    "collector_errors_total": "counter",
+    "collector_request_latency_seconds": "histogram",
+    "collector_time_to_first_token_seconds": "histogram",
+    "collector_queue_wait_seconds": "histogram",
+    "collector_budget_wait_seconds": "histogram",
+    "collector_event_loop_lag_seconds": "histogram",
+    "collector_sync_seconds": "histogram",
+}
+
+def render_prometheus(registry: Dict[str, RunMetrics]) -> str:
+    """設定ごとの RunMetrics を Prometheus のテキスト形式にまとめる（同じ名前の行を # TYPE の下に並べる）"""
+    lines_by_name: Dict[str, List[str]] = {name: [] for name in _PROMETHEUS_TYPES}
+    for config, metrics in registry.items():
+        for line in metrics.prometheus_lines(f"config={_label(config)}"):
+            name = line.split("{", 1)[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[:-len(suffix)] in lines_by_name:
+                    name = name[:-len(suffix)]
+                    break
+            lines_by_name[name].append(line)
+    out = []
+    for name, lines in lines_by_name.items():
+        if lines:
+            out.append(f"# TYPE {name} {_PROMETHEUS_TYPES[name]}")
+            out.extend(lines)
+    return "\n".join(out) + "\n"
+
+class MetricsServer:
+    """
+    /metrics で Prometheus のテキスト形式を返す、ローカル専用の最小限の HTTP サーバー（asyncio のみで動く）。
+    スイープでは設定ごとの RunMetrics を config ラベルで区別して登録する。
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.registry: Dict[str, RunMetrics] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def register(self, config: str, metrics: RunMetrics):
+        self.registry[config] = metrics
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # ヘッダは読み捨てる
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render_prometheus(self.registry).encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def write_metrics_file(path: str, metrics: RunMetrics):
+    """メトリクスを JSON に書く（置き換えで確定するので、読み手が書きかけのファイルを見ることはない）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metrics.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+async def publish_metrics(metrics: RunMetrics, path: Optional[str], interval: float):
+    """キャンセルされるまで、イベントループの遅れを計測しながら interval 秒ごとにメトリクスファイルを書き直す"""
+    watcher = asyncio.create_task(metrics.watch_event_loop())
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            if path:
+                write_metrics_file(path, metrics)
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
@@ -0,0 +1,92 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional
+from collector.serializer import NormalizationConfig
+
+# 適用順に並べた規則と、--normalize を値なしで指定したときに有効にする規則
+RULES = ("nfkc", "punctuation", "whitespace", "strip", "casefold", "trailing_punctuation")
+DEFAULT_RULES = ("nfkc", "punctuation", "whitespace", "strip")
+
+# 表記揺れする記号を代表の文字に寄せる（全角の ！？，． などは NFKC で半角になる）
+_PUNCTUATION = str.maketrans({
+    "“": '"', "”": '"', "„": '"', "‟": '"', "″": '"',
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'",
+    "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-", "―": "-", "−": "-",
+    "〜": "~", "～": "~",
+})
+_WHITESPACE = re.compile(r"\s+")
+# 和文の句読点・括弧の前後の空白（「、 」と「、」のような揺れ）は取り除く
+_CJK_PUNCTUATION_SPACE = re.compile(r"\s+(?=[、。「」『』【】・])|(?<=[、。「」『』【】・])\s+")
+# 文末の句読点・感嘆符・疑問符（と、その後ろの空白）
+_TRAILING_PUNCTUATION = re.compile(r"[。．.！!？?]+\s*$")
+
+def _nfkc(text: str) -> str:
+    return unicodedata.normalize("NFKC", text)
+
+def _punctuation(text: str) -> str:
+    return text.translate(_PUNCTUATION)
+
+def _whitespace(text: str) -> str:
+    return _WHITESPACE.sub(" ", _CJK_PUNCTUATION_SPACE.sub("", text))
+
+def _strip(text: str) -> str:
+    return text.strip()
+
+def _casefold(text: str) -> str:
+    return text.casefold()
+
+def _trailing_punctuation(text: str) -> str:
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+_STEPS: Dict[str, Callable[[str], str]] = {
+    "nfkc": _nfkc,
+    "punctuation": _punctuation,
+    "whitespace": _whitespace,
+    "strip": _strip,
+    "casefold": _casefold,
+    "trailing_punctuation": _trailing_punctuation,
+}
+
+def normalization_config(rules: Optional[Iterable[str]]) -> NormalizationConfig:
+    """
+    --normalize の値から NormalizationConfig を作る。
+    None なら無効、空なら DEFAULT_RULES、それ以外は指定した規則だけを有効にする（rules には全規則の有無を記録する）。
+    """
+    if rules is None:
+        return NormalizationConfig(enabled=False)
+    enabled = set(rules) or set(DEFAULT_RULES)
+    unknown = enabled - set(RULES)
+    if unknown:
+        raise ValueError(f"unknown normalization rules: {sorted(unknown)} (allowed: {', '.join(RULES)})")
+    return NormalizationConfig(enabled=True, rules={rule: rule in enabled for rule in RULES})
+
+def enabled_rules(config: NormalizationConfig) -> List[str]:
+    """有効な規則を適用順に返す"""
+    if not config.enabled:
+        return []
+    return [rule for rule in RULES if config.rules.get(rule)]
+
+class Normalizer:
+    """
+    NormalizationConfig の有効な規則を、生成時に関数の列へ組み立てておいて順に適用する。
+    同じ回答が何度も返るので、結果はテキストごとにキャッシュする。
+    """
+
+    def __init__(self, config: NormalizationConfig, cache_size: int = 1 << 16):
+        self.config = config
+        self.rules = enabled_rules(config)
+        steps = [_STEPS[rule] for rule in self.rules]
+
+        def normalize(text: str) -> str:
+            for step in steps:
+                text = step(text)
+            return text
+
+        self._normalize = lru_cache(maxsize=cache_size)(normalize)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def __call__(self, text: str) -> str:
+        return self._normalize(text)
@@ -0,0 +1,269 @@
+import bisect
+import heapq
+import itertools
+import json
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from collector.file_io import iter_json_array, open_text
+from collector.graph_export import OTHER_LABEL
+
+class TrieIndex:
+    """
+    集計済みの Trie（Aggregator / ArrayAggregator / RadixAggregator、または出力ファイルの graph.edges）への問い合わせ用の索引。
+
+    ノードIDごとのフラット配列（親・ラベル・遷移回数）と、親ごとに子をラベル順に並べた CSR 形式の子リスト
+    （start[node]..start[node + 1] が node の子の範囲）を持つ。prefix のたどり方は focus_subtree と同じで、
+    各ノードでは子の範囲を二分探索するだけなので、接頭辞の検索は O(prefix の長さ × log 分岐数)、
+    ノードから回答文字列への復元は親をたどる O(深さ) で済み、エッジ全体を走査しない。
+    圧縮エッジ（複数文字のラベル）もそのまま扱い、prefix がエッジの途中で終わる場合はそのエッジの終点に着いたとみなす。
+    トークン単位のグラフ（BPE など）では先頭の文字が同じ兄弟が複数ありうるので、prefix に一致する経路は全てたどり、回数を合計する。
+
+    確率の分母 total はルートから出る遷移の合計（空の回答は数えない）。
+    各ノードで終わった回答の数は、そのノードへの遷移回数から子への遷移回数の合計を引いて求める。
+    """
+
+    def __init__(self, parent: Sequence[int], count: Sequence[int], labels: List[Optional[str]], total: Optional[int] = None):
+        size = len(parent)
+        self.parent = parent if isinstance(parent, array) else array("i", parent)
+        # ArrayAggregator.export_arrays は内部の配列をそのまま返すので、ルートの回数を書き込む count は複製する
+        self.count = array("q", count)
+        self.labels = labels
+        # 子の数を数えてから各親の範囲へ詰める（ノードID順なので兄弟の並びは挿入順になる）
+        start = array("i", [0]) * (size + 1)
+        for node in range(size):
+            p = self.parent[node]
+            if p >= 0:
+                start[p + 1] += 1
+        for node in range(size):
+            start[node + 1] += start[node]
+        fill = array("i", start)
+        children = array("i", [0]) * start[size]
+        for node in range(size):
+            p = self.parent[node]
+            if p >= 0:
+                children[fill[p]] = node
+                fill[p] += 1
+        # 二分探索できるよう、兄弟が2つ以上ある範囲だけラベル順に並べ直す
+        for node in range(size):
+            lo, hi = start[node], start[node + 1]
+            if hi - lo > 1:
+                children[lo:hi] = array("i", sorted(children[lo:hi], key=labels.__getitem__))
+        self.start = start
+        self.children = children
+        self.count[0] = sum(self.count[c] for c in children[start[0]:start[1]]) if total is None else total
+
+    @classmethod
+    def from_arrays(cls, parent, label, count, labels: List[str], total: Optional[int] = None) -> "TrieIndex":
+        """export_arrays の (parent, label, count, labels) から作る"""
+        return cls(parent, count, [labels[l] if l >= 0 else None for l in label], total)
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[dict], total: Optional[int] = None) -> "TrieIndex":
+        """
+        graph.edges（圧縮・枝刈り済みでもよい）から作る。エッジは1件ずつ読むので、ストリームをそのまま渡せる。
+        圧縮グラフのノードIDは飛び飛びになるため、使われていないIDは親 -1 の空きとして持つ。
+        """
+        parent = array("i", [-1])
+        count = array("q", [0])
+        labels: List[Optional[str]] = [None]
+        for e in edges:
+            to = e["to"]
+            if to >= len(parent):
+                grow = to + 1 - len(parent)
+                parent.extend(array("i", [-1]) * grow)
+                count.extend(array("q", [0]) * grow)
+                labels.extend([None] * grow)
+            parent[to] = e["from"]
+            count[to] = e["count"]
+            labels[to] = e["ch"]
+        return cls(parent, count, labels, total)
+
+    @classmethod
+    def load(cls, path: str) -> "TrieIndex":
+        """出力ファイル（.json / .json.gz / .json.zst）の graph.edges から作る（runs は読まない）"""
+        with open_text(path) as f:
+            return cls.from_edges(iter_json_array(f, "edges"))
+
+    @property
+    def total(self) -> int:
+        return self.count[0]
+
+    def _matching_children(self, node: int, rest: str) -> Iterator[int]:
+        # rest の先頭と最初の文字が同じ子は、ラベル順に並べた範囲の中で連続している
+        lo, hi = self.start[node], self.start[node + 1]
+        labels = self.labels
+        i = bisect.bisect_left(self.children, rest[0], lo, hi, key=labels.__getitem__)
+        while i < hi:
+            label = labels[self.children[i]]
+            if label[0] != rest[0]:
+                break
+            if label != OTHER_LABEL and (rest.startswith(label) or label.startswith(rest)):
+                yield self.children[i]
+            i += 1
+
+    def _locate(self, prefix: str) -> List[Tuple[int, str]]:
+        """
+        prefix をたどった先の (ノードID, そのノードへのエッジのうち prefix より後ろの部分) の一覧。たどれなければ空。
+        トークン単位のグラフでは "a" → "b" と "ab" のように同じ文字列に当たる兄弟が複数あるので、一致する子を全て展開する。
+        返すノードの部分木は互いに重ならないので、回数はそのまま足し合わせられる。
+        """
+        located: List[Tuple[int, str]] = []
+        stack = [(0, 0)]
+        while stack:
+            node, pos = stack.pop()
+            if pos == len(prefix):
+                located.append((node, ""))
+                continue
+            children = list(self._matching_children(node, prefix[pos:]))
+            # ラベル順に取り出せるよう逆順に積む
+            for child in reversed(children):
+                label = self.labels[child]
+                if pos + len(label) > len(prefix):
+                    located.append((child, label[len(prefix) - pos:]))
+                else:
+                    stack.append((child, pos + len(label)))
+        return located
+
+    def _children(self, node: int) -> Iterator[int]:
+        for i in range(self.start[node], self.start[node + 1]):
+            yield self.children[i]
+
+    def _ended(self, node: int) -> int:
+        """node で終わった回答の数"""
+        return self.count[node] - sum(self.count[c] for c in self._children(node))
+
+    def node_id(self, prefix: str) -> Optional[int]:
+        """
+        prefix をたどった先のノードID（圧縮エッジの途中で終わる場合はその終点）。たどれなければ None。
+        トークン単位のグラフで複数のノードに当たる場合は最初のもの（回数は prefix_count で合計を見る）。
+        """
+        located = self._locate(prefix)
+        return located[0][0] if located else None
+
+    def path(self, node_id: int) -> str:
+        """ルートから node_id までのラベルを連結した文字列（親をたどって復元する）"""
+        parts = []
+        while node_id > 0:
+            parts.append(self.labels[node_id])
+            node_id = self.parent[node_id]
+        return "".join(reversed(parts))
+
+    def prefix_count(self, prefix: str) -> int:
+        """prefix で始まる回答の数"""
+        return sum(self.count[node] for node, _ in self._locate(prefix))
+
+    def prefix_probability(self, prefix: str) -> float:
+        """prefix で始まる回答の割合"""
+        return self.prefix_count(prefix) / self.total if self.total else 0.0
+
+    def continuations(self, prefix: str, k: Optional[int] = 5) -> List[Dict[str, Any]]:
+        """
+        prefix の直後に続くラベルを回数の多い順に k 件（None なら全件）返す。p は prefix で始まる回答に対する割合。
+        prefix で終わる回答は text が空で end が True の候補になる。圧縮エッジの途中では、続きは残りのラベル1つだけ。
+        prefix が複数のノードに当たる場合は、同じ続きの回数を足し合わせる。
+        """
+        located = self._locate(prefix)
+        if not located:
+            return []
+        total = 0
+        merged: Dict[Tuple[str, bool], int] = {}
+        for node, rest in located:
+            total += self.count[node]
+            if rest:
+                merged[(rest, False)] = merged.get((rest, False), 0) + self.count[node]
+                continue
+            for c in self._children(node):
+                merged[(self.labels[c], False)] = merged.get((self.labels[c], False), 0) + self.count[c]
+            ended = self._ended(node)
+            if ended > 0:
+                merged[("", True)] = merged.get(("", True), 0) + ended
+        candidates = [(text, count, end) for (text, end), count in merged.items()]
+        if k is not None:
+            candidates = heapq.nlargest(k, candidates, key=lambda item: item[1])
+        else:
+            candidates.sort(key=lambda item: item[1], reverse=True)
+        return [{"text": text, "count": count, "p": count / total if total else None, "end": end} for text, count, end in candidates]
+
+    def answers(self) -> Iterator[Tuple[str, int]]:
+        """全ての（空でない）回答と、その回数を返す（順序はノードID順）"""
+        for node in range(1, len(self.parent)):
+            if self.parent[node] < 0 or self.labels[node] == OTHER_LABEL:
+                continue
+            ended = self._ended(node)
+            if ended > 0:
+                yield self.path(node), ended
+
+    def top_paths(self, k: int = 5, prefix: str = "") -> List[Dict[str, Any]]:
+        """
+        prefix で始まる回答のうち、回数の多いものから k 件を返す（p は全回答に対する割合）。
+        遷移回数は深くなるほど減るので、回数の多い順にノードを展開する最良優先探索で、上位 k 件に必要な部分だけを見る。
+        枝刈りでまとめた "(other)" の先は回答を復元できないので数えない。
+        トークン単位のグラフでは、同じ文字列でも分割の異なる回答は別の件として返す。
+        """
+        # 同じ回数のノードは後から積んだもの（深いもの）から取り出すので、回数が並ぶ部分では深さ優先になる
+        tiebreak = itertools.count(0, -1)
+        # (-回数, 回答の末尾なら 0, 順序, ノードID)。同じ回数なら確定した回答を先に取り出し、余計な展開をしない
+        heap = [(-self.count[node], 1, next(tiebreak), node) for node, _ in self._locate(prefix)]
+        heapq.heapify(heap)
+        paths: List[Dict[str, Any]] = []
+        while heap and len(paths) < k:
+            neg_count, pending, _, node = heapq.heappop(heap)
+            if not pending:
+                paths.append({"text": self.path(node), "count": -neg_count, "p": -neg_count / self.total})
+                continue
+            ended = self._ended(node)
+            if ended > 0:
+                heapq.heappush(heap, (-ended, 0, next(tiebreak), node))
+            for child in self._children(node):
+                if self.labels[child] != OTHER_LABEL:
+                    heapq.heappush(heap, (-self.count[child], 1, next(tiebreak), child))
+        return paths
+
+    def rare_paths(self, threshold: float, prefix: str = "") -> Iterator[Dict[str, Any]]:
+        """
+        prefix で始まる回答のうち、割合（全回答に対する）が threshold 未満になった所を深さ優先で返す。
+        - complete が False: そこで初めて threshold を下回った接頭辞（この先の回答は全て稀なので、それ以上は展開しない）
+        - complete が True: threshold 以上の接頭辞で終わった、割合が threshold 未満の回答
+        threshold 以上の部分だけをたどるので、見るノードは稀な部分木の根までで済む。
+        """
+        located = self._locate(prefix)
+        if not located or not self.total:
+            return
+        limit = threshold * self.total
+        stack = [node for node, _ in reversed(located)]
+        while stack:
+            node = stack.pop()
+            if self.count[node] < limit:
+                yield {"text": self.path(node), "count": self.count[node], "p": self.count[node] / self.total, "complete": False}
+                continue
+            ended = self._ended(node)
+            if 0 < ended < limit:
+                yield {"text": self.path(node), "count": ended, "p": ended / self.total, "complete": True}
+            stack.extend(child for child in self._children(node) if self.labels[child] != OTHER_LABEL)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the aggregated trie of a collector output")
+    parser.add_argument("input", help="Collector output (.json / .json.gz / .json.zst)")
+    parser.add_argument("--prefix", default="", help="Prefix to look up (default: the root)")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of continuations after the prefix")
+    parser.add_argument("--paths", type=int, default=5, help="Number of most likely full answers starting with the prefix")
+    parser.add_argument("--rare", type=float, help="Also list the prefixes / answers whose probability falls below this")
+    parser.add_argument("--limit", type=int, default=100, help="Maximum number of rare entries to print")
+    args = parser.parse_args()
+
+    index = TrieIndex.load(args.input)
+    result = {
+        "prefix": args.prefix,
+        "node_id": index.node_id(args.prefix),
+        "count": index.prefix_count(args.prefix),
+        "total": index.total,
+        "p": index.prefix_probability(args.prefix),
+        "continuations": index.continuations(args.prefix, args.top_k),
+        "paths": index.top_paths(args.paths, args.prefix),
+    }
+    if args.rare is not None:
+        result["rare"] = list(itertools.islice(index.rare_paths(args.rare, args.prefix), args.limit))
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
@@ -0,0 +1,269 @@
+from array import array
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from collector.aggregator import DepthStats, depth_stats_from_counts, split_compressed_edges
+from collector.array_aggregator import ArrayAggregator
+
+if TYPE_CHECKING:
+    from collector.query import TrieIndex
+
+class RadixNode:
+    """
+    Radix Tree の辺（とその終点）。label は親からこのノードまでの文字列（トークン列の場合はタプル）。
+
+    文字単位の Trie では label の各文字が1ノードに当たり、それらのノードIDは
+    first_id から連続している（1つの辺は1回の挿入でまとめて作られ、分割しても連続性は保たれる）。
+    """
+    __slots__ = ("label", "count", "first_id", "depth", "children")
+
+    def __init__(self, label, count: int, first_id: int, depth: int):
+        self.label = label
+        self.count = count
+        self.first_id = first_id
+        # 辺の終点の深さ（文字単位の Trie での深さ）
+        self.depth = depth
+        self.children: Dict[str, "RadixNode"] = {}
+
+    @property
+    def node_id(self) -> int:
+        """辺の終点に当たる、文字単位の Trie でのノードID"""
+        return self.first_id + len(self.label) - 1
+
+class RadixAggregator:
+    """
+    Aggregator と同じAPIを持つ、挿入時にパスを圧縮する Radix Tree 実装。
+
+    分岐のない区間を1本の辺として保持し、途中で分岐が生じたとき・途中でテキストが終わったときだけ辺を分割する。
+    ノードIDは文字単位の Trie と同じ規則で採番するため、get_compressed_graph_data は
+    Aggregator.get_compressed_graph_data と同じ内容を、文字単位の Trie を作らずに返す。
+    長くほとんど分岐しない出力ではノード数が大幅に減る。
+    """
+
+    def __init__(self):
+        self.root = RadixNode("", 0, 0, 0)
+        self._next_id = 1
+        self.depth_stats = DepthStats()
+
+    def __len__(self) -> int:
+        """文字単位の Trie に換算したノード数"""
+        return self._next_id
+
+    def radix_node_count(self) -> int:
+        """実際に保持している辺（Radix ノード）の数（ルートを含む）"""
+        count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children.values())
+        return count
+
+    def load_from_runs(self, runs: List[dict]):
+        """
+        既存の実行結果（runs）をアグリゲーターに読み込む。
+        同一テキストはまとめて1回だけ挿入する。
+        """
+        self.add_many(run.get("text", "") for run in runs if run.get("status") == "ok")
+
+    def add_many(self, texts: Iterable[str]):
+        """同一テキストを集約し、ユニークな文字列ごとに出現回数を重みとして挿入する"""
+        for text, weight in Counter(texts).items():
+            self.add_tokens(text, weight)
+
+    def add_text(self, text: str, weight: int = 1):
+        self.add_tokens(text, weight)
+
+    def _split(self, node: RadixNode, offset: int) -> RadixNode:
+        """node の辺を label[:offset] と label[offset:] に分け、上側の新しいノードを返す"""
+        upper = RadixNode(node.label[:offset], node.count, node.first_id, node.depth - len(node.label) + offset)
+        node.label = node.label[offset:]
+        node.first_id += offset
+        # 元の子（下側）を先に入れ、子の並びを文字単位の Trie の挿入順と一致させる
+        upper.children[node.label[0]] = node
+        return upper
+
+    def add_tokens(self, tokens, weight: int = 1):
+        """トークン（または文字）の列をアグリゲーターに追加する（weight 回分としてカウント）"""
+        if not isinstance(tokens, str):
+            tokens = tuple(tokens)
+        node = self.root
+        pos = 0
+        length = len(tokens)
+        while pos < length:
+            child = node.children.get(tokens[pos])
+            if child is None:
+                # 残りをまとめて1本の辺にする（ID は残りの文字数分を連番で確保）
+                child = RadixNode(tokens[pos:], weight, self._next_id, node.depth + length - pos)
+                self._next_id += length - pos
+                node.children[tokens[pos]] = child
+                break
+            label = child.label
+            # 辺のラベルとの共通部分の長さ（先頭は一致済み）
+            common = 1
+            limit = min(len(label), length - pos)
+            while common < limit and label[common] == tokens[pos + common]:
+                common += 1
+            if common < len(label):
+                # 辺の途中で分岐する・テキストが終わる場合は、そこで分割する
+                child = self._split(child, common)
+                node.children[tokens[pos]] = child
+            child.count += weight
+            node = child
+            pos += common
+        self.depth_stats.add(tokens, weight)
+
+    def merge(self, other):
+        """
+        other を取り込む（Aggregator.merge と同じ採番・子の順序になる）。
+        辺の途中での分岐や回数の加算が絡むため、フラット配列の Trie に展開してマージしてから作り直す。
+        """
+        trie = ArrayAggregator.from_arrays(*self.export_arrays(), self.depth_stats)
+        trie.merge(other)
+        merged = RadixAggregator.from_arrays(*trie.export_arrays(), trie.depth_stats)
+        self.root, self._next_id, self.depth_stats = merged.root, merged._next_id, merged.depth_stats
+
+    def _iter_radix_edges(self) -> Iterator[Tuple[RadixNode, RadixNode]]:
+        """(親, 子) を深さ優先で列挙する"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for child in node.children.values():
+                yield node, child
+                stack.append(child)
+
+    def export_arrays(self) -> Tuple[array, array, array, List[str]]:
+        """文字単位の Trie に展開し、ノードID順のフラット配列 (parent, label, count) とラベル表として返す"""
+        size = self._next_id
+        parent = array("i", [-1]) * size
+        label = array("i", [-1]) * size
+        count = array("q", [0]) * size
+        labels: List[str] = []
+        label_ids: Dict[str, int] = {}
+        for node, child in self._iter_radix_edges():
+            prev = node.node_id if node is not self.root else 0
+            for i, char in enumerate(child.label):
+                label_id = label_ids.get(char)
+                if label_id is None:
+                    label_id = label_ids[char] = len(labels)
+                    labels.append(char)
+                node_id = child.first_id + i
+                parent[node_id] = prev
+                label[node_id] = label_id
+                count[node_id] = child.count
+                prev = node_id
+        return parent, label, count, labels
+
+    @classmethod
+    def from_arrays(cls, parent, label, count, labels: List[str], depth_stats: Optional[DepthStats] = None) -> "RadixAggregator":
+        """
+        export_arrays の逆変換（スナップショットからの復元）。
+        子が1つだけで流量が変わらないノードを辺に連結する。子は親より大きいIDを持つので、ID順の1回の走査で済む。
+        ラベル表に1文字でないもの（トークン）があれば、辺のラベルはトークンのタプルのまま持つ
+        （文字列に連結すると len(label) が文字数になり、node_id がずれるため）。
+        """
+        size = len(parent)
+        child_counts = array("i", [0]) * size
+        for node_id in range(1, size):
+            child_counts[parent[node_id]] += 1
+
+        aggregator = cls()
+        # 辺の終点のノードID -> RadixNode（伸ばしている途中の辺は終点が進むたびに付け替える）
+        ends: Dict[int, RadixNode] = {0: aggregator.root}
+        parts: Dict[int, List[str]] = {}
+        for node_id in range(1, size):
+            p = parent[node_id]
+            char = labels[label[node_id]]
+            node = ends.pop(p) if p != 0 and child_counts[p] == 1 and count[p] == count[node_id] else None
+            if node is not None:
+                # 分岐も途中終了もないので、親の辺を1文字伸ばす
+                parts[id(node)].append(char)
+                node.depth += 1
+            else:
+                parent_node = ends[p]
+                if child_counts[p] == len(parent_node.children) + 1:
+                    # 最後の子を付けたら、この親から伸びる辺はもう無い
+                    ends.pop(p)
+                node = RadixNode(char, count[node_id], node_id, parent_node.depth + 1)
+                parts[id(node)] = [char]
+                parent_node.children[char] = node
+            ends[node_id] = node
+
+        tokenized = any(len(ch) != 1 for ch in labels)
+        for node, child in aggregator._iter_radix_edges():
+            chars = parts.pop(id(child))
+            child.label = tuple(chars) if tokenized else "".join(chars)
+        aggregator._next_id = size
+        if depth_stats is not None:
+            aggregator.depth_stats = depth_stats
+        return aggregator
+
+    def iter_nodes(self) -> Iterator[dict]:
+        """文字単位の Trie のノードを ID 順に返す（辺ごとの連番区間を ID 順に並べて展開する）"""
+        yield {"id": 0, "depth": 0}
+        spans = sorted((child.first_id, child.depth - len(child.label), len(child.label)) for _, child in self._iter_radix_edges())
+        for first_id, start_depth, length in spans:
+            for k in range(length):
+                yield {"id": first_id + k, "depth": start_depth + k + 1}
+
+    def iter_edges(self) -> Iterator[dict]:
+        """文字単位の Trie のエッジを Aggregator.iter_edges と同じ順序（親ID順、各親の中では挿入順）で返す"""
+        parent, label, count, labels = self.export_arrays()
+        # 子は作られた順にIDが振られるので、親IDで安定ソートすれば各親の中は挿入順になる
+        for node_id in sorted(range(1, len(parent)), key=parent.__getitem__):
+            yield {
+                "from": parent[node_id],
+                "to": node_id,
+                "ch": labels[label[node_id]],
+                "count": count[node_id]
+            }
+
+    def index(self) -> "TrieIndex":
+        """接頭辞の問い合わせ用の索引を作る。文字単位に展開せず、圧縮済みの辺から作る"""
+        from collector.query import TrieIndex
+        return TrieIndex.from_edges(self.iter_compressed_edges())
+
+    def get_graph_data(self) -> Tuple[List[dict], List[dict]]:
+        return list(self.iter_nodes()), list(self.iter_edges())
+
+    def iter_compressed_edges(self) -> Iterator[dict]:
+        """
+        パス圧縮済みのエッジを1件ずつ返す。辺がそのまま圧縮後の辺になるので、展開や連結は不要。
+        Aggregator.iter_compressed_edges と同じ順序・内容を出力する。
+        """
+        stack = [self.root]
+        while stack:
+            curr = stack.pop()
+            curr_id = curr.node_id if curr is not self.root else 0
+            for child in curr.children.values():
+                stack.append(child)
+                yield {
+                    "from": curr_id,
+                    "to": child.node_id,
+                    "ch": child.label if isinstance(child.label, str) else "".join(child.label),
+                    "count": child.count,
+                    "depth": child.depth
+                }
+
+    def get_compressed_graph_data(self) -> Tuple[List[dict], List[dict]]:
+        """パス圧縮済みのグラフデータを返す（Aggregator.get_compressed_graph_data と同じ）"""
+        return split_compressed_edges(self.iter_compressed_edges())
+
+    def calculate_stats(self) -> dict:
+        """挿入時に更新している深さ別統計を返す（Trie の再走査なし。コストは Aggregator.calculate_stats と同じ）"""
+        return {
+            "depth_stats": self.depth_stats.to_list()
+        }
+
+    def recalculate_stats(self) -> dict:
+        """全ての辺を走査して深さ別統計を計算し直す（calculate_stats の検証用）"""
+        # 辺の k 文字目は、深さ (辺の始点の深さ + k) からの遷移
+        depth_counts: Dict[int, Dict[str, int]] = {}
+        for _, child in self._iter_radix_edges():
+            start_depth = child.depth - len(child.label)
+            for k, ch in enumerate(child.label):
+                char_counts = depth_counts.setdefault(start_depth + k, {})
+                char_counts[ch] = char_counts.get(ch, 0) + child.count
+
+        return {
+            "depth_stats": depth_stats_from_counts(depth_counts)
+        }
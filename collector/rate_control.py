@@ -0,0 +1,168 @@
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Any, Dict, Mapping, Optional
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    レート制限ヘッダの時間表記を秒に変換する。
+    例: "1.5" (retry-after) / "20ms" / "6m0s" / "1h2m3s" (x-ratelimit-reset-*)
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+def _header_int(headers: Optional[Mapping[str, str]], name: str) -> Optional[int]:
+    if not headers or headers.get(name) is None:
+        return None
+    try:
+        return int(headers.get(name))
+    except ValueError:
+        return None
+
+class TokenBucket:
+    """
+    1分あたりの上限（RPM / TPM）を守るためのトークンバケット。
+    容量は約10秒分とし、バーストを抑えつつ上限に沿って均等に流す。
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # 容量を超える要求は容量まで丸める（そうしないと永遠に待つ）
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """見積りと実績の差分を反映する（負の残高も許容し、次の acquire で返済させる）"""
+        self._refill()
+        self._tokens -= delta
+
+class AdaptiveLimiter:
+    """
+    429 とレイテンシに応じて同時実行数を増減する AIMD 制御。
+
+    - 成功: 上限を 1/limit ずつ増やす（おおよそ1往復ごとに +1）
+    - 429: 上限を半分にする（同じ混雑で何度も落ちないよう、直近の p50 レイテンシ（1往復）に1回まで）
+    - 直近のレイテンシ p90 が基準（観測した p50 の最小値）の latency_factor 倍を超えたら増加を止める
+    - x-ratelimit-remaining-requests / -tokens が残り少ない場合も増加を止める
+
+    asyncio.Semaphore と同様に `async with limiter:` で使う。
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_window: int = 200,
+        latency_factor: float = 2.0,
+        history_size: int = 256,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_factor = latency_factor
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+        self._latencies: deque = deque(maxlen=latency_window)
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._started = time.monotonic()
+        self.rate_limited = 0
+        # 上限の変化履歴はチェックポイントごとに meta へ書くので、直近 history_size 件だけ残す
+        self.history: deque = deque([[0.0, self.limit]], maxlen=history_size)
+        self.peak = self.limit
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _set_limit(self, value: float):
+        before = self.limit
+        self._limit = max(self.min_limit, min(self.max_limit, value))
+        # 待機中のタスクは直後の __aexit__ で起こされ、新しい上限で再判定される
+        if self.limit != before:
+            self.history.append([round(time.monotonic() - self._started, 3), self.limit])
+            self.peak = max(self.peak, self.limit)
+
+    def _percentile(self, q: float) -> float:
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _congested(self, headers: Optional[Mapping[str, str]]) -> bool:
+        for name in ("x-ratelimit-remaining-requests", "x-ratelimit-remaining-tokens"):
+            remaining = _header_int(headers, name)
+            if remaining is not None and remaining <= self.limit:
+                return True
+        if len(self._latencies) >= 20:
+            p50 = self._percentile(0.5)
+            self._baseline = p50 if self._baseline is None else min(self._baseline, p50)
+            if self._percentile(0.9) > self._baseline * self.latency_factor:
+                return True
+        return False
+
+    def on_success(self, latency: float, headers: Optional[Mapping[str, str]] = None):
+        self._latencies.append(latency)
+        if not self._congested(headers):
+            self._set_limit(self._limit + 1.0 / self._limit)
+
+    def on_rate_limited(self):
+        self.rate_limited += 1
+        now = time.monotonic()
+        cooldown = self._percentile(0.5) if self._latencies else 1.0
+        if now - self._last_decrease >= cooldown:
+            self._last_decrease = now
+            self._set_limit(self._limit / 2)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "mode": "auto",
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "final": self.limit,
+            "peak": self.peak,
+            "rate_limited": self.rate_limited,
+            "history": list(self.history),
+        }
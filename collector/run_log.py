@@ -0,0 +1,84 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterator
+
+class RunLog:
+    """
+    実行結果を1行1件のJSON（JSONL）として追記していくログ。
+
+    チェックポイントのたびに全件を書き直す代わりに、完了した run を到着順に追記する。
+    書き込みコストは1件あたり O(1) で、レジューム時は1行ずつ読み戻せる。
+    ファイル名: runs-{hash}.jsonl（プロンプトハッシュごとに1ファイル）
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+
+    @classmethod
+    def for_hash(cls, output_dir: str, prompt_hash: str) -> "RunLog":
+        return cls(Path(output_dir) / f"runs-{prompt_hash}.jsonl")
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 前回の書き込みが途中で切れていた場合、次の行が壊れないよう改行を補う
+        needs_newline = False
+        if self.path.exists() and self.path.stat().st_size > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(self.path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+        return self
+
+    def append(self, run: dict):
+        if self._file is None:
+            self.open()
+        self._file.write(json.dumps(run, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+    def flush(self, sync: bool = False):
+        if self._file is None:
+            return
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def offset(self) -> int:
+        """現在までに書き込んだバイト数（追記のみなのでファイルサイズと一致する）"""
+        self.flush()
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def replay(self, start: int = 0) -> Iterator[dict]:
+        """
+        ログを start バイト目から1件ずつ読み戻す。
+        途中で切れた行（書き込み中の中断）は読み飛ばす。
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
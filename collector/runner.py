@@ -1,15 +1,41 @@
 import asyncio
+import contextlib
 import logging
-from typing import List, Optional, Any, Callable
+import time
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, List, Optional, Any, Callable, Union
 from openai import AsyncOpenAI
 from tqdm.asyncio import tqdm
+from collector.aggregator import DepthStats, StreamCursor
+from collector.backends import CompletionBackend, OpenAIBackend
+from collector.metrics import RunMetrics
+from collector.rate_control import AdaptiveLimiter, TokenBucket, parse_duration
 
 logger = logging.getLogger(__name__)
 
+def _apportion(total: Optional[int], weights: List[int]) -> List[Optional[int]]:
+    """total を weights の比で整数に按分する（最大剰余法で合計を total に一致させる）"""
+    if total is None:
+        return [None] * len(weights)
+    weight_sum = sum(weights)
+    if weight_sum == 0:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    shares = [total * w // weight_sum for w in weights]
+    remainders = sorted(range(len(weights)), key=lambda i: total * weights[i] % weight_sum, reverse=True)
+    for i in remainders[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+async def _close_stream(stream):
+    """ストリームを閉じる（openai の AsyncStream は close、async generator は aclose）"""
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close is not None:
+        await close()
+
 class Runner:
     def __init__(
         self,
-        client: AsyncOpenAI,
+        client: Optional[AsyncOpenAI],
         model: str,
         prompt: str,
         n: int,
@@ -17,7 +43,24 @@ class Runner:
         request_params: dict,
         on_result: Optional[Callable[[str, dict], Any]] = None,
         on_checkpoint: Optional[Callable[[List[dict]], Any]] = None,
-        checkpoint_interval: int = 100
+        checkpoint_interval: Optional[int] = 100,
+        progress_postfix: Optional[Callable[[], dict]] = None,
+        on_complete: Optional[Callable[[dict], Any]] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        request_bucket: Optional[TokenBucket] = None,
+        token_bucket: Optional[TokenBucket] = None,
+        max_retries: int = 6,
+        choices_per_request: int = 1,
+        backend: Optional[CompletionBackend] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        progress_desc: str = "Collecting",
+        progress_position: Optional[int] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        metrics: Optional[RunMetrics] = None,
+        stream_responses: bool = False,
+        live_stats: Optional[DepthStats] = None,
+        normalize: Optional[Callable[[str], str]] = None,
+        keep_results: bool = True
     ):
         self.client = client
         self.model = model
@@ -28,81 +71,341 @@ class Runner:
         self.on_result = on_result
         self.on_checkpoint = on_checkpoint
         self.checkpoint_interval = checkpoint_interval
-        self._semaphore = asyncio.Semaphore(concurrency)
+        self.progress_postfix = progress_postfix
+        self.on_complete = on_complete
+        # limiter を渡した場合は固定の Semaphore の代わりに適応的な同時実行数制御を使う
+        self.limiter = limiter
+        self.request_bucket = request_bucket
+        self.token_bucket = token_bucket
+        self.max_retries = max_retries
+        # backend を渡さなければ client で実際の API を呼ぶ（適応制御時はヘッダも取得する）
+        self.backend = backend or OpenAIBackend(client, raw_headers=limiter is not None)
+        # 1リクエストで chat completions の `n` 個の choice を受け取り、それぞれを1試行として扱う
+        self.choices_per_request = max(1, choices_per_request)
+        self._requests = -(-n // self.choices_per_request)
+        # 固定並列時はワーカー数そのものが同時実行数になるので、追加のゲートは不要。
+        # 複数の Runner で同時実行枠を共有する場合（スイープ）は共有の semaphore を渡す
+        self._semaphore = limiter or semaphore or contextlib.nullcontext()
+        self.progress_desc = progress_desc
+        self.progress_position = progress_position
+        # 結果を1件受け取るごとに呼び、True を返したら新しいリクエストの発行をやめる（収束による早期終了）
+        self.should_stop = should_stop
+        self._stopping = False
+        # レイテンシ・待ち時間・トークン数などの実行時メトリクス（渡さなければ Runner 内でだけ集計する）
+        self.metrics = metrics or RunMetrics()
+        # ストリーミングで受け取り、届いた文字を live_stats（表示用の深さ別統計）へ逐次反映する
+        self.stream_responses = stream_responses
+        self.live_stats = live_stats
+        # 集計前にテキストを正規化する（元の応答は、正規化で変わった場合だけ raw_text に残す）
+        self.normalize = normalize
+        # False なら結果を溜めない（on_complete でランログへ書き出す場合）。run は件数だけを返し、メモリは n によらない
+        self.keep_results = keep_results
+        # 同時実行の上限（auto 時は limiter の上限）だけワーカーを立てる
+        self._workers = max(1, min(limiter.max_limit if limiter else concurrency, self._requests))
         self._results = []
-        self._errors = []
-
-    async def _call_api(self, run_id: int):
-        async with self._semaphore:
-            try:
-                # OpenAI SDK自体がリトライ機能を持っているが、429対策として追加のリトライが必要になる可能性がある
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "user", "content": self.prompt}],
-                    **self.request_params
+
+    def _estimate_tokens(self, count: int) -> int:
+        # TPM 予算の事前見積り（プロンプトは概算で1文字1トークン + choice ごとの最大出力トークン）
+        return len(self.prompt) + self.request_params.get("max_tokens", 0) * count
+
+    async def _create_completion(self, count: int = 1):
+        """API を呼び出し（count > 1 なら `n` で複数 choice を要求）、(レスポンス, レスポンスヘッダ) を返す"""
+        kwargs = dict(
+            model=self.model,
+            messages=[{"role": "user", "content": self.prompt}],
+            **self.request_params
+        )
+        if count > 1:
+            kwargs["n"] = count
+        if self.stream_responses:
+            kwargs["stream"] = True
+            kwargs["stream_options"] = {"include_usage": True}
+        return await self.backend.create(**kwargs)
+
+    async def _read_stream(self, stream, started: float):
+        """
+        ストリームのチャンクを choice ごとに組み立て、非ストリーミングと同じ形のレスポンスにして返す。
+        届いた文字はその場で live_stats に反映し、choice ごとに最初の文字が届くまでの時間（TTFT）を記録する。
+        ストリームを最後まで読めた場合だけ反映を確定し、途中のエラー・キャンセルでは取り消す。
+        受信中の反映は届いたままの文字で、normalize があれば確定時に正規化後のテキストへ置き換える（Trie・ランログと一致させる）。
+        どの場合もストリームは閉じ、中断時に HTTP 接続を残さない。
+        """
+        choices: Dict[int, SimpleNamespace] = {}
+        cursors: Dict[int, StreamCursor] = {}
+        usage = None
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                for delta_choice in chunk.choices or []:
+                    choice = choices.get(delta_choice.index)
+                    if choice is None:
+                        choice = choices[delta_choice.index] = SimpleNamespace(
+                            index=delta_choice.index, parts=[], logprobs=[], ttft=None
+                        )
+                        if self.live_stats is not None:
+                            cursors[delta_choice.index] = StreamCursor(self.live_stats)
+                    content = delta_choice.delta.content if delta_choice.delta else None
+                    if content:
+                        if choice.ttft is None:
+                            choice.ttft = time.monotonic() - started
+                            self.metrics.time_to_first_token.observe(choice.ttft)
+                        choice.parts.append(content)
+                        if delta_choice.index in cursors:
+                            cursors[delta_choice.index].feed(content)
+                    if delta_choice.logprobs and delta_choice.logprobs.content:
+                        choice.logprobs.extend(delta_choice.logprobs.content)
+            for cursor in cursors.values():
+                cursor.commit(self.normalize(cursor.text) if self.normalize else None)
+        finally:
+            # commit 済みのカーソルには何もしない
+            for cursor in cursors.values():
+                cursor.abort()
+            await _close_stream(stream)
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    index=c.index,
+                    message=SimpleNamespace(content="".join(c.parts)),
+                    logprobs=SimpleNamespace(content=c.logprobs) if c.logprobs else None,
+                    ttft=c.ttft
                 )
-                
-                text = response.choices[0].message.content or ""
-                usage = {
-                    "input_tokens": response.usage.prompt_tokens,
-                    "output_tokens": response.usage.completion_tokens
-                } if response.usage else None
-                
-                logprobs = None
-                if response.choices[0].logprobs and response.choices[0].logprobs.content:
-                    logprobs = []
-                    for lp in response.choices[0].logprobs.content:
-                        top_lp = []
-                        if lp.top_logprobs:
-                            for tlp in lp.top_logprobs:
-                                top_lp.append({
-                                    "token": tlp.token,
-                                    "logprob": tlp.logprob,
-                                    "bytes": list(tlp.bytes) if tlp.bytes else None
-                                })
-                        
-                        logprobs.append({
-                            "token": lp.token,
-                            "logprob": lp.logprob,
-                            "bytes": list(lp.bytes) if lp.bytes else None,
-                            "top_logprobs": top_lp
+                for c in choices.values()
+            ],
+            usage=usage
+        )
+
+    def _build_result(self, run_id: int, choice, usage: Optional[dict]) -> dict:
+        text = choice.message.content or ""
+        raw_text = None
+        if self.normalize:
+            normalized = self.normalize(text)
+            if normalized != text:
+                text, raw_text = normalized, text
+        
+        logprobs = None
+        if choice.logprobs and choice.logprobs.content:
+            logprobs = []
+            for lp in choice.logprobs.content:
+                top_lp = []
+                if lp.top_logprobs:
+                    for tlp in lp.top_logprobs:
+                        top_lp.append({
+                            "token": tlp.token,
+                            "logprob": tlp.logprob,
+                            "bytes": list(tlp.bytes) if tlp.bytes else None
                         })
                 
-                result = {
-                    "id": run_id,
-                    "text": text,
-                    "status": "ok",
-                    "usage": usage,
-                    "logprobs": logprobs
-                }
-                
-                if self.on_result:
-                    self.on_result(text, result)
-                
-                return result
-            except Exception as e:
-                logger.error(f"Error in run {run_id}: {e}")
-                error_info = {
-                    "id": run_id,
-                    "status": "error",
-                    "error": {
-                        "type": type(e).__name__,
-                        "message": str(e)
-                    }
-                }
-                return error_info
-
-    async def run(self):
-        tasks = [self._call_api(i) for i in range(self.n)]
+                logprobs.append({
+                    "token": lp.token,
+                    "logprob": lp.logprob,
+                    "bytes": list(lp.bytes) if lp.bytes else None,
+                    "top_logprobs": top_lp
+                })
         
+        return {
+            "id": run_id,
+            "text": text,
+            "raw_text": raw_text,
+            "status": "ok",
+            "usage": usage,
+            "logprobs": logprobs,
+            # ストリーミング時のみ（リクエスト開始から最初の文字が届くまでの秒数）
+            "time_to_first_token": getattr(choice, "ttft", None)
+        }
+
+    def _build_results(self, first_id: int, count: int, response) -> List[dict]:
+        """
+        レスポンスの choice を1件ずつ run に分ける（id は first_id から連番）。
+        usage はリクエスト単位でしか返らないので、入力トークンは均等に、
+        出力トークンは logprobs があればトークン数、なければ文字数の比で按分する。
+        """
+        choices = sorted(response.choices, key=lambda c: c.index)[:count]
+        usages = [None] * len(choices)
+        if response.usage:
+            weights = [
+                len(c.logprobs.content) if c.logprobs and c.logprobs.content else len(c.message.content or "")
+                for c in choices
+            ]
+            inputs = _apportion(response.usage.prompt_tokens, [1] * len(choices))
+            outputs = _apportion(response.usage.completion_tokens, weights)
+            usages = [{"input_tokens": i, "output_tokens": o} for i, o in zip(inputs, outputs)]
+        results = [self._build_result(first_id + k, c, u) for k, (c, u) in enumerate(zip(choices, usages))]
+        # 要求より少ない choice しか返らなかった分はエラーとして記録する
+        for run_id in range(first_id + len(choices), first_id + count):
+            results.append(self._error_result(run_id, RuntimeError(f"response had {len(choices)} of {count} choices"), None))
+        return results
+
+    def _error_result(self, run_id: int, error: Exception, status: Optional[int]) -> dict:
+        return {
+            "id": run_id,
+            "status": "error",
+            "error": {
+                "type": type(error).__name__,
+                "message": str(error),
+                "http_status": status
+            }
+        }
+
+    async def _acquire_budget(self, count: int):
+        if self.request_bucket:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket:
+            await self.token_bucket.acquire(self._estimate_tokens(count))
+
+    def _settle_budget(self, count: int, usage):
+        # 見積りと実際の使用トークン数の差をバケットに反映する
+        if self.token_bucket and usage:
+            actual = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0)
+            self.token_bucket.adjust(actual - self._estimate_tokens(count))
+
+    async def _call_api(self, first_id: int, count: int = 1) -> List[dict]:
+        """first_id から count 件分の試行を1リクエストで実行し、試行ごとの結果を返す"""
+        retries = 0
+        while True:
+            retry_after = None
+            # RPM / TPM の待ちは同時実行枠の外で行う（待っている間に枠を塞がない）
+            waiting = time.monotonic()
+            await self._acquire_budget(count)
+            self.metrics.budget_wait.observe(time.monotonic() - waiting)
+            waiting = time.monotonic()
+            async with self._semaphore:
+                self.metrics.queue_wait.observe(time.monotonic() - waiting)
+                try:
+                    started = time.monotonic()
+                    self.metrics.request_started()
+                    try:
+                        response, headers = await self._create_completion(count)
+                        if self.stream_responses:
+                            response = await self._read_stream(response, started)
+                    finally:
+                        self.metrics.request_finished(time.monotonic() - started)
+                    if self.limiter:
+                        self.limiter.on_success(time.monotonic() - started, headers)
+                    
+                    self.metrics.add_usage(response.usage)
+                    self._settle_budget(count, response.usage)
+                    return self._build_results(first_id, count, response)
+                except Exception as e:
+                    status = getattr(e, "status_code", None)
+                    # 適応制御時は SDK のリトライを切っているので、429 はここで待ってから再試行する
+                    if self.limiter and status == 429 and retries < self.max_retries:
+                        self.limiter.on_rate_limited()
+                        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                        retry_after = (
+                            parse_duration(headers.get("retry-after"))
+                            or parse_duration(headers.get("x-ratelimit-reset-requests"))
+                            or min(60.0, 0.5 * 2 ** retries)
+                        )
+                        retries += 1
+                        self.metrics.retries += 1
+                    else:
+                        runs = f"run {first_id}" if count == 1 else f"runs {first_id}-{first_id + count - 1}"
+                        logger.error(f"Error in {runs}: {e}")
+                        return [self._error_result(run_id, e, status) for run_id in range(first_id, first_id + count)]
+            # 待機中はスロットを手放しておく
+            await asyncio.sleep(retry_after)
+
+    async def _produce(self, ids: asyncio.Queue):
+        # 1リクエスト分の (先頭 id, choice 数) を流す。最後のリクエストは端数になる
+        for first_id in range(0, self.n, self.choices_per_request):
+            if self._stopping:
+                break
+            await ids.put((first_id, min(self.choices_per_request, self.n - first_id)))
+        for _ in range(self._workers):
+            await ids.put(None)
+
+    async def _worker(self, ids: asyncio.Queue, out: asyncio.Queue):
+        while (batch := await ids.get()) is not None:
+            # 停止後はキューに残ったリクエストを発行せずに読み捨てる
+            if self._stopping:
+                continue
+            await out.put(await self._call_api(*batch))
+        await out.put(None)
+
+    def stop(self):
+        """
+        新しいリクエストの発行をやめる。実行中のリクエストは完了を待って結果を返す（費用を払った結果は捨てない）。
+        発行は id 順なので、受け取る run の id は 0 から連続したままになる。
+        """
+        self._stopping = True
+
+    async def results(self) -> AsyncIterator[dict]:
+        """
+        固定数のワーカーがキューから run id を取り出して API を呼び、完了順に結果を返す。
+        複数 choice のリクエストでは、choice ごとに1件ずつ返す。
+        キューはどちらもワーカー数で上限を切るため、保持するタスク・結果は n によらず O(concurrency)。
+        途中で反復をやめる（または外側がキャンセルされる）と、実行中のワーカーも止める。
+        """
+        ids = asyncio.Queue(maxsize=self._workers)
+        out = asyncio.Queue(maxsize=self._workers)
+        tasks = [asyncio.create_task(self._produce(ids))]
+        tasks.extend(asyncio.create_task(self._worker(ids, out)) for _ in range(self._workers))
+        try:
+            remaining = self._workers
+            while remaining:
+                batch = await out.get()
+                if batch is None:
+                    remaining -= 1
+                    continue
+                for result in batch:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self) -> Union[List[dict], Dict[str, int]]:
+        """
+        n 件を収集し、id 順に並べた結果を返す。
+        keep_results が False なら結果は保持せず、{"completed", "ok", "error"} の件数だけを返す
+        （on_checkpoint には空のリストを渡す）。
+        """
         results = []
-        for i, task in enumerate(tqdm(asyncio.as_completed(tasks), total=self.n, desc="Collecting")):
-            res = await task
-            results.append(res)
-            
-            # チェックポイントの実行
-            if self.on_checkpoint and (i + 1) % self.checkpoint_interval == 0:
+        completed = ok = 0
+        progress = tqdm(total=self.n, desc=self.progress_desc, position=self.progress_position)
+        try:
+            async with contextlib.aclosing(self.results()) as stream:
+                async for res in stream:
+                    completed += 1
+                    if res["status"] == "ok":
+                        ok += 1
+                    if self.keep_results:
+                        results.append(res)
+                    progress.update()
+                    self.metrics.result(res)
+
+                    # Trie への反映は受け取り側で行い、チェックポイントの runs と集計を一致させる
+                    if self.on_result and res["status"] == "ok":
+                        self.on_result(res["text"], res)
+
+                    # 成功・失敗を問わず完了した結果を通知（ランログへの追記など）
+                    if self.on_complete:
+                        self.on_complete(res)
+
+                    # 集計中の統計をプログレスバーに表示
+                    if self.progress_postfix:
+                        progress.set_postfix(self.progress_postfix(), refresh=False)
+
+                    # 収束したら以降のリクエストを止める（判定は should_stop 側で間引く）
+                    if self.should_stop and not self._stopping and res["status"] == "ok" and self.should_stop():
+                        self.stop()
+                        progress.set_description(f"{self.progress_desc} (converged)", refresh=False)
+
+                    # チェックポイントの実行
+                    if self.on_checkpoint and self.checkpoint_interval and completed % self.checkpoint_interval == 0:
+                        with self.metrics.timer("checkpoint"):
+                            self.on_checkpoint(results)
+        except asyncio.CancelledError:
+            # Ctrl-C（asyncio.run がメインタスクをキャンセル）: ワーカーは停止済みなので、
+            # そこまでに完了した結果で最後のチェックポイントを書いてから中断を伝える
+            if self.on_checkpoint and completed:
                 self.on_checkpoint(results)
-            
+            raise
+        finally:
+            progress.close()
+
+        if not self.keep_results:
+            return {"completed": completed, "ok": ok, "error": completed - ok}
         self._results = sorted(results, key=lambda x: x["id"])
         return self._results
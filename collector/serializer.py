@@ -1,5 +1,6 @@
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from json.encoder import encode_basestring
+from typing import List, Optional, Dict, Any, Iterable, TextIO
 from pydantic import BaseModel, Field
 
 class MetaInfo(BaseModel):
@@ -8,6 +9,11 @@ class MetaInfo(BaseModel):
     library: Dict[str, str]
     host: Dict[str, str]
     notes: Optional[str] = None
+    concurrency: Optional[Dict[str, Any]] = None
+    # デバッグモードの logprobs を格納したサイドカー（出力 JSON と同じディレクトリのファイル名）
+    logprobs_file: Optional[str] = None
+    # 実行時メトリクスの要約（レイテンシ・待ち時間の分布、トークン数、エラー数、同期処理の所要時間）
+    metrics: Optional[Dict[str, Any]] = None
 
 class RequestConfig(BaseModel):
     max_output_tokens: int
@@ -15,11 +21,43 @@ class RequestConfig(BaseModel):
     top_p: Optional[float] = None
     seed: Optional[int] = None
     store: bool = False
+    choices_per_request: int = 1
+    # ストリーミングで受け取ったか（run ごとの time_to_first_token はこのときだけ記録される）
+    stream: bool = False
 
 class NormalizationConfig(BaseModel):
+    """集計前のテキストの正規化（rules は規則名 → 有効か。規則と適用順は collector.normalization.RULES）"""
     enabled: bool = False
     rules: Dict[str, bool] = Field(default_factory=dict)
 
+class GraphExportConfig(BaseModel):
+    """グラフ出力の枝刈り条件（どれにも当てはまらない枝は親ごとに1本の "other" エッジにまとめる）"""
+    min_count: int = 1
+    min_p: float = 0.0
+    top_k: Optional[int] = None
+    max_depth: Optional[int] = None
+
+    def is_noop(self) -> bool:
+        return self.min_count <= 1 and self.min_p <= 0.0 and self.top_k is None and self.max_depth is None
+
+class ConvergenceConfig(BaseModel):
+    """
+    収束による早期終了の条件。criteria の全ての統計が patience 回続けて収束したら、新しいリクエストの発行をやめる。
+
+    - entropy: 深さ別エントロピーの、前回の判定からの変化の最大値が tolerance（ビット）以下
+    - topk: 上位 top_k 件の回答の出現割合の信頼区間の半幅が、いずれも tolerance 以下
+    - rare: branch で始まる回答の割合の信頼区間の半幅が、割合の relative_tolerance 倍以下
+    """
+    criteria: List[str] = Field(default_factory=lambda: ["entropy"])
+    tolerance: float = 0.01
+    relative_tolerance: float = 0.25
+    confidence: float = 0.95
+    interval: int = 100
+    min_samples: int = 500
+    patience: int = 3
+    top_k: int = 5
+    branch: Optional[str] = None
+
 class ConfigInfo(BaseModel):
     model: str
     prompt: str
@@ -27,6 +65,8 @@ class ConfigInfo(BaseModel):
     concurrency: int
     request: RequestConfig
     normalization: NormalizationConfig
+    # 枝刈りして出力した場合の条件（None なら全エッジを出力）
+    graph: Optional[GraphExportConfig] = None
 
 class ErrorInfo(BaseModel):
     type: str
@@ -58,6 +98,7 @@ class RunResult(BaseModel):
     usage: Optional[Dict[str, Optional[int]]] = None
     deviation: Optional[DeviationInfo] = None
     logprobs: Optional[List[LogprobContent]] = None
+    time_to_first_token: Optional[float] = None
 
 class Node(BaseModel):
     id: int
@@ -88,6 +129,8 @@ class StatsInfo(BaseModel):
     totals: Dict[str, int]
     depth_stats: List[DepthStat] = Field(default_factory=list)
     deviations: Optional[Dict[str, Any]] = None
+    # 収束による早期終了の条件と、最後の判定で観測した値（--converge 指定時のみ）
+    convergence: Optional[Dict[str, Any]] = None
 
 class CollectorOutput(BaseModel):
     meta: MetaInfo
@@ -95,3 +138,108 @@ class CollectorOutput(BaseModel):
     runs: List[RunResult] = Field(default_factory=list)
     graph: GraphInfo
     stats: StatsInfo
+
+def _json_float(value: float) -> str:
+    """
+    pydantic と同じ表記の浮動小数点数（桁は repr と同じ最短表現）。
+    repr と違い、指数 -5 は小数表記になり、指数部は 0 埋めしない（1.5e-06 → 1.5e-6）。
+    """
+    text = repr(float(value))
+    if "e" not in text:
+        return text
+    mantissa, exp = text.split("e")
+    exp = int(exp)
+    if exp == -5:
+        sign = "-" if mantissa.startswith("-") else ""
+        return f"{sign}0.0000{mantissa.lstrip('-').replace('.', '')}"
+    return f"{mantissa}e{'+' if exp > 0 else '-'}{abs(exp)}"
+
+def _json_usage(usage: Optional[Dict[str, Optional[int]]]) -> str:
+    if usage is None:
+        return "null"
+    return "{" + ",".join(
+        f"{encode_basestring(k)}:{'null' if v is None else int(v)}" for k, v in usage.items()
+    ) + "}"
+
+def _json_error(error: Optional[Dict[str, Any]]) -> str:
+    if not error:
+        return "null"
+    status = error.get("http_status")
+    return (
+        f'{{"type":{encode_basestring(error["type"])},"message":{encode_basestring(error["message"])},'
+        f'"http_status":{"null" if status is None else int(status)}}}'
+    )
+
+def _json_run(run_id: int, run: Dict[str, Any]) -> str:
+    if run.get("logprobs") is not None:
+        # logprobs を埋め込む run は浮動小数点の表記を揃えるため pydantic で書く（デバッグモードは通常サイドカー）
+        return RunResult(
+            id=run_id,
+            text=run.get("text", ""),
+            raw_text=run.get("raw_text"),
+            status=run.get("status", "ok"),
+            error=ErrorInfo(**run["error"]) if run.get("error") else None,
+            usage=run.get("usage"),
+            logprobs=run["logprobs"],
+            time_to_first_token=run.get("time_to_first_token")
+        ).model_dump_json()
+    ttft = run.get("time_to_first_token")
+    raw_text = run.get("raw_text")
+    return (
+        f'{{"id":{run_id},"text":{encode_basestring(run.get("text", ""))},'
+        f'"raw_text":{"null" if raw_text is None else encode_basestring(raw_text)},'
+        f'"status":{encode_basestring(run.get("status", "ok"))},"error":{_json_error(run.get("error"))},'
+        f'"usage":{_json_usage(run.get("usage"))},"deviation":null,"logprobs":null,'
+        f'"time_to_first_token":{"null" if ttft is None else _json_float(ttft)}}}'
+    )
+
+def write_output_json(
+    f: TextIO,
+    meta: MetaInfo,
+    config: ConfigInfo,
+    runs: Iterable[Dict[str, Any]],
+    nodes: Iterable[Dict[str, Any]],
+    edges: Iterable[Dict[str, Any]],
+    depth_stats: List[Dict[str, Any]],
+    convergence: Optional[Dict[str, Any]] = None,
+) -> StatsInfo:
+    """
+    CollectorOutput を組み立てずに、model_dump_json(by_alias=True) と同じ（インデントなしの）JSON を書き出す。
+    runs / nodes / edges は1件ずつ文字列化して流すので、件数分のモデルを作らない。
+    meta / config / stats は小さいので pydantic で検証して書き、stats.totals は runs を書きながら数える。
+    run の id は出力順に振り直す。
+    """
+    write = f.write
+    write('{"meta":')
+    write(meta.model_dump_json())
+    write(',"config":')
+    write(config.model_dump_json())
+
+    write(',"runs":[')
+    ok = error = total_chars = 0
+    for i, run in enumerate(runs):
+        if i:
+            write(",")
+        write(_json_run(i, run))
+        if run.get("status", "ok") == "ok":
+            ok += 1
+        else:
+            error += 1
+        total_chars += len(run.get("text", ""))
+
+    write('],"graph":{"nodes":[')
+    for i, node in enumerate(nodes):
+        write(f'{"," if i else ""}{{"id":{node["id"]},"depth":{node["depth"]}}}')
+    write('],"edges":[')
+    for i, edge in enumerate(edges):
+        p = edge.get("p")
+        write(
+            f'{"," if i else ""}{{"from":{edge["from"]},"to":{edge["to"]},"ch":{encode_basestring(edge["ch"])},'
+            f'"count":{edge["count"]},"p":{"null" if p is None else _json_float(p)}}}'
+        )
+
+    stats = StatsInfo(totals={"ok": ok, "error": error, "total_chars": total_chars}, depth_stats=depth_stats, convergence=convergence)
+    write(']},"stats":')
+    write(stats.model_dump_json())
+    write("}")
+    return stats
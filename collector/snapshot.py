@@ -0,0 +1,107 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Optional, Tuple
+
+from collector.aggregator import DepthStats
+
+# ファイル形式:
+#   MAGIC (8 bytes) | ヘッダ長 (uint32 LE) | ヘッダ JSON | parent (int32) | label (int32) | count (int64) | ラベル (UTF-8)
+# ヘッダにはノード数・ラベル表の長さ・深さ別統計・再開位置などの情報を格納する。
+MAGIC = b"LSCTRIE1"
+_HEADER_LEN = struct.Struct("<I")
+
+def snapshot_path(output_dir: str, prompt_hash: str) -> Path:
+    """プロンプトハッシュごとのスナップショットのパス（出力ファイルと同じディレクトリ）"""
+    return Path(output_dir) / f"trie-{prompt_hash}.bin"
+
+def save_snapshot(aggregator, path: Path, info: dict):
+    """
+    アグリゲーターの状態をバイナリスナップショットとして保存する。
+    info にはレジューム用の情報（取り込み済みの ok 件数、ランログの位置など）を入れる。
+    一時ファイルに書いてから置き換えるため、書き込み途中で中断しても既存のスナップショットは壊れない。
+    """
+    parent, label, count, labels = aggregator.export_arrays()
+    encoded = [ch.encode("utf-8") for ch in labels]
+    label_lengths = array("i", [len(b) for b in encoded])
+
+    header = {
+        "byteorder": sys.byteorder,
+        "nodes": len(parent),
+        "labels": len(labels),
+        "depth_stats": aggregator.depth_stats.to_dict(),
+        "info": info,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for arr in (array("i", parent), array("i", label), array("q", count), label_lengths):
+            arr.tofile(f)
+        f.write(b"".join(encoded))
+    os.replace(tmp_path, path)
+
+def _read_array(buf, offset: int, typecode: str, length: int, swap: bool) -> Tuple[array, int]:
+    arr = array(typecode)
+    end = offset + arr.itemsize * length
+    if length < 0 or end > len(buf):
+        raise ValueError("snapshot truncated")
+    arr.frombytes(buf[offset:end])
+    if swap:
+        arr.byteswap()
+    return arr, end
+
+def load_snapshot(path: Path, aggregator_cls) -> Optional[Tuple[object, dict]]:
+    """
+    スナップショットをメモリマップで読み込み、aggregator_cls のインスタンスとして復元する。
+    ファイルが無い・壊れている（途中で切れている、末尾に余分なバイトがある、ヘッダが読めない）場合は None を返す。
+    """
+    path = Path(path)
+    if not path.exists() or path.stat().st_size < len(MAGIC) + _HEADER_LEN.size:
+        return None
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buf = memoryview(mm)
+        try:
+            if bytes(buf[:len(MAGIC)]) != MAGIC:
+                return None
+            offset = len(MAGIC)
+            (header_len,) = _HEADER_LEN.unpack_from(buf, offset)
+            offset += _HEADER_LEN.size
+            header = json.loads(bytes(buf[offset:offset + header_len]))
+            offset += header_len
+
+            swap = header["byteorder"] != sys.byteorder
+            nodes = header["nodes"]
+            parent, offset = _read_array(buf, offset, "i", nodes, swap)
+            label, offset = _read_array(buf, offset, "i", nodes, swap)
+            count, offset = _read_array(buf, offset, "q", nodes, swap)
+            label_lengths, offset = _read_array(buf, offset, "i", header["labels"], swap)
+
+            labels = []
+            for length in label_lengths:
+                if length < 0 or offset + length > len(buf):
+                    raise ValueError("snapshot truncated")
+                labels.append(str(buf[offset:offset + length], "utf-8"))
+                offset += length
+            if offset != len(buf):
+                raise ValueError("snapshot has trailing bytes")
+            depth_stats = DepthStats.from_dict(header["depth_stats"])
+            info = header["info"]
+        except (ValueError, KeyError, TypeError, struct.error, UnicodeDecodeError):
+            # JSONDecodeError は ValueError のサブクラス
+            return None
+        finally:
+            buf.release()
+
+    aggregator = aggregator_cls.from_arrays(parent, label, count, labels, depth_stats)
+    return aggregator, info
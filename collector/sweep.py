@@ -0,0 +1,50 @@
+import argparse
+import itertools
+from typing import List
+
+from collector.file_io import load_json
+
+# スイープで設定ごとに変えられる引数（argparse の dest 名）
+SWEEP_KEYS = ("prompt", "model", "temp", "max_tokens", "n", "choices_per_request", "debug")
+# 数値の引数は argparse と同じ型に揃える（JSON の 1 と 1.0 が別の設定ハッシュにならないように）
+NUMERIC_TYPES = {"temp": float, "max_tokens": int, "n": int, "choices_per_request": int}
+
+def _coerce(key: str, value):
+    cast = NUMERIC_TYPES.get(key)
+    if cast is None:
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{key} must be a number, got {value!r}")
+    if cast is int and value != int(value):
+        raise ValueError(f"{key} must be an integer, got {value!r}")
+    return cast(value)
+
+def load_sweep(path, base: argparse.Namespace) -> List[argparse.Namespace]:
+    """
+    マトリクス指定の JSON を読み、設定ごとの引数（base のコピー）に展開する。
+
+        {
+          "matrix": {"prompt": ["...", "..."], "model": ["gpt-4.1-mini"], "temp": [0.7, 1.0]},
+          "n": 1000
+        }
+
+    matrix の各キーの値の直積が1設定になる。トップレベルのキーは全設定に共通の値として上書きする。
+    """
+    spec = load_json(path)
+    matrix = spec.get("matrix") or {}
+    fixed = {k: v for k, v in spec.items() if k != "matrix"}
+    unknown = (set(matrix) | set(fixed)) - set(SWEEP_KEYS)
+    if unknown:
+        raise ValueError(f"unknown sweep keys: {sorted(unknown)} (allowed: {', '.join(SWEEP_KEYS)})")
+    for key, values in matrix.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"matrix.{key} must be a non-empty list")
+
+    configs = []
+    for combo in itertools.product(*matrix.values()):
+        values = {key: _coerce(key, value) for key, value in {**fixed, **dict(zip(matrix, combo))}.items()}
+        config = argparse.Namespace(**{**vars(base), **values})
+        if config.prompt is None:
+            raise ValueError("sweep spec must set 'prompt' (in matrix or at the top level)")
+        configs.append(config)
+    return configs
@@ -1,85 +1,117 @@
-import json
+import io
 import os
-from typing import Dict, Any
+import re
+import sys
+from typing import Dict, Any, Iterable, Iterator, Optional, TextIO
 import graphviz
+from collector.file_io import iter_json_array, open_text
+from collector.graph_export import annotate_edges, focus_subtree, level_of_detail, prune_graph
+from collector.serializer import GraphExportConfig
 
-def generate_mermaid(data: Dict[str, Any]) -> str:
-    """JSONデータからMermaid形式のグラフ文字列を生成する"""
-    lines = ["graph LR"]
-    
-    # 実際にはノード名はprefixを表示したい場合もあるが、まずはIDベースで簡潔に
-    # graph.edgesを使う
-    graph = data.get("graph", {})
-    edges = graph.get("edges", [])
-    
+# 特殊文字（特に絵文字など）が dot -Tpng をクラッシュさせることがあるため、非BMP文字 (絵文字など) は '?' に置換する
+_NON_BMP = re.compile("[\U00010000-\U0010FFFF]")
+
+def _edge_label(ch: str) -> str:
+    label = ch.replace("\n", "\\n").replace("\r", "\\r")
+    if label == " ":
+        label = "(space)"
+    return label
+
+def write_mermaid(f: TextIO, edges: Iterable[dict]):
+    """エッジを1件ずつ Mermaid 形式で書き出す（グラフ全体を保持しない）"""
+    f.write("graph LR\n")
     for edge in edges:
-        from_id = edge["from"]
-        to_id = edge["to"]
-        label = edge["ch"]
-        count = edge["count"]
-        
-        label = edge["ch"].replace("\n", "\\n").replace("\r", "\\r")
-        if label == " ":
-            label = "(space)"
-            
+        label = _edge_label(edge["ch"]).replace('"', "#quot;")
         # Mermaid形式: from_id -- "char (count)" --> to_id
-        lines.append(f'    node{from_id} -- "{label} ({count})" --> node{to_id}')
-        
-    return "\n".join(lines)
+        f.write(f'    node{edge["from"]} -- "{label} ({edge["count"]})" --> node{edge["to"]}\n')
+
+def write_dot(f: TextIO, edges: Iterable[dict]):
+    """
+    エッジを1件ずつ DOT 形式で書き出す（graphviz.Digraph を組み立てない）。
+    線の太さは分岐確率 p に比例させる（全エッジの最大回数を求める走査が要らない）。
+    """
+    f.write("digraph {\n\trankdir=LR\n")
+    for edge in edges:
+        # DOT の文字列では \ と " をエスケープし、改行は \n（DOT でも改行）で表す
+        label = _NON_BMP.sub("?", _edge_label(edge["ch"].replace("\\", "\\\\").replace('"', '\\"')))
+        p = edge.get("p")
+        penwidth = 1 + 4 * p if p is not None else 1
+        f.write(f'\t{edge["from"]} -> {edge["to"]} [label="{label} ({edge["count"]})" penwidth={penwidth:.2f}]\n')
+    f.write("}\n")
+
+def generate_mermaid(data: Dict[str, Any]) -> str:
+    """JSONデータからMermaid形式のグラフ文字列を生成する"""
+    buf = io.StringIO()
+    write_mermaid(buf, annotate_edges(data.get("graph", {}).get("edges", [])))
+    return buf.getvalue().rstrip("\n")
+
+def render_dot(edges: Iterable[dict], output_path: str = "graph", fmt: str = "png") -> str:
+    """DOT ファイルを書いてから dot コマンドで描画する"""
+    dot_path = f"{output_path}.dot"
+    with open(dot_path, "w", encoding="utf-8") as f:
+        write_dot(f, edges)
+    out_path = f"{output_path}.{fmt}"
+    try:
+        graphviz.render("dot", fmt, dot_path, outfile=out_path)
+    finally:
+        os.remove(dot_path)
+    return out_path
 
 def generate_graphviz(data: Dict[str, Any], output_path: str = "graph", fmt: str = "png"):
     """JSONデータからGraphvizを使用してグラフ画像を生成する"""
-    dot = graphviz.Digraph(comment='Char-Graph Visualization', format=fmt)
-    dot.attr(rankdir='LR')
-    
-    graph = data.get("graph", {})
-    nodes = graph.get("nodes", [])
-    edges = graph.get("edges", [])
-    
-    # ノード追加
-    for node in nodes:
-        node_id = str(node["id"])
-        dot.node(node_id, label=node_id)
-        
-    # エッジ追加
-    max_count = max([e["count"] for e in edges]) if edges else 1
-    
-    for edge in edges:
-        from_id = str(edge["from"])
-        to_id = str(edge["to"])
-        count = edge["count"]
-        
-        # 特殊文字（特に絵文字など）が dot -Tpng をクラッシュさせることがあるためサニタイズ
-        # 非BMP文字 (絵文字など) を '?' に置換
-        raw_ch = edge["ch"]
-        sanitized_ch = "".join([c if ord(c) <= 0xFFFF else "?" for c in raw_ch])
-        
-        label = sanitized_ch.replace("\n", "\\n").replace("\r", "\\r")
-        if label == " ":
-            label = "(space)"
-            
-        # 太さを出現頻度に比例させる
-        penwidth = str(max(1, (count / max_count) * 5))
-        
-        dot.edge(from_id, to_id, label=f"{label} ({count})", penwidth=penwidth)
-        
-    dot.render(output_path, cleanup=True)
-    return f"{output_path}.{fmt}"
+    return render_dot(annotate_edges(data.get("graph", {}).get("edges", [])), output_path, fmt)
+
+def stream_edges(path: str, prefix: Optional[str] = None) -> Iterator[dict]:
+    """出力ファイルのエッジを p を付けて1件ずつ読む（prefix 指定時はその部分木だけ）"""
+    with open_text(path) as f:
+        edges = annotate_edges(iter_json_array(f, "edges"))
+        if prefix is not None:
+            edges = focus_subtree(edges, prefix)
+        yield from edges
+
+def read_depths(path: str) -> Dict[int, int]:
+    """
+    出力ファイルのノードの深さ（ノードID → 深さ）を読む。
+    圧縮グラフやトークン単位のグラフではエッジの数・ラベルの文字数から深さが分からないので、--max-depth で使う。
+    """
+    with open_text(path) as f:
+        return {node["id"]: node["depth"] for node in iter_json_array(f, "nodes")}
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Visualize Char-Graph JSON")
-    parser.add_argument("--input", required=True, help="Path to the input JSON file")
-    parser.add_argument("--format", choices=["mermaid", "png", "svg"], default="png", help="Output format")
+    parser.add_argument("--input", required=True, help="Path to the input JSON file (.json / .json.gz / .json.zst)")
+    parser.add_argument("--format", choices=["mermaid", "dot", "png", "svg"], default="png", help="Output format")
     parser.add_argument("--out", default="graph_output", help="Output filename (base)")
-    
+    parser.add_argument("--prefix", type=str, help="Render only the subtree reached by this prefix")
+    parser.add_argument("--budget", type=int, help="Level of detail: render only the most frequent N nodes (connected to the root)")
+    parser.add_argument("--min-count", type=int, default=1, help="Drop edges taken fewer times than this")
+    parser.add_argument("--min-p", type=float, default=0.0, help="Drop edges whose branch probability is below this")
+    parser.add_argument("--top-k", type=int, help="Keep at most this many children per node")
+    parser.add_argument("--max-depth", type=int, help="Do not expand nodes at or beyond this depth")
+
     args = parser.parse_args()
-    
-    with open(args.input, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        
+    config = GraphExportConfig(min_count=args.min_count, min_p=args.min_p, top_k=args.top_k, max_depth=args.max_depth)
+    if args.budget is not None and not config.is_noop():
+        parser.error("--budget cannot be combined with --min-count / --min-p / --top-k / --max-depth")
+
+    # エッジはファイルから1件ずつ読み、枝刈り・詳細度の制限をした結果（小さい）だけを保持する
+    if args.budget is not None:
+        # 2回走査する（上位ノードの選択と、残した親ごとの合計の集計）
+        _, edges = level_of_detail(lambda: stream_edges(args.input, args.prefix), args.budget)
+    elif not config.is_noop():
+        # 大きなグラフは描画できないので、枝刈りしてから描く（刈った枝は親ごとに "(other)" にまとまる）
+        depths = read_depths(args.input) if config.max_depth is not None else None
+        _, edges = prune_graph(stream_edges(args.input, args.prefix), config, depths)
+    else:
+        edges = stream_edges(args.input, args.prefix)
+
     if args.format == "mermaid":
-        print(generate_mermaid(data))
+        write_mermaid(sys.stdout, edges)
+    elif args.format == "dot":
+        with open(f"{args.out}.dot", "w", encoding="utf-8") as f:
+            write_dot(f, edges)
+        print(f"Graph written to {args.out}.dot")
     else:
-        path = generate_graphviz(data, args.out, args.format)
+        path = render_dot(edges, args.out, args.format)
         print(f"Graph rendered to {path}")
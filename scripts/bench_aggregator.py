@@ -0,0 +1,113 @@
+import gc
+import json
+import math
+import time
+import tracemalloc
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+
+BACKENDS = {
+    "object": Aggregator,
+    "array": ArrayAggregator,
+    "radix": RadixAggregator,
+}
+
+def load_corpus(report_path: str, runs: int) -> list:
+    """
+    classification_report.json の (ユニーク回答, 出現回数) から実験データ相当のコーパスを作る。
+    runs がレポートの総数を超える場合は繰り返して埋める。
+    """
+    with open(report_path, "r", encoding="utf-8") as f:
+        details = json.load(f)["details"]
+
+    base = []
+    for text, info in details.items():
+        base.extend([text] * info["count"])
+
+    texts = []
+    while len(texts) < runs:
+        texts.extend(base[:runs - len(texts)])
+    return texts
+
+def stats_match(a: dict, b: dict) -> bool:
+    """depth_stats が一致するか（浮動小数点は丸め誤差を許容して）比較する"""
+    def normalize(stats):
+        return [
+            {**d, "entropy_bits": None, "top_chars": [(c["ch"], c["count"]) for c in d["top_chars"]]}
+            for d in stats["depth_stats"]
+        ]
+    if normalize(a) != normalize(b):
+        return False
+    return all(
+        math.isclose(x["entropy_bits"], y["entropy_bits"], rel_tol=1e-9, abs_tol=1e-9)
+        for x, y in zip(a["depth_stats"], b["depth_stats"])
+    )
+
+def bench_backend(name: str, texts: list) -> dict:
+    # メモリは tracemalloc 下で、スループットは計測オーバーヘッドなしで別々に測る
+    tracemalloc.start()
+    aggregator = BACKENDS[name]()
+    for text in texts:
+        aggregator.add_text(text)
+    trie_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del aggregator
+    gc.collect()
+
+    start = time.perf_counter()
+    aggregator = BACKENDS[name]()
+    for text in texts:
+        aggregator.add_text(text)
+    insert_sec = time.perf_counter() - start
+
+    # 同一テキストを集約して重み付き挿入する経路（レジューム時の load_from_runs 相当）
+    gc.collect()
+    start = time.perf_counter()
+    BACKENDS[name]().add_many(texts)
+    add_many_sec = time.perf_counter() - start
+
+    timings = {}
+    for stage in ("get_graph_data", "get_compressed_graph_data", "calculate_stats", "recalculate_stats"):
+        start = time.perf_counter()
+        result = getattr(aggregator, stage)()
+        timings[stage] = time.perf_counter() - start
+        timings[stage + "_result"] = result
+
+    total_chars = sum(len(t) for t in texts)
+    return {
+        "backend": name,
+        "runs": len(texts),
+        "total_chars": total_chars,
+        "trie_mb": trie_bytes / 1024 / 1024,
+        "insert_sec": insert_sec,
+        "chars_per_sec": total_chars / insert_sec,
+        "add_many_sec": add_many_sec,
+        **timings,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare trie backends (memory / throughput)")
+    parser.add_argument("--report", default="classification_report.json", help="Corpus source (classification report)")
+    parser.add_argument("--runs", type=int, default=10000, help="Number of runs to insert")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.report, args.runs)
+    results = [bench_backend(name, texts) for name in BACKENDS]
+
+    # 全バックエンドの出力が一致し、逐次更新の統計が全走査の再計算と一致することを確認
+    reference = results[0]
+    for res in results:
+        for stage in ("get_graph_data", "get_compressed_graph_data", "calculate_stats"):
+            assert res[stage + "_result"] == reference[stage + "_result"], f"{res['backend']}: {stage} differs"
+        assert stats_match(res["calculate_stats_result"], res["recalculate_stats_result"]), \
+            f"{res['backend']}: incremental stats differ from full recalculation"
+
+    print(f"runs={args.runs} total_chars={reference['total_chars']} nodes={len(reference['get_graph_data_result'][0])}")
+    print(f"{'backend':<8} {'trie MB':>8} {'insert s':>9} {'chars/s':>11} {'add_many s':>10} {'graph s':>8} {'compress s':>10} {'stats s':>8} {'rescan s':>8}")
+    for res in results:
+        print(
+            f"{res['backend']:<8} {res['trie_mb']:>8.1f} {res['insert_sec']:>9.3f} {res['chars_per_sec']:>11,.0f} {res['add_many_sec']:>10.3f} "
+            f"{res['get_graph_data']:>8.3f} {res['get_compressed_graph_data']:>10.3f} {res['calculate_stats']:>8.3f} {res['recalculate_stats']:>8.3f}"
+        )
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+from collector.backends import MockBackend, load_mock_corpus
+from collector.run_log import RunLog
+from collector.runner import Runner
+from collector.snapshot import save_snapshot
+from collector.serializer import MetaInfo, ConfigInfo, RequestConfig, NormalizationConfig, write_output_json
+
+class TimedBackend:
+    """バックエンド呼び出し1回ごとのレイテンシ（Runner から見た往復時間）を記録する"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = []
+
+    async def create(self, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.backend.create(**kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def peak_rss_mb() -> float:
+    # Linux は KB、macOS はバイト単位で返る
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def write_json_checkpoint(aggregator, runs: list, path: str):
+    """collector の通常モードのチェックポイント（全件を1ファイルに書き直す）相当"""
+    meta = MetaInfo(run_id="bench", library={}, host={}, notes="Checkpoint")
+    config = ConfigInfo(
+        model="mock", prompt="bench", n=len(runs), concurrency=0,
+        request=RequestConfig(max_output_tokens=0), normalization=NormalizationConfig()
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        write_output_json(
+            f, meta, config, runs, aggregator.iter_nodes(), aggregator.iter_edges(),
+            aggregator.calculate_stats()["depth_stats"]
+        )
+
+async def bench(args, workdir: str) -> dict:
+    backend = TimedBackend(MockBackend(
+        corpus=load_mock_corpus(args.corpus) if args.corpus else None,
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        seed=0
+    ))
+    aggregator = {"object": Aggregator, "array": ArrayAggregator, "radix": RadixAggregator}[args.trie]()
+    run_log = RunLog(os.path.join(workdir, "runs.jsonl")) if args.stream else None
+    checkpoint_times = []
+
+    def on_complete(result):
+        run_log.append(result)
+        if result["status"] == "ok":
+            aggregator.add_text(result["text"])
+
+    def on_checkpoint(runs):
+        start = time.perf_counter()
+        if run_log:
+            run_log.flush(sync=True)
+            save_snapshot(aggregator, os.path.join(workdir, "trie.bin"), {"log_offset": run_log.offset()})
+        else:
+            write_json_checkpoint(aggregator, runs, os.path.join(workdir, "checkpoint.json"))
+        checkpoint_times.append(time.perf_counter() - start)
+
+    runner = Runner(
+        client=None,
+        model="mock",
+        prompt="北海道の県庁所在地は？",
+        n=args.n,
+        concurrency=args.concurrency,
+        request_params={"max_tokens": 50, **({"logprobs": True, "top_logprobs": 5} if args.logprobs else {})},
+        on_result=None if run_log else (lambda text, result: aggregator.add_text(text)),
+        on_complete=on_complete if run_log else None,
+        on_checkpoint=on_checkpoint,
+        checkpoint_interval=args.checkpoint_interval,
+        choices_per_request=args.choices_per_request,
+        backend=backend,
+        keep_results=run_log is None
+    )
+    start = time.perf_counter()
+    results = await runner.run()
+    elapsed = time.perf_counter() - start
+    if run_log:
+        run_log.close()
+
+    if run_log:
+        # ランログ時は結果を溜めず、件数だけが返る
+        ok, errors = results["ok"], results["error"]
+    else:
+        ok = sum(1 for r in results if r["status"] == "ok")
+        errors = len(results) - ok
+    return {
+        "n": args.n,
+        "ok": ok,
+        "errors": errors,
+        "requests": len(backend.latencies),
+        "sec": elapsed,
+        "samples_per_sec": ok / elapsed,
+        "latency_p50_ms": percentile(backend.latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(backend.latencies, 0.99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "checkpoints": len(checkpoint_times),
+        "checkpoint_total_sec": sum(checkpoint_times),
+        "checkpoint_max_sec": max(checkpoint_times, default=0.0),
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="End-to-end collection throughput against the mock backend")
+    parser.add_argument("--n", type=int, default=10000, help="Number of samples")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrency level")
+    parser.add_argument("--choices-per-request", type=int, default=1, help="Samples per request")
+    parser.add_argument("--latency", type=float, default=0.05, help="Median mock latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="Log-normal sigma of the mock latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Injected 429 probability")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Injected 500 probability")
+    parser.add_argument("--corpus", type=str, help="classification_report.json to sample outputs from")
+    parser.add_argument("--logprobs", action="store_true", help="Request logprobs (debug mode)")
+    parser.add_argument("--checkpoint-interval", type=int, default=2000, help="Samples between checkpoints")
+    parser.add_argument("--stream", action="store_true", help="Checkpoint via run log + trie snapshot instead of full JSON")
+    parser.add_argument("--trie", choices=["object", "array", "radix"], default="object", help="Trie backend")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        res = asyncio.run(bench(args, workdir))
+
+    print(f"n={res['n']} ok={res['ok']} errors={res['errors']} requests={res['requests']} concurrency={args.concurrency}")
+    print(f"throughput: {res['samples_per_sec']:,.0f} samples/s ({res['sec']:.2f} s)")
+    print(f"latency:    p50 {res['latency_p50_ms']:.1f} ms / p99 {res['latency_p99_ms']:.1f} ms")
+    print(f"peak RSS:   {res['peak_rss_mb']:.1f} MB")
+    print(f"checkpoint: {res['checkpoints']} x, total {res['checkpoint_total_sec']:.3f} s, max {res['checkpoint_max_sec']:.3f} s")
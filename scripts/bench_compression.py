@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import time
+from collector.file_io import COMPRESSION_SUFFIXES, load_json, open_text
+
+FORMATS = {"json": None, **COMPRESSION_SUFFIXES}
+
+def bench_format(data, raw_bytes: int, fmt: str, workdir: str, repeat: int) -> dict:
+    path = os.path.join(workdir, "output.json" + (COMPRESSION_SUFFIXES.get(fmt) or ""))
+
+    write_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with open_text(path, "w") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        write_times.append(time.perf_counter() - start)
+
+    read_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        assert load_json(path) == data
+        read_times.append(time.perf_counter() - start)
+
+    size = os.path.getsize(path)
+    # スループットは元の（非圧縮の）JSON のバイト数基準
+    return {
+        "format": fmt,
+        "bytes": size,
+        "ratio": raw_bytes / size,
+        "write_mb_s": raw_bytes / min(write_times) / 1024 / 1024,
+        "read_mb_s": raw_bytes / min(read_times) / 1024 / 1024,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare output size and read/write throughput per compression format")
+    parser.add_argument("inputs", nargs="+", help="Collector output files (.json / .json.gz / .json.zst)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions (best time is reported)")
+    args = parser.parse_args()
+
+    for input_path in args.inputs:
+        data = load_json(input_path)
+        raw_bytes = len(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        print(f"{input_path}: {raw_bytes / 1024:,.0f} KiB as compact JSON")
+        print(f"{'format':<6} {'KiB':>9} {'ratio':>6} {'write MB/s':>11} {'read MB/s':>10}")
+        with tempfile.TemporaryDirectory() as workdir:
+            for fmt in FORMATS:
+                res = bench_format(data, raw_bytes, fmt, workdir, args.repeat)
+                print(f"{res['format']:<6} {res['bytes'] / 1024:>9,.0f} {res['ratio']:>6.1f} {res['write_mb_s']:>11.1f} {res['read_mb_s']:>10.1f}")
@@ -0,0 +1,256 @@
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+from collector.serializer import (
+    CollectorOutput, MetaInfo, ConfigInfo, RequestConfig, NormalizationConfig,
+    GraphInfo, StatsInfo, Node, Edge, RunResult, write_output_json
+)
+from scripts.compress_json import compress_existing_json
+
+BACKENDS = {
+    "object": Aggregator,
+    "array": ArrayAggregator,
+    "radix": RadixAggregator,
+}
+
+# --- 合成コーパス -----------------------------------------------------------
+
+def short_repetitive(rng: random.Random, runs: int) -> list:
+    """Yes/No 系の短い回答。少数の回答に Zipf 的に偏る（実験の典型）"""
+    answers = ["YES", "Yes", "Yes.", "yes", "NO", "No", "No.", "Y", "N", "Yes!", "YES.", "Maybe"]
+    weights = [1 / (i + 1) ** 1.5 for i in range(len(answers))]
+    return rng.choices(answers, weights, k=runs)
+
+_WORDS = (
+    "the model answer question because capital city prefecture island north south government office "
+    "however therefore is are was not only also which located in of and a an to for with its this that"
+).split()
+
+def long_diverse(rng: random.Random, runs: int) -> list:
+    """100〜250文字程度の英文。先頭数語は共通の書き出しから選び、以降はほぼ一意に分岐する"""
+    openings = ["The answer is", "In short,", "Strictly speaking,", "Well,", "The capital of Hokkaido is"]
+    texts = []
+    for _ in range(runs):
+        words = [rng.choice(openings)] + rng.choices(_WORDS, k=rng.randint(20, 40))
+        texts.append(" ".join(words) + ".")
+    return texts
+
+_JA_PHRASES = [
+    "北海道の", "県庁所在地は", "札幌市です。", "道庁所在地は", "北海道には", "「県」ではなく",
+    "「道」と呼ばれているため、", "県庁所在地はありません。", "なお、", "行政の中心地は", "です。",
+    "一般的には", "と言われています。", "ちなみに、", "政令指定都市の", "人口は約197万人です。",
+]
+
+def japanese(rng: random.Random, runs: int) -> list:
+    """日本語の中程度の長さの回答。定型句の組み合わせで枝分かれする"""
+    weights = [1 / (i + 1) for i in range(len(_JA_PHRASES))]
+    return ["".join(rng.choices(_JA_PHRASES, weights, k=rng.randint(3, 8))) for _ in range(runs)]
+
+_EMOJI = [
+    "😀", "😂", "👍", "👍🏽", "🎉", "🍣", "🗾", "❄️", "🇯🇵", "👨‍👩‍👧", "🧑🏻‍💻", "✨", "🙏", "🔥", "💯",
+]
+
+def emoji_heavy(rng: random.Random, runs: int) -> list:
+    """絵文字（異体字セレクタ・肌色修飾・ZWJ 連結・国旗を含む）が多い短文"""
+    texts = []
+    for _ in range(runs):
+        parts = rng.choices(_EMOJI, k=rng.randint(2, 10))
+        if rng.random() < 0.5:
+            parts.insert(rng.randint(0, len(parts)), rng.choice(["札幌", "Sapporo", "はい", "Yes"]))
+        texts.append("".join(parts))
+    return texts
+
+CORPORA = {
+    "short_repetitive": short_repetitive,
+    "long_diverse": long_diverse,
+    "japanese": japanese,
+    "emoji": emoji_heavy,
+}
+
+def make_corpus(name: str, runs: int, seed: int = 0) -> list:
+    return CORPORA[name](random.Random(seed), runs)
+
+# --- 計測 -------------------------------------------------------------------
+
+def measure(fn, memory: bool = True) -> tuple:
+    """
+    fn を実行し (戻り値, 経過秒, ピーク MB) を返す。
+    時間は計測オーバーヘッドなしで測り、メモリは tracemalloc 下でもう一度実行して測る。
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return result, elapsed, peak_mb
+
+def bench_header(texts: list) -> tuple:
+    meta = MetaInfo(run_id="bench", library={}, host={})
+    config = ConfigInfo(
+        model="bench", prompt="bench", n=len(texts), concurrency=0,
+        request=RequestConfig(max_output_tokens=0), normalization=NormalizationConfig()
+    )
+    return meta, config
+
+def build_output(aggregator, texts: list, meta: MetaInfo, config: ConfigInfo) -> CollectorOutput:
+    """以前の save_output と同じく、全要素を pydantic モデルにして CollectorOutput を組み立てる"""
+    nodes, edges = aggregator.get_graph_data()
+    return CollectorOutput(
+        meta=meta,
+        config=config,
+        runs=[RunResult(id=i, text=t, status="ok") for i, t in enumerate(texts)],
+        graph=GraphInfo(nodes=[Node(**n) for n in nodes], edges=[Edge(**e) for e in edges]),
+        stats=StatsInfo(
+            totals={"ok": len(texts), "error": 0, "total_chars": sum(len(t) for t in texts)},
+            depth_stats=aggregator.calculate_stats()["depth_stats"]
+        )
+    )
+
+def write_fast(aggregator, texts: list, meta: MetaInfo, config: ConfigInfo) -> str:
+    """collector の save_output と同じ経路（write_output_json）で書き出す"""
+    buf = io.StringIO()
+    runs = ({"text": t, "status": "ok"} for t in texts)
+    write_output_json(
+        buf, meta, config, runs, aggregator.iter_nodes(), aggregator.iter_edges(),
+        aggregator.calculate_stats()["depth_stats"]
+    )
+    return buf.getvalue()
+
+def bench_case(corpus: str, runs: int, backend: str, memory: bool, workdir: str) -> dict:
+    texts = make_corpus(corpus, runs)
+    meta, config = bench_header(texts)
+    stages = {}
+
+    def record(stage, fn):
+        result, sec, peak_mb = measure(fn, memory)
+        stages[stage] = {"sec": sec, "peak_mb": peak_mb}
+        return result
+
+    def insert():
+        aggregator = BACKENDS[backend]()
+        for text in texts:
+            aggregator.add_text(text)
+        return aggregator
+
+    aggregator = record("add_text", insert)
+    record("get_graph_data", aggregator.get_graph_data)
+    record("get_compressed_graph_data", aggregator.get_compressed_graph_data)
+    record("calculate_stats", aggregator.calculate_stats)
+    output = record("output_build", lambda: build_output(aggregator, texts, meta, config))
+    dumped = record("model_dump_json", lambda: output.model_dump_json(by_alias=True))
+    fast = record("fast_write", lambda: write_fast(aggregator, texts, meta, config))
+    # 高速経路の出力が pydantic の出力とバイト単位で一致するか
+    identical = fast == dumped
+    del fast
+
+    input_path = os.path.join(workdir, "input.json")
+    with open(input_path, "w", encoding="utf-8") as f:
+        f.write(dumped)
+    del output, dumped
+
+    def compress():
+        with contextlib.redirect_stdout(io.StringIO()):
+            compress_existing_json(input_path, os.path.join(workdir, "output.json"))
+    record("compress_json", compress)
+
+    return {
+        "corpus": corpus,
+        "runs": runs,
+        "backend": backend,
+        "total_chars": sum(len(t) for t in texts),
+        "nodes": len(aggregator.get_graph_data()[0]),
+        "fast_write_identical": identical,
+        "stages": stages,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_comparison(results: list, baseline_path: str):
+    """同じ (corpus, runs, backend, stage) の時間を基準ファイルと比べる（< 1.0 なら高速化）"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    base = {(c["corpus"], c["runs"], c["backend"]): c["stages"] for c in baseline["cases"]}
+    print(f"\ncompared with {baseline_path} ({baseline['meta']['commit']})")
+    print(f"{'corpus':<17} {'runs':>8} {'stage':<26} {'base s':>8} {'now s':>8} {'ratio':>6}")
+    for case in results:
+        old = base.get((case["corpus"], case["runs"], case["backend"]))
+        if not old:
+            continue
+        for stage, now in case["stages"].items():
+            if stage in old and old[stage]["sec"] > 0:
+                print(
+                    f"{case['corpus']:<17} {case['runs']:>8,} {stage:<26} "
+                    f"{old[stage]['sec']:>8.3f} {now['sec']:>8.3f} {now['sec'] / old[stage]['sec']:>6.2f}"
+                )
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark offline aggregation and serialization stages")
+    parser.add_argument("--corpus", nargs="+", choices=list(CORPORA), default=list(CORPORA), help="Synthetic corpora")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Numbers of runs (e.g. add 1000000)")
+    parser.add_argument("--trie", choices=list(BACKENDS), default="object", help="Trie backend")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass (time only)")
+    parser.add_argument("--out", type=str, help="Result JSON path (default: out/bench/offline-{commit}-{timestamp}.json)")
+    parser.add_argument("--compare", type=str, help="Earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = []
+    print(f"{'corpus':<17} {'runs':>8} {'stage':<26} {'sec':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for corpus in args.corpus:
+            for runs in args.sizes:
+                case = bench_case(corpus, runs, args.trie, not args.no_memory, workdir)
+                results.append(case)
+                for stage, res in case["stages"].items():
+                    peak = f"{res['peak_mb']:>8.1f}" if res["peak_mb"] is not None else f"{'-':>8}"
+                    print(f"{corpus:<17} {runs:>8,} {stage:<26} {res['sec']:>8.3f} {peak}")
+                stages = case["stages"]
+                pydantic_sec = stages["output_build"]["sec"] + stages["model_dump_json"]["sec"]
+                print(
+                    f"{corpus:<17} {runs:>8,} fast_write speedup x{pydantic_sec / stages['fast_write']['sec']:.1f} "
+                    f"(identical to model_dump_json: {case['fast_write_identical']})"
+                )
+
+    out_path = args.out or os.path.join("out", "bench", f"offline-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {
+                "commit": commit,
+                "created_at": datetime.now().isoformat(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "trie": args.trie,
+            },
+            "cases": results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"Saved results to {out_path}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
@@ -0,0 +1,81 @@
+import asyncio
+import gc
+import time
+import tracemalloc
+from types import SimpleNamespace
+from collector.runner import Runner
+
+# API を呼ばずに即座に返す擬似レスポンス（スケジューラ自体のオーバーヘッドだけを測る）
+MESSAGE = SimpleNamespace(content="YES")
+
+class SimulatedRunner(Runner):
+    async def _create_completion(self, count: int = 1):
+        await asyncio.sleep(0)
+        choices = [SimpleNamespace(index=i, message=MESSAGE, logprobs=None) for i in range(count)]
+        return SimpleNamespace(choices=choices, usage=None), None
+
+def make_runner(n: int, concurrency: int, choices_per_request: int = 1) -> SimulatedRunner:
+    return SimulatedRunner(
+        client=None, model="sim", prompt="Hi", n=n, concurrency=concurrency, request_params={},
+        choices_per_request=choices_per_request
+    )
+
+async def run_pool(n: int, concurrency: int, choices_per_request: int = 1) -> int:
+    count = 0
+    async for _ in make_runner(n, concurrency, choices_per_request).results():
+        count += 1
+    return count
+
+async def run_eager(n: int, concurrency: int, choices_per_request: int = 1) -> int:
+    """以前の Runner.run 相当: n 個のコルーチンを先に作り、Semaphore と as_completed で回す"""
+    runner = make_runner(n, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(run_id):
+        async with semaphore:
+            return await runner._call_api(run_id)
+
+    count = 0
+    for task in asyncio.as_completed([call(i) for i in range(n)]):
+        count += len(await task)
+    return count
+
+SCHEDULERS = {
+    "pool": run_pool,
+    "eager": run_eager,
+}
+
+def bench_scheduler(name: str, n: int, concurrency: int, choices_per_request: int = 1) -> dict:
+    # メモリは tracemalloc 下で、時間は計測オーバーヘッドなしで別々に測る
+    tracemalloc.start()
+    asyncio.run(SCHEDULERS[name](n, concurrency, choices_per_request))
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    gc.collect()
+
+    start = time.perf_counter()
+    count = asyncio.run(SCHEDULERS[name](n, concurrency, choices_per_request))
+    elapsed = time.perf_counter() - start
+    assert count == n, f"{name}: {count} results for n={n}"
+    return {
+        "scheduler": name,
+        "n": n,
+        "peak_mb": peak_bytes / 1024 / 1024,
+        "sec": elapsed,
+        "us_per_call": elapsed / n * 1e6,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare Runner scheduling overhead (simulated API calls)")
+    parser.add_argument("--n", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Numbers of simulated calls")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrency level")
+    parser.add_argument("--choices-per-request", type=int, default=1, help="Samples per simulated request (pool only)")
+    args = parser.parse_args()
+
+    print(f"concurrency={args.concurrency} choices_per_request={args.choices_per_request}")
+    print(f"{'scheduler':<9} {'n':>9} {'peak MB':>8} {'sec':>8} {'us/call':>8}")
+    for n in args.n:
+        for name in SCHEDULERS:
+            res = bench_scheduler(name, n, args.concurrency, args.choices_per_request if name == "pool" else 1)
+            print(f"{res['scheduler']:<9} {res['n']:>9,} {res['peak_mb']:>8.1f} {res['sec']:>8.2f} {res['us_per_call']:>8.1f}")
@@ -1,29 +1,45 @@
 import json
 import asyncio
-import sys
+import contextlib
+import hashlib
 import os
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Optional
 from collections import Counter
 from openai import AsyncOpenAI
 from pydantic import BaseModel
+from collector.backends import OpenAIBackend
+from collector.file_io import load_json
+from collector.rate_control import AdaptiveLimiter, parse_duration
 
 # カテゴリ分類用のスキーマ
 class ClassificationResult(BaseModel):
     category: str
     reason: str
 
-async def classify_text(client: AsyncOpenAI, text: str, model: str) -> ClassificationResult:
-    """LLMを使用してテキストを分類する"""
-    prompt = f"""以下のLLMによる回答テキストを、その記述スタイルやスタンスに基づいて分類してください。
+class BatchItem(ClassificationResult):
+    id: int
 
-対象テキスト:
-\"\"\"{text}\"\"\"
+class BatchResult(BaseModel):
+    results: List[BatchItem]
+
+SYSTEM_PROMPT = "You are a helpful assistant that classifies text patterns."
+
+CATEGORIES = ["ASSERTIVE", "CORRECTIVE", "DENIAL", "OTHER"]
 
-分類カテゴリ:
+CATEGORY_DEFINITIONS = """分類カテゴリ:
 - ASSERTIVE: 「札幌市です」のように、単に事実を言い切っているもの。
 - CORRECTIVE: 「道庁所在地ですが」や「厳密には県ではなく道ですが」のように、前提の誤りを指摘または補足しながら回答しているもの。
 - DENIAL: 「北海道は『道』なので県庁所在地はありません」のように、存在を否定するもの。
-- OTHER: 上記のどれにも当てはまらないもの。
+- OTHER: 上記のどれにも当てはまらないもの。"""
+
+# 1件ずつ分類するときのプロンプト（{text} に回答、{definitions} にカテゴリ定義が入る）
+SINGLE_PROMPT_TEMPLATE = """以下のLLMによる回答テキストを、その記述スタイルやスタンスに基づいて分類してください。
+
+対象テキスト:
+\"\"\"{text}\"\"\"
+
+{definitions}
 
 出力フォーマット (JSON):
 {{
@@ -31,35 +47,175 @@ async def classify_text(client: AsyncOpenAI, text: str, model: str) -> Classific
   "reason": "そのカテゴリに分類した簡潔な理由"
 }}
 """
+
+SINGLE_RESPONSE_FORMAT = {"type": "json_object"}
+
+# バッチ分類のプロンプト（{count} に件数、{items} に id 付きの回答、{definitions} にカテゴリ定義が入る）
+BATCH_PROMPT_TEMPLATE = """以下の {count} 件のLLMによる回答テキストを、それぞれの記述スタイルやスタンスに基づいて分類してください。
+
+対象テキスト（[id] の後に続く引用）:
+{items}
+
+{definitions}
+
+すべての id について、category と、そのカテゴリに分類した簡潔な理由 (reason) を返してください。
+"""
+
+# バッチ分類の構造化出力（id ごとに category / reason を返させる）
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "classifications",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "category": {"type": "string", "enum": CATEGORIES},
+                            "reason": {"type": "string"},
+                        },
+                        "required": ["id", "category", "reason"],
+                        "additionalProperties": False,
+                    },
+                }
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def template_hash() -> str:
+    """
+    分類基準（システムプロンプト・カテゴリ定義・両方のプロンプトと応答形式）のハッシュ。
+    どれかを変えれば別のキーになる。1件ずつ・バッチのどちらで分類した結果もキャッシュを共有する。
+    """
+    parts = [
+        SYSTEM_PROMPT, CATEGORY_DEFINITIONS, SINGLE_PROMPT_TEMPLATE, BATCH_PROMPT_TEMPLATE,
+        json.dumps(SINGLE_RESPONSE_FORMAT, sort_keys=True, ensure_ascii=False),
+        json.dumps(BATCH_RESPONSE_FORMAT, sort_keys=True, ensure_ascii=False),
+    ]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+class ClassificationCache:
+    """
+    分類結果のキャッシュ（JSONL、1行1件の追記のみ）。
+    キーは (テキストのハッシュ, 分類モデル, テンプレートのハッシュ)。ERROR はキャッシュせず、次回に再分類する。
+    """
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.prefix = f"{model}:{template_hash()}:"
+        self._entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中で中断した末尾の行は読み飛ばす
+                        continue
+                    self._entries[entry["key"]] = entry
+        self._file = None
+
+    def key(self, text: str) -> str:
+        return self.prefix + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[ClassificationResult]:
+        entry = self._entries.get(self.key(text))
+        return ClassificationResult(category=entry["category"], reason=entry["reason"]) if entry else None
+
+    def put(self, text: str, result: ClassificationResult):
+        if result.category == "ERROR":
+            return
+        entry = {"key": self.key(text), "category": result.category, "reason": result.reason}
+        self._entries[entry["key"]] = entry
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # 中断しても分類済みの分を失わないよう、1件ごとに書き出す
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class Classifier:
+    """同時実行数の制御（固定または AIMD）と 429 の再試行をまとめて、JSON 応答を返す API 呼び出し"""
+
+    def __init__(self, client: AsyncOpenAI, model: str, limiter: Optional[AdaptiveLimiter], concurrency: int, max_retries: int = 6):
+        self.backend = OpenAIBackend(client, raw_headers=limiter is not None)
+        self.model = model
+        self.limiter = limiter
+        self._gate = limiter or asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+
+    async def complete_json(self, prompt: str, response_format: dict) -> dict:
+        retries = 0
+        while True:
+            retry_after = None
+            async with self._gate:
+                try:
+                    started = time.monotonic()
+                    response, headers = await self.backend.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "user", "content": prompt}
+                        ],
+                        response_format=response_format
+                    )
+                    if self.limiter:
+                        self.limiter.on_success(time.monotonic() - started, headers)
+                    return json.loads(response.choices[0].message.content)
+                except Exception as e:
+                    # 適応制御時は SDK のリトライを切っているので、429 はここで待ってから再試行する
+                    if not (self.limiter and getattr(e, "status_code", None) == 429 and retries < self.max_retries):
+                        raise
+                    self.limiter.on_rate_limited()
+                    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                    retry_after = parse_duration(headers.get("retry-after")) or min(60.0, 0.5 * 2 ** retries)
+                    retries += 1
+            # 待機中はスロットを手放しておく
+            await asyncio.sleep(retry_after)
+
+async def classify_text(classifier: Classifier, text: str) -> ClassificationResult:
+    """LLMを使用してテキストを分類する"""
+    prompt = SINGLE_PROMPT_TEMPLATE.format(text=text, definitions=CATEGORY_DEFINITIONS)
     try:
-        response = await client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that classifies text patterns."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        content = response.choices[0].message.content
-        data = json.loads(content)
+        data = await classifier.complete_json(prompt, SINGLE_RESPONSE_FORMAT)
         return ClassificationResult(**data)
     except Exception as e:
         return ClassificationResult(category="ERROR", reason=str(e))
 
-async def main():
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/classify_responses.py <input.json> [model]")
-        return
+async def classify_batch(classifier: Classifier, texts: List[str]) -> List[ClassificationResult]:
+    """複数のテキストを1リクエストで分類する（構造化出力で id ごとの結果を受け取る）"""
+    items = "\n\n".join(f"[{i}]\n\"\"\"{text}\"\"\"" for i, text in enumerate(texts))
+    prompt = BATCH_PROMPT_TEMPLATE.format(count=len(texts), items=items, definitions=CATEGORY_DEFINITIONS)
+    try:
+        data = BatchResult(**await classifier.complete_json(prompt, BATCH_RESPONSE_FORMAT))
+    except Exception as e:
+        return [ClassificationResult(category="ERROR", reason=str(e)) for _ in texts]
+    by_id = {item.id: item for item in data.results}
+    # 応答に含まれなかった id は ERROR にして、次回の実行で再分類させる
+    return [
+        ClassificationResult(category=by_id[i].category, reason=by_id[i].reason) if i in by_id
+        else ClassificationResult(category="ERROR", reason="missing from batch response")
+        for i in range(len(texts))
+    ]
 
-    input_path = sys.argv[1]
-    model = sys.argv[2] if len(sys.argv) > 2 else "gpt-4o-mini"
-    
-    if not os.path.exists(input_path):
-        print(f"Error: File not found: {input_path}")
+async def main(args):
+    if not os.path.exists(args.input):
+        print(f"Error: File not found: {args.input}")
         return
 
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_json(args.input)
 
     # 成功した実行結果からユニークな回答を抽出
     runs = data.get("runs", [])
@@ -67,27 +223,46 @@ async def main():
     unique_texts_counter = Counter(texts)
     unique_texts = list(unique_texts_counter.keys())
 
+    cache = ClassificationCache(args.cache, args.model)
+    results: Dict[str, ClassificationResult] = {}
+    for text in unique_texts:
+        cached = cache.get(text)
+        if cached is not None:
+            results[text] = cached
+    pending = [text for text in unique_texts if text not in results]
+
     print(f"Total successful runs: {len(texts)}")
-    print(f"Unique response patterns: {len(unique_texts)}")
-    print(f"Classifying using {model}...")
+    print(f"Unique response patterns: {len(unique_texts)} (cached: {len(results)}, to classify: {len(pending)})")
+
+    if pending:
+        print(f"Classifying using {args.model}...")
+        limiter = AdaptiveLimiter(max_limit=args.max_concurrency) if args.concurrency == "auto" else None
+        # 適応制御時は 429 を自前で観測・再試行するため、SDK のリトライは無効にする
+        client = AsyncOpenAI(max_retries=0) if limiter else AsyncOpenAI()
+        classifier = Classifier(client, args.model, limiter, 0 if limiter else args.concurrency)
 
-    client = AsyncOpenAI()
-    
-    # バッチ処理（同時並列数を制限）
-    semaphore = asyncio.Semaphore(10)
-    
-    async def limited_classify(text):
-        async with semaphore:
-            return await classify_text(client, text, model)
+        async def classify_chunk(chunk: List[str]):
+            if args.batch_size > 1:
+                chunk_results = await classify_batch(classifier, chunk)
+            else:
+                chunk_results = [await classify_text(classifier, chunk[0])]
+            for text, res in zip(chunk, chunk_results):
+                results[text] = res
+                cache.put(text, res)
 
-    tasks = [limited_classify(text) for text in unique_texts]
-    results = await asyncio.gather(*tasks)
+        chunks = [pending[i:i + args.batch_size] for i in range(0, len(pending), args.batch_size)]
+        with contextlib.closing(cache):
+            await asyncio.gather(*(classify_chunk(chunk) for chunk in chunks))
+        errors = sum(1 for text in pending if results[text].category == "ERROR")
+        if errors:
+            print(f"Warning: {errors} texts failed to classify (not cached; re-run to retry)")
 
     # 集計
     category_counts = Counter()
     classification_map = {} # text -> result
 
-    for text, res in zip(unique_texts, results):
+    for text in unique_texts:
+        res = results[text]
         count = unique_texts_counter[text]
         category_counts[res.category] += count
         classification_map[text] = {
@@ -108,11 +283,28 @@ async def main():
         "summary": dict(category_counts),
         "details": classification_map
     }
-    
-    report_path = "classification_report.json"
-    with open(report_path, "w", encoding="utf-8") as f:
+
+    with open(args.report, "w", encoding="utf-8") as f:
         json.dump(output_report, f, indent=2, ensure_ascii=False)
-    print(f"\nDetailed report saved to {report_path}")
+    print(f"\nDetailed report saved to {args.report}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    import argparse
+    parser = argparse.ArgumentParser(description="Classify the unique responses of a collector output with an LLM")
+    parser.add_argument("input", help="Collector output (.json / .json.gz / .json.zst)")
+    parser.add_argument("model", nargs="?", default="gpt-4o-mini", help="Classifier model")
+    parser.add_argument("--cache", default="classification_cache.jsonl", help="Classification cache (JSONL, keyed by text hash, model and prompt template)")
+    parser.add_argument("--report", default="classification_report.json", help="Report output path")
+    parser.add_argument("--batch-size", type=int, default=1, help="Texts classified per request (structured JSON output when > 1)")
+    parser.add_argument("--concurrency", type=str, default="10", help="Concurrent requests (integer, or 'auto' for adaptive AIMD control)")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Upper bound for --concurrency auto")
+    args = parser.parse_args()
+    if args.concurrency != "auto":
+        try:
+            args.concurrency = int(args.concurrency)
+        except ValueError:
+            parser.error("--concurrency must be an integer or 'auto'")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    asyncio.run(main(args))
@@ -1,13 +1,18 @@
 import json
 import sys
 import os
+import shutil
+from pathlib import Path
+from collections import Counter
 from collector.aggregator import Aggregator
 from collector.serializer import CollectorOutput
+from collector.graph_export import annotate_edges
+from collector.logprob_store import logprobs_path
+from collector.file_io import load_json, open_text
 
-def compress_existing_json(input_path, output_path, use_bpe=False, vocab_size=1000):
+def compress_existing_json(input_path, output_path, use_bpe=False, vocab_size=1000, bpe_cache="out/bpe_cache"):
     print(f"Loading {input_path}...")
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_json(input_path)
     
     # Pydanticモデルを介して検証しつつロード
     output_obj = CollectorOutput(**data)
@@ -16,20 +21,23 @@ def compress_existing_json(input_path, output_path, use_bpe=False, vocab_size=10
     if use_bpe:
         from collector.bpe_manager import BPEManager
         print(f"Training custom BPE (vocab_size={vocab_size})...")
-        texts = [r.text for r in output_obj.runs if r.status == "ok"]
+        counts = Counter(r.text for r in output_obj.runs if r.status == "ok")
         bpe = BPEManager(vocab_size=vocab_size)
-        bpe.train(texts)
+        # 同じコーパス・語彙サイズで学習済みの語彙があれば再学習しない
+        if bpe.train_or_load(counts, bpe_cache):
+            print(f"Loaded cached BPE vocabulary from {bpe_cache}")
         print("Building token-level Trie...")
-        for text in texts:
-            tokens = bpe.tokenize(text)
-            aggregator.add_tokens(tokens)
+        # ユニークなテキストをまとめてトークン化し、出現回数を重みとして挿入
+        unique_texts = list(counts)
+        for text, tokens in zip(unique_texts, bpe.tokenize_batch(unique_texts)):
+            aggregator.add_tokens(tokens, counts[text])
     else:
         print("Building character-level Trie and compressing paths...")
-        runs_data = [r.model_dump() for r in output_obj.runs]
-        aggregator.load_from_runs(runs_data)
+        aggregator.add_many(r.text for r in output_obj.runs if r.status == "ok")
     
     # パス圧縮を適用 (BPEの場合も分岐があればさらに圧縮可能)
     new_nodes, new_edges = aggregator.get_compressed_graph_data()
+    new_edges = list(annotate_edges(new_edges))
     
     print(f"Original edges: {len(data['graph']['edges'])}")
     print(f"Compressed edges: {len(new_edges)}")
@@ -41,7 +49,17 @@ def compress_existing_json(input_path, output_path, use_bpe=False, vocab_size=10
     dirname = os.path.dirname(output_path)
     if dirname:
         os.makedirs(dirname, exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
+    
+    # logprobs のサイドカーは出力ファイル名に合わせて隣へコピーする
+    if output_obj.meta.logprobs_file:
+        source = Path(input_path).parent / output_obj.meta.logprobs_file
+        sidecar = logprobs_path(output_path)
+        if source.resolve() != sidecar.resolve():
+            shutil.copyfile(source, sidecar)
+        data["meta"]["logprobs_file"] = sidecar.name
+    
+    # 出力の拡張子が .json.gz / .json.zst なら圧縮して書く
+    with open_text(output_path, "w") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
     
     print(f"Saved compressed JSON to {output_path}")
@@ -53,6 +71,7 @@ if __name__ == "__main__":
     parser.add_argument("output", help="Output JSON path")
     parser.add_argument("--bpe", action="store_true", help="Use custom BPE compression")
     parser.add_argument("--vocab", type=int, default=1000, help="BPE vocabulary size")
+    parser.add_argument("--bpe-cache", default="out/bpe_cache", help="Directory of trained BPE vocabularies (keyed by corpus fingerprint and vocab size)")
     args = parser.parse_args()
 
-    compress_existing_json(args.input, args.output, use_bpe=args.bpe, vocab_size=args.vocab)
+    compress_existing_json(args.input, args.output, use_bpe=args.bpe, vocab_size=args.vocab, bpe_cache=args.bpe_cache)
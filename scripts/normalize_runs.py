@@ -0,0 +1,107 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import List, Optional
+from collector.aggregator import Aggregator
+from collector.file_io import load_json, open_text
+from collector.graph_export import export_graph
+from collector.logprob_store import logprobs_path
+from collector.normalization import RULES, Normalizer, normalization_config
+from collector.serializer import CollectorOutput, write_output_json
+
+def normalize_run_file(input_path: str, output_path: Optional[str], rules: List[str], compress: bool = False) -> dict:
+    """
+    既存の出力ファイルの run を正規化し直し、Trie を作り直して書き出す（output_path が None なら計測だけ）。
+    既に正規化済みのファイルは raw_text（元の応答）から正規化し直す。
+    正規化前後のユニークなテキスト数と Trie のノード数を返す。
+    入力ファイルへの上書きは拒否する（同じハッシュの trie-{hash}.bin / runs-{hash}.jsonl は正規化前のままなので、
+    次のレジュームで正規化前の集計と混ざる）。
+    """
+    if output_path is not None and Path(output_path).resolve() == Path(input_path).resolve():
+        raise ValueError("refusing to overwrite the input in place; write the normalized output to another directory")
+    output_obj = CollectorOutput(**load_json(input_path))
+    config = normalization_config(rules)
+    normalize = Normalizer(config)
+
+    runs = []
+    before = Aggregator()
+    after = Aggregator()
+    raw_texts = []
+    texts = []
+    for run in output_obj.runs:
+        r = run.model_dump()
+        raw = r["raw_text"] if r["raw_text"] is not None else r["text"]
+        text = normalize(raw)
+        r["text"], r["raw_text"] = text, (raw if text != raw else None)
+        runs.append(r)
+        if r["status"] == "ok":
+            raw_texts.append(raw)
+            texts.append(text)
+    before.add_many(raw_texts)
+    after.add_many(texts)
+
+    result = {
+        "input": str(input_path),
+        "ok_runs": len(texts),
+        "unique_before": len(set(raw_texts)),
+        "unique_after": len(set(texts)),
+        "nodes_before": len(before.nodes),
+        "nodes_after": len(after.nodes),
+    }
+    if output_path is None:
+        return result
+
+    dirname = os.path.dirname(output_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    meta = output_obj.meta
+    # logprobs のサイドカーは出力ファイル名に合わせて隣へコピーする
+    if meta.logprobs_file:
+        source = Path(input_path).parent / meta.logprobs_file
+        sidecar = logprobs_path(output_path)
+        if source.resolve() != sidecar.resolve():
+            shutil.copyfile(source, sidecar)
+        meta = meta.model_copy(update={"logprobs_file": sidecar.name})
+    nodes, edges = export_graph(after, compress, output_obj.config.graph)
+    with open_text(output_path, "w") as f:
+        write_output_json(
+            f, meta, output_obj.config.model_copy(update={"normalization": config}), runs, nodes, edges,
+            after.calculate_stats()["depth_stats"], convergence=output_obj.stats.convergence
+        )
+    return result
+
+def _ratio(after: int, before: int) -> str:
+    return f"{after / before:.1%}" if before else "-"
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Re-normalize the runs of existing collector outputs and rebuild their graphs")
+    parser.add_argument("inputs", nargs="+", help="Collector outputs (.json / .json.gz / .json.zst)")
+    parser.add_argument("--out-dir", default="out/normalized", help="Directory for the normalized outputs (same file names; must differ from the inputs' directory)")
+    parser.add_argument("--rules", nargs="*", choices=RULES, metavar="RULE", default=[], help=f"Rules to apply (default: nfkc punctuation whitespace strip; available: {', '.join(RULES)})")
+    parser.add_argument("--compress", action="store_true", help="Write a path-compressed graph")
+    parser.add_argument("--dry-run", action="store_true", help="Only measure how much normalization shrinks the data")
+    args = parser.parse_args()
+
+    totals = {"unique_before": 0, "unique_after": 0, "nodes_before": 0, "nodes_after": 0}
+    for input_path in args.inputs:
+        output_path = None if args.dry_run else os.path.join(args.out_dir, os.path.basename(input_path))
+        try:
+            result = normalize_run_file(input_path, output_path, args.rules, compress=args.compress)
+        except (OSError, ValueError) as e:
+            print(f"Error: {input_path}: {e}", file=sys.stderr)
+            continue
+        for key in totals:
+            totals[key] += result[key]
+        print(
+            f"{input_path}: {result['ok_runs']} runs, "
+            f"unique texts {result['unique_before']} -> {result['unique_after']} ({_ratio(result['unique_after'], result['unique_before'])}), "
+            f"trie nodes {result['nodes_before']} -> {result['nodes_after']} ({_ratio(result['nodes_after'], result['nodes_before'])})"
+            + (f" -> {output_path}" if output_path else "")
+        )
+    if len(args.inputs) > 1:
+        print(
+            f"Total: unique texts {totals['unique_before']} -> {totals['unique_after']} ({_ratio(totals['unique_after'], totals['unique_before'])}), "
+            f"trie nodes {totals['nodes_before']} -> {totals['nodes_after']} ({_ratio(totals['nodes_after'], totals['nodes_before'])})"
+        )
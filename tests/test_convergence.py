@@ -0,0 +1,35 @@
+import pytest
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.convergence import ConvergenceMonitor
+from collector.radix_aggregator import RadixAggregator
+from collector.serializer import ConvergenceConfig
+
+TEXTS = ["札幌", "札幌", "札幌市", "東京", "", "東京都", "札幌"]
+
+@pytest.mark.parametrize("cls", [Aggregator, ArrayAggregator, RadixAggregator])
+def test_prime_from_trie_matches_prime(cls):
+    config = ConvergenceConfig(criteria=["topk", "rare"], branch="札幌")
+    aggregator = cls()
+    aggregator.add_many(TEXTS)
+
+    expected = ConvergenceMonitor(config, aggregator)
+    expected.prime(TEXTS)
+    monitor = ConvergenceMonitor(config, aggregator)
+    monitor.prime_from_trie(len(TEXTS))
+
+    assert monitor.n == expected.n
+    assert monitor.answers == expected.answers
+    assert monitor.branch_hits == expected.branch_hits
+
+def test_summary_reports_samples_at_last_check():
+    config = ConvergenceConfig(criteria=["topk"], interval=3, min_samples=1)
+    monitor = ConvergenceMonitor(config, Aggregator())
+    for text in TEXTS:
+        monitor.observe(text)
+        monitor.should_stop()
+    summary = monitor.summary()
+    assert monitor.n == 7
+    assert summary["checks"] == 2
+    assert summary["samples"] == 6
+    assert set(summary["criteria"]) == {"topk"}
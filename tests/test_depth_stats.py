@@ -0,0 +1,67 @@
+import math
+import pytest
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+
+AGGREGATORS = [Aggregator, ArrayAggregator, RadixAggregator]
+
+TEXTS = ["札幌", "札幌市", "札幌", "東京", "東京都", "", "大阪", "札幌市です", "東京"]
+
+def assert_stats_match(aggregator):
+    """挿入時に更新した統計が、Trie の全走査による再計算と一致する"""
+    incremental = aggregator.calculate_stats()["depth_stats"]
+    recalculated = aggregator.recalculate_stats()["depth_stats"]
+    assert len(incremental) == len(recalculated)
+    for inc, rec in zip(incremental, recalculated):
+        assert {**inc, "entropy_bits": None} == {**rec, "entropy_bits": None}
+        assert math.isclose(inc["entropy_bits"], rec["entropy_bits"], rel_tol=1e-9, abs_tol=1e-12)
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_add_text(cls):
+    aggregator = cls()
+    for text in TEXTS:
+        aggregator.add_text(text)
+    assert_stats_match(aggregator)
+    assert aggregator.calculate_stats()["depth_stats"][0]["total_transitions"] == 8
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_weights_and_add_many(cls):
+    weighted = cls()
+    weighted.add_text("札幌", 3)
+    weighted.add_text("東京", 2)
+    weighted.add_tokens(["札", "幌", "市"], 4)
+    assert_stats_match(weighted)
+
+    aggregator = cls()
+    aggregator.add_many(TEXTS)
+    assert_stats_match(aggregator)
+    one_by_one = cls()
+    for text in TEXTS:
+        one_by_one.add_text(text)
+    assert aggregator.calculate_stats() == one_by_one.calculate_stats()
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+@pytest.mark.parametrize("other_cls", AGGREGATORS)
+def test_merge(cls, other_cls):
+    aggregator = cls()
+    aggregator.add_many(TEXTS[:4])
+    other = other_cls()
+    other.add_many(TEXTS[4:])
+    other.add_text("札幌", 5)
+    aggregator.merge(other)
+    assert_stats_match(aggregator)
+
+    expected = cls()
+    expected.add_many(TEXTS[:4])
+    expected.add_many(TEXTS[4:])
+    expected.add_text("札幌", 5)
+    assert aggregator.calculate_stats() == expected.calculate_stats()
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_tokens(cls):
+    aggregator = cls()
+    aggregator.add_tokens(["札幌", "市"], 2)
+    aggregator.add_tokens(["札", "幌"])
+    aggregator.add_tokens(["東京", "都", "庁"], 3)
+    assert_stats_match(aggregator)
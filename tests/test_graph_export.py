@@ -0,0 +1,84 @@
+import pytest
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.graph_export import OTHER_LABEL, export_graph, level_of_detail, prune_graph
+from collector.radix_aggregator import RadixAggregator
+from collector.serializer import GraphExportConfig
+
+AGGREGATORS = [Aggregator, ArrayAggregator, RadixAggregator]
+
+TEXTS = ["札幌", "札幌市", "札幌", "東京", "東京都", "", "大阪", "札幌市です", "東京", "名古屋", "札幌"]
+TOKENS = [["札幌", "市"], ["札幌", "市"], ["札幌"], ["東京", "都"], ["東京"], ["大阪", "府", "です"]]
+
+def build(cls, tokens=False):
+    aggregator = cls()
+    if tokens:
+        for t in TOKENS:
+            aggregator.add_tokens(t)
+    else:
+        aggregator.add_many(TEXTS)
+    return aggregator
+
+def assert_mass_conserved(original_edges, nodes, edges):
+    """残した親から出る回数の合計（"other" を含む）は、元のグラフでの合計と一致する"""
+    totals = {}
+    for e in original_edges:
+        totals[e["from"]] = totals.get(e["from"], 0) + e["count"]
+    kept = {}
+    for e in edges:
+        kept[e["from"]] = kept.get(e["from"], 0) + e["count"]
+    for parent, count in kept.items():
+        assert count == totals[parent]
+    assert len({n["id"] for n in nodes}) == len(nodes)
+    assert {e["to"] for e in edges} <= {n["id"] for n in nodes}
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("config", [
+    GraphExportConfig(top_k=1),
+    GraphExportConfig(min_count=2),
+    GraphExportConfig(min_p=0.3, max_depth=2),
+])
+def test_prune_conserves_mass(cls, compress, config):
+    aggregator = build(cls)
+    original = list(aggregator.iter_compressed_edges() if compress else aggregator.iter_edges())
+    nodes, edges = export_graph(aggregator, compress, config)
+    assert any(e["ch"] == OTHER_LABEL for e in edges)
+    assert_mass_conserved(original, nodes, edges)
+    for e in edges:
+        assert e["p"] == pytest.approx(e["count"] / sum(x["count"] for x in edges if x["from"] == e["from"]))
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_level_of_detail_conserves_mass(cls):
+    aggregator = build(cls)
+    nodes, edges = level_of_detail(aggregator.iter_edges, 4)
+    assert len(nodes) == 5 + sum(1 for e in edges if e["ch"] == OTHER_LABEL)
+    assert_mass_conserved(list(aggregator.iter_edges()), nodes, edges)
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_export_compressed_streams_same_graph(cls):
+    aggregator = build(cls)
+    expected_nodes, expected_edges = aggregator.get_compressed_graph_data()
+    nodes, edges = export_graph(aggregator, compress=True)
+    assert list(nodes) == expected_nodes
+    assert [{k: e[k] for k in ("from", "to", "ch", "count")} for e in edges] == expected_edges
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+@pytest.mark.parametrize("compress", [False, True])
+def test_prune_depth_counts_tokens(cls, compress):
+    """トークン単位のグラフでは、深さはラベルの文字数ではなくトークン数で数える"""
+    aggregator = build(cls, tokens=True)
+    depths = {n["id"]: n["depth"] for n in aggregator.iter_nodes()}
+    nodes, edges = export_graph(aggregator, compress, GraphExportConfig(max_depth=1, top_k=1))
+    by_id = {n["id"]: n["depth"] for n in nodes}
+    for e in edges:
+        if e["ch"] == OTHER_LABEL:
+            assert by_id[e["to"]] == 1
+        else:
+            assert by_id[e["to"]] == depths[e["to"]]
+    # 根の子（深さ1）は残り、その先は展開しない
+    assert {e["from"] for e in edges} == {0}
+    # ファイルから読んだエッジ（depth なし）でも depths を渡せば同じ結果になる
+    plain = [{k: e[k] for k in ("from", "to", "ch", "count")}
+             for e in (aggregator.iter_compressed_edges() if compress else aggregator.iter_edges())]
+    assert prune_graph(plain, GraphExportConfig(max_depth=1, top_k=1), depths) == (nodes, edges)
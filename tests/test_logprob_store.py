@@ -0,0 +1,40 @@
+from pathlib import Path
+from collector.logprob_store import LogprobTable, logprobs_path
+
+# float32 で誤差なく表せる値にして、読み戻した値をそのまま比較する
+RUNS = [
+    {"logprobs": [
+        {"token": "札", "logprob": -0.5, "bytes": list("札".encode("utf-8")), "top_logprobs": [
+            {"token": "札", "logprob": -0.5, "bytes": list("札".encode("utf-8"))},
+            {"token": "東", "logprob": -1.25, "bytes": None},
+        ]},
+        {"token": "幌", "logprob": -0.125, "bytes": list("幌".encode("utf-8")), "top_logprobs": []},
+    ]},
+    {"logprobs": None},
+    {"logprobs": []},
+    {"logprobs": [{"token": "東", "logprob": -2.0, "bytes": None, "top_logprobs": []}]},
+]
+
+def test_round_trip(tmp_path):
+    table = LogprobTable.from_runs(RUNS)
+    path = tmp_path / "run.logprobs.bin"
+    table.save(path)
+
+    loaded = LogprobTable.load(path)
+    assert len(loaded) == len(RUNS)
+    for row, run in enumerate(RUNS):
+        assert loaded.dicts(row) == table.dicts(row) == run["logprobs"]
+    assert loaded.content(1) is None
+    assert loaded.content(0)[0].top_logprobs[1].token == "東"
+    # トークン辞書は (文字列, bytes) ごとに1回だけ保存される
+    assert len(loaded.tokens) == 3
+
+def test_load_missing_or_foreign(tmp_path):
+    assert LogprobTable.load(tmp_path / "missing.bin") is None
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a logprob table")
+    assert LogprobTable.load(path) is None
+
+def test_logprobs_path():
+    assert logprobs_path("out/run-x.json") == Path("out/run-x.logprobs.bin")
+    assert logprobs_path("out/run-x.json.gz") == Path("out/run-x.logprobs.bin")
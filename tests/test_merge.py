@@ -0,0 +1,57 @@
+import math
+import random
+import pytest
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+from collector.snapshot import load_snapshot, save_snapshot
+
+AGGREGATORS = [Aggregator, ArrayAggregator, RadixAggregator]
+
+def make_texts(n=300, seed=0):
+    rng = random.Random(seed)
+    heads = ["札幌", "札幌市", "北海道", "東京", ""]
+    return [rng.choice(heads) + "".join(rng.choice("市ですね。") for _ in range(rng.randint(0, 4))) for _ in range(n)]
+
+def assert_same(merged, single):
+    """シャードをマージした結果が、全テキストを1プロセスで挿入した結果とグラフ・統計まで一致する"""
+    assert merged.get_graph_data() == single.get_graph_data()
+    assert merged.get_compressed_graph_data() == single.get_compressed_graph_data()
+    assert merged.depth_stats.char_counts == single.depth_stats.char_counts
+    merged_stats = merged.calculate_stats()["depth_stats"]
+    single_stats = single.calculate_stats()["depth_stats"]
+    assert len(merged_stats) == len(single_stats)
+    for m, s in zip(merged_stats, single_stats):
+        assert {**m, "entropy_bits": None} == {**s, "entropy_bits": None}
+        assert math.isclose(m["entropy_bits"], s["entropy_bits"], rel_tol=1e-9, abs_tol=1e-12)
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+@pytest.mark.parametrize("shards", [1, 3, 7])
+def test_merged_shards_match_single_process(cls, shards):
+    texts = make_texts()
+    single = cls()
+    single.add_many(texts)
+
+    # --shard I/K と同じく、試行を K 個の連続した区間に分けてそれぞれ集計する
+    size = -(-len(texts) // shards)
+    merged = cls()
+    for i in range(shards):
+        shard = cls()
+        shard.add_many(texts[i * size:(i + 1) * size])
+        merged.merge(shard)
+    assert_same(merged, single)
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_merge_shards_restored_from_snapshots(tmp_path, cls):
+    texts = make_texts(seed=1)
+    single = cls()
+    single.add_many(texts)
+
+    merged = cls()
+    for i, chunk in enumerate((texts[:100], texts[100:120], texts[120:])):
+        shard = cls()
+        shard.add_many(chunk)
+        save_snapshot(shard, tmp_path / f"trie-{i}.bin", {"ok_runs": len(chunk)})
+        restored, _ = load_snapshot(tmp_path / f"trie-{i}.bin", cls)
+        merged.merge(restored)
+    assert_same(merged, single)
@@ -0,0 +1,56 @@
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+import pytest
+
+AGGREGATORS = [Aggregator, ArrayAggregator, RadixAggregator]
+
+def _token_index(cls):
+    aggregator = cls()
+    aggregator.add_tokens(["a", "b", "x"], 5)
+    aggregator.add_tokens(["ab", "y"], 3)
+    return aggregator.index()
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_prefix_count_sums_siblings_sharing_a_first_character(cls):
+    index = _token_index(cls)
+    assert index.total == 8
+    assert index.prefix_count("a") == 8
+    assert index.prefix_count("ab") == 8
+    assert index.prefix_count("abx") == 5
+    assert index.prefix_count("aby") == 3
+    assert index.prefix_count("abz") == 0
+    assert index.prefix_probability("ab") == 1.0
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_top_paths_and_continuations_cover_every_matching_sibling(cls):
+    index = _token_index(cls)
+    assert [(p["text"], p["count"]) for p in index.top_paths(5, "ab")] == [("abx", 5), ("aby", 3)]
+    continuations = {c["text"]: c["count"] for c in index.continuations("ab", None)}
+    assert continuations == {"x": 5, "y": 3}
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_rare_paths_cover_every_matching_sibling(cls):
+    index = _token_index(cls)
+    rare = list(index.rare_paths(0.5, "ab"))
+    # 圧縮の有無で報告される接頭辞の長さは変わるが、稀なのは "ab" + "y" の枝だけ
+    assert [(r["count"], r["complete"]) for r in rare] == [(3, False)]
+    assert "aby".startswith(rare[0]["text"])
+
+def test_character_trie_queries():
+    aggregator = Aggregator()
+    aggregator.add_many(["札幌", "札幌", "札幌市", "東京"])
+    index = aggregator.index()
+    assert index.prefix_count("札") == 3
+    assert index.path(index.node_id("札幌")) == "札幌"
+    assert index.continuations("札幌") == [
+        {"text": "", "count": 2, "p": 2 / 3, "end": True},
+        {"text": "市", "count": 1, "p": 1 / 3, "end": False},
+    ]
+    assert [p["text"] for p in index.top_paths(2)] == ["札幌", "札幌市"]
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_answers(cls):
+    aggregator = cls()
+    aggregator.add_many(["札幌", "札幌", "札幌市", "東京", ""])
+    assert sorted(aggregator.index().answers()) == [("札幌", 2), ("札幌市", 1), ("東京", 1)]
@@ -0,0 +1,42 @@
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+from collector.snapshot import load_snapshot, save_snapshot
+
+def _token_trie(cls, *sequences):
+    aggregator = cls()
+    for tokens in sequences:
+        aggregator.add_tokens(tokens)
+    return aggregator
+
+def test_token_arrays_round_trip_keeps_node_ids():
+    radix = _token_trie(RadixAggregator, ["ab", "c"], ["ab", "d"])
+    restored = RadixAggregator.from_arrays(*radix.export_arrays())
+
+    assert restored.get_graph_data() == radix.get_graph_data()
+    assert restored.get_compressed_graph_data() == radix.get_compressed_graph_data()
+    assert all(edge["from"] != edge["to"] for edge in restored.iter_edges())
+    assert restored.get_compressed_graph_data()[1][0] == {"from": 0, "to": 1, "ch": "ab", "count": 2}
+
+def test_token_snapshot_round_trip(tmp_path):
+    radix = _token_trie(RadixAggregator, ["ab", "c", "de"], ["ab", "c", "f"], ["x"])
+    path = tmp_path / "trie-test.bin"
+    save_snapshot(radix, path, {})
+    restored, _ = load_snapshot(path, RadixAggregator)
+
+    assert restored.get_graph_data() == radix.get_graph_data()
+    assert restored.get_compressed_graph_data() == radix.get_compressed_graph_data()
+    # 復元後も続けて挿入できる
+    restored.add_tokens(["ab", "c", "de"])
+    radix.add_tokens(["ab", "c", "de"])
+    assert restored.get_graph_data() == radix.get_graph_data()
+
+def test_token_merge_matches_array_aggregator():
+    left = [["ab", "c"], ["ab", "d"]]
+    right = [["ab", "d", "e"], ["xy"]]
+    radix = _token_trie(RadixAggregator, *left)
+    radix.merge(_token_trie(RadixAggregator, *right))
+    expected = _token_trie(ArrayAggregator, *left, *right)
+
+    assert radix.get_graph_data() == expected.get_graph_data()
+    assert radix.get_compressed_graph_data() == expected.get_compressed_graph_data()
+    assert len(radix) == len(expected)
@@ -0,0 +1,33 @@
+import asyncio
+from collector.backends import MockBackend
+from collector.rate_control import AdaptiveLimiter
+from collector.runner import Runner
+
+def _runner(**kwargs) -> Runner:
+    return Runner(
+        client=None, model="mock", prompt="Hi", n=50, concurrency=4, request_params={"max_tokens": 10},
+        backend=MockBackend(latency=0.0, latency_sigma=0.0, rate_5xx=0.2, seed=0), **kwargs
+    )
+
+def test_run_returns_sorted_results():
+    results = asyncio.run(_runner().run())
+    assert [r["id"] for r in results] == list(range(50))
+
+def test_run_without_keeping_results_returns_counts():
+    completed = []
+    checkpoints = []
+    summary = asyncio.run(_runner(
+        keep_results=False, on_complete=completed.append, on_checkpoint=checkpoints.append, checkpoint_interval=10
+    ).run())
+    ok = sum(1 for r in completed if r["status"] == "ok")
+    assert summary == {"completed": 50, "ok": ok, "error": 50 - ok}
+    assert 0 < ok < 50
+    assert checkpoints == [[]] * 5
+
+def test_limiter_history_is_bounded():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1000, history_size=8)
+    for _ in range(2000):
+        limiter.on_success(0.01)
+    summary = limiter.summary()
+    assert len(summary["history"]) == 8
+    assert summary["peak"] == limiter.limit > 8
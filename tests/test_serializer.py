@@ -0,0 +1,57 @@
+import io
+from datetime import datetime
+import pytest
+from collector.aggregator import Aggregator
+from collector.graph_export import annotate_edges
+from collector.serializer import (
+    CollectorOutput, ConfigInfo, ErrorInfo, GraphInfo, MetaInfo, NormalizationConfig, RequestConfig, RunResult,
+    write_output_json
+)
+
+META = MetaInfo(
+    run_id="20260101-000000", created_at=datetime(2026, 1, 1, 12, 34, 56, 789000),
+    library={"python": "3.13"}, host={"os": "linux"}, concurrency={"mode": "auto", "history": [[0.0, 4]]},
+    metrics={"latency": {"p50": 0.25}}
+)
+CONFIG = ConfigInfo(
+    model="mock", prompt="北海道の県庁所在地は？", n=8, concurrency=4,
+    request=RequestConfig(max_output_tokens=50, temperature=1.0, stream=True),
+    normalization=NormalizationConfig(enabled=True, rules={"nfkc": True})
+)
+
+RUNS = [
+    {"id": 7, "text": "札幌市です", "status": "ok", "usage": {"prompt_tokens": 12, "completion_tokens": 5}},
+    {"id": 3, "text": "札幌", "raw_text": "札幌 ", "status": "ok", "time_to_first_token": 1.5e-06},
+    {"id": 0, "text": "", "status": "error", "error": {"type": "APIError", "message": "boom \"quoted\"", "http_status": 503}},
+    {"id": 1, "text": "", "status": "error", "error": {"type": "TimeoutError", "message": "timed out", "http_status": None}},
+    {"id": 2, "text": "改行\nタブ\t制御\x01\\ と 😀", "status": "ok", "time_to_first_token": 0.00001234,
+     "usage": {"prompt_tokens": 3, "completion_tokens": None}},
+    {"id": 5, "text": "札幌", "status": "ok", "time_to_first_token": 123456789.125,
+     "logprobs": [{"token": "札幌", "logprob": -0.1, "bytes": [1, 2], "top_logprobs": [{"token": "東", "logprob": -2.5e-7}]}]},
+]
+
+@pytest.mark.parametrize("convergence", [None, {"converged": True, "samples": 6, "criteria": {"topk": {"max": 0.125}}}])
+def test_matches_model_dump_json(convergence):
+    aggregator = Aggregator()
+    aggregator.add_many(r["text"] for r in RUNS if r["status"] == "ok")
+    edges = list(annotate_edges(aggregator.iter_edges()))
+    depth_stats = aggregator.calculate_stats()["depth_stats"]
+
+    buf = io.StringIO()
+    stats = write_output_json(
+        buf, META, CONFIG, iter(RUNS), aggregator.iter_nodes(), iter(edges), depth_stats, convergence=convergence
+    )
+
+    # run の id は出力順に振り直される
+    runs = [
+        RunResult(**{**r, "id": i, "error": ErrorInfo(**r["error"]) if r.get("error") else None})
+        for i, r in enumerate(RUNS)
+    ]
+    expected = CollectorOutput(
+        meta=META, config=CONFIG, runs=runs,
+        graph=GraphInfo(nodes=list(aggregator.iter_nodes()), edges=edges),
+        stats=stats
+    ).model_dump_json(by_alias=True)
+    assert buf.getvalue() == expected
+    assert stats.totals == {"ok": 4, "error": 2, "total_chars": sum(len(r["text"]) for r in RUNS)}
+    assert stats.convergence == convergence
@@ -0,0 +1,54 @@
+import pytest
+from collector.aggregator import Aggregator
+from collector.array_aggregator import ArrayAggregator
+from collector.radix_aggregator import RadixAggregator
+from collector.snapshot import MAGIC, load_snapshot, save_snapshot
+
+AGGREGATORS = [Aggregator, ArrayAggregator, RadixAggregator]
+
+TEXTS = ["札幌", "札幌市", "札幌", "東京", "東京都", "", "大阪", "札幌市です", "東京"]
+
+def edges(aggregator):
+    return sorted((e["ch"], e["count"]) for e in aggregator.iter_edges())
+
+@pytest.mark.parametrize("cls", AGGREGATORS)
+def test_round_trip(tmp_path, cls):
+    aggregator = cls()
+    aggregator.add_many(TEXTS)
+    path = tmp_path / "trie.bin"
+    info = {"ok_runs": len(TEXTS), "log_offset": 123, "next_id": 10}
+    save_snapshot(aggregator, path, info)
+
+    restored, restored_info = load_snapshot(path, cls)
+    assert restored_info == info
+    assert edges(restored) == edges(aggregator)
+    assert restored.calculate_stats() == aggregator.calculate_stats()
+
+@pytest.mark.parametrize("cut", [4, 20, -30, -3, -1])
+def test_truncated(tmp_path, cut):
+    aggregator = Aggregator()
+    aggregator.add_many(TEXTS)
+    path = tmp_path / "trie.bin"
+    save_snapshot(aggregator, path, {"ok_runs": len(TEXTS)})
+    data = path.read_bytes()
+    path.write_bytes(data[:cut])
+    assert load_snapshot(path, Aggregator) is None
+
+def test_corrupted(tmp_path):
+    aggregator = Aggregator()
+    aggregator.add_many(TEXTS)
+    path = tmp_path / "trie.bin"
+    save_snapshot(aggregator, path, {"ok_runs": len(TEXTS)})
+    data = path.read_bytes()
+
+    path.write_bytes(b"XXXXXXXX" + data[len(MAGIC):])
+    assert load_snapshot(path, Aggregator) is None
+    path.write_bytes(data + b"\0")
+    assert load_snapshot(path, Aggregator) is None
+    # ヘッダ JSON の先頭を壊す
+    path.write_bytes(data[:len(MAGIC) + 4] + b"#" + data[len(MAGIC) + 5:])
+    assert load_snapshot(path, Aggregator) is None
+    # 末尾のラベル（UTF-8 の多バイト文字）を壊す
+    path.write_bytes(data[:-1] + b"\xff")
+    assert load_snapshot(path, Aggregator) is None
+    assert load_snapshot(tmp_path / "missing.bin", Aggregator) is None
@@ -0,0 +1,26 @@
+import argparse
+import json
+import pytest
+from collector.cache_manager import calculate_prompt_hash
+from collector.sweep import load_sweep
+
+BASE = argparse.Namespace(prompt=None, model="gpt-4.1-mini", temp=1.0, max_tokens=50, n=10, choices_per_request=1, debug=False)
+
+def _write(tmp_path, spec):
+    path = tmp_path / "sweep.json"
+    path.write_text(json.dumps(spec), encoding="utf-8")
+    return path
+
+def test_numeric_values_are_normalized(tmp_path):
+    configs = load_sweep(_write(tmp_path, {"matrix": {"temp": [1, 0.5]}, "prompt": "Hi", "n": 100.0}), BASE)
+    assert [c.temp for c in configs] == [1.0, 0.5]
+    assert all(isinstance(c.temp, float) and isinstance(c.n, int) for c in configs)
+
+def test_int_and_float_temp_share_a_hash():
+    config = {"model": "m", "prompt": "Hi", "max_tokens": 50, "debug": False}
+    assert calculate_prompt_hash({**config, "temp": 1}) == calculate_prompt_hash({**config, "temp": 1.0})
+
+@pytest.mark.parametrize("spec", [{"n": 10.5}, {"temp": "hot"}, {"max_tokens": True}])
+def test_invalid_numbers_are_rejected(tmp_path, spec):
+    with pytest.raises(ValueError):
+        load_sweep(_write(tmp_path, {"prompt": "Hi", **spec}), BASE)